@@ -0,0 +1,104 @@
+"""Compare the latency of cheap requests queued behind slow GetCoverage requests in the sync and async views
+
+Usage:
+    python -m benchmarks.bench_async --workers 4 --coverages 8 --capabilities 200 --read-latency 0.05
+
+All requests arrive at once. The sync path serves them with a pool of --workers threads, like a threaded WSGI
+server, so GetCapabilities requests wait for a free worker behind the GetCoverage requests. The async path sends
+every request through Django's ASGI handler on one event loop: cached documents are served on the loop and
+GetCoverage requests run in the coverage pool of --workers threads. Latencies include the time queued. The async
+view requires Django 4.1 or later.
+
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _timed(view, request, submitted):
+    view(request)
+    return time.perf_counter() - submitted
+
+
+async def _timed_async(request, submitted):
+    await request
+    return time.perf_counter() - submitted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=300, help="Width and height of the synthetic product.")
+    parser.add_argument('--workers', type=int, default=4, help="Sync worker threads and async coverage threads.")
+    parser.add_argument('--coverages', type=int, default=8, help="Concurrent GetCoverage requests.")
+    parser.add_argument('--capabilities', type=int, default=200, help="Concurrent GetCapabilities requests.")
+    parser.add_argument('--read-latency', type=float, default=0.05, help="Seconds added to every band read.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import RequestFactory
+    from django.views import View
+
+    if not hasattr(View, 'view_is_async'):
+        print("The async view requires Django 4.1 or later.")
+        return 1
+    from django.core.handlers.asgi import ASGIHandler
+
+    from data_cube_wcs import views
+    from . import fake_datacube, harness
+
+    # the app's urls serve the async view, the sync path calls the WebService view directly
+    settings.WCS_ASYNC_VIEWS = True
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=5,
+                                             read_latency=args.read_latency)
+    harness.setup_environment([product])
+    settings.WCS_ASYNC_COVERAGE_THREADS = args.workers
+    # direct reads skip the synthetic read latency
+    settings.WCS_DIRECT_READS = False
+
+    factory = RequestFactory()
+    capabilities = {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCapabilities"}
+    coverage = harness.get_coverage_parameters(product, time_depth=3)
+    sync_view = views.WebService.as_view()
+    # render and cache the capabilities document once, as any running server would have
+    sync_view(factory.get("/wcs/", capabilities))
+
+    requests = [('GetCoverage', coverage)] * args.coverages + [('GetCapabilities', capabilities)] * args.capabilities
+
+    results = {}
+    sync_requests = [(operation, factory.get("/wcs/", parameters)) for operation, parameters in requests]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [(operation, executor.submit(_timed, sync_view, request, time.perf_counter()))
+                   for operation, request in sync_requests]
+        results['sync'] = [(operation, future.result()) for operation, future in futures]
+    elapsed = {'sync': time.perf_counter() - started}
+
+    async def run_async(requests):
+        application = ASGIHandler()
+        submitted = time.perf_counter()
+        latencies = await asyncio.gather(*[_timed_async(harness.asgi_get(application, "/wcs/", parameters), submitted)
+                                           for _, parameters in requests])
+        return [(operation, latency) for (operation, _), latency in zip(requests, latencies)]
+
+    started = time.perf_counter()
+    results['async'] = asyncio.run(run_async(requests))
+    elapsed['async'] = time.perf_counter() - started
+
+    for mode in ('sync', 'async'):
+        for operation in ('GetCapabilities', 'GetCoverage'):
+            summary = harness.summarize([latency for name, latency in results[mode] if name == operation])
+            print("{:<6} {:<16} p50 {:>9.1f}ms  p99 {:>9.1f}ms  max {:>9.1f}ms".format(
+                mode, operation, summary['p50_ms'], summary['p99_ms'], summary['max_ms']))
+        print("{:<6} {:.1f} requests/s".format(mode, len(results[mode]) / elapsed[mode]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Measure the import cost of starting the WCS app with python -X importtime
+
+Usage:
+    python -m benchmarks.bench_import_time --top 15 --budget-ms 1000
+
+Startup is django.setup() and loading the url conf, i.e. everything a worker imports before serving GetCapabilities.
+The scientific stack (HEAVY_MODULES) must only be imported once a coverage is requested, so the command exits with
+a non-zero status if startup imports any of it or the total import time exceeds the budget.
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('numpy', 'pandas', 'xarray', 'rasterio', 'datacube', 'scipy', 'dask', 'netCDF4')
+
+STARTUP_SCRIPT = """
+import json, sys
+import django
+django.setup()
+import data_cube_wcs.urls
+print(json.dumps(sorted(module for module in {heavy!r} if module in sys.modules)))
+"""
+
+
+def measure_startup(settings_module='benchmarks.settings'):
+    """Start the app in a fresh interpreter with -X importtime
+
+    Returns:
+        dict with the total import time in ms, the (module, self us, cumulative us) of every reported import and
+        the heavy modules that were imported
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT.format(heavy=HEAVY_MODULES)],
+        cwd=root, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    return {
+        'total_ms': sum(self_us for _, self_us, _ in imports) / 1000,
+        'imports': imports,
+        'heavy_modules': json.loads(result.stdout.strip().splitlines()[-1])
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=15, help="Number of slowest imports to list.")
+    parser.add_argument('--budget-ms', type=float, default=1000)
+    args = parser.parse_args(argv)
+
+    result = measure_startup()
+    for module, self_us, cumulative_us in sorted(result['imports'], key=lambda row: row[2], reverse=True)[:args.top]:
+        print("{:<48} self {:>8.1f}ms  cumulative {:>8.1f}ms".format(module, self_us / 1000, cumulative_us / 1000))
+    print("total import time: {:.1f}ms (budget {:.0f}ms)".format(result['total_ms'], args.budget_ms))
+    if result['heavy_modules']:
+        print("heavy modules imported at startup: {}".format(", ".join(result['heavy_modules'])))
+    return 1 if result['heavy_modules'] or result['total_ms'] > args.budget_ms else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
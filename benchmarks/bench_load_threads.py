@@ -0,0 +1,63 @@
+"""Benchmark the scaling of GetCoverage loads with the number of read threads
+
+Usage:
+    python -m benchmarks.bench_load_threads --threads 1,2,4,8 --read-latency 0.02
+
+Each scenario is a time range request over every band of a multi-scene product, so a single batch is split into a
+read per band and scene. The read latency emulates network or object storage, where reads are latency rather than
+throughput bound. WCS_IO_CONCURRENCY is raised above the largest thread count unless --io-concurrency is given.
+
+"""
+import argparse
+import os
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=500, help="Width and height of the synthetic product.")
+    parser.add_argument('--times', type=int, default=20, help="Number of acquisitions in the time range.")
+    parser.add_argument('--storage', default='geotiff', choices=('geotiff', 'netcdf'))
+    parser.add_argument('--read-latency', type=float, default=0.02, help="Seconds added to every band read.")
+    parser.add_argument('--threads', default="1,2,4,8", help="WCS_LOAD_THREADS values to compare.")
+    parser.add_argument('--io-concurrency', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=4, help="WCS_MOSAIC_BATCH_SIZE.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import Client
+
+    from data_cube_wcs import utils
+    from . import fake_datacube, harness
+
+    # every pixel is missing from some scene so the mosaic never completes early
+    product = fake_datacube.SyntheticProduct(
+        "ls8_synthetic", width=args.size, height=args.size, times=args.times, storage=args.storage,
+        nodata_fraction=0.9, read_latency=args.read_latency)
+    harness.setup_environment([product])
+    client = Client()
+
+    thread_counts = [int(thread_count) for thread_count in args.threads.split(",")]
+    settings.WCS_IO_CONCURRENCY = args.io_concurrency or max(thread_counts)
+    settings.WCS_MOSAIC_BATCH_SIZE = args.batch_size
+    utils._io_semaphore = None
+
+    parameters = harness.get_coverage_parameters(product, bbox_fraction=0.5, time_depth=args.times)
+    baseline = None
+    for thread_count in thread_counts:
+        settings.WCS_LOAD_THREADS = thread_count
+        result = harness.run_scenario(client, parameters, repeat=args.repeat)
+        baseline = baseline or result['p50_ms']
+        print("threads={:<3} p50 {:>9.1f}ms  p95 {:>9.1f}ms  speedup {:>5.2f}x  peak {:>8.1f}MB  [{}]".format(
+            thread_count, result['p50_ms'], result['p95_ms'], baseline / result['p50_ms'],
+            result['peak_memory_bytes'] / 2**20, result['status']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Compare the peak resident memory of a worker serving concurrent large GetCoverage requests with and without a
+memory budget
+
+Usage:
+    python -m benchmarks.bench_memory --size 1500 --concurrency 6 --budget-mb 400
+
+Every mode runs in a fresh interpreter that writes the synthetic product, then serves --concurrency whole product
+requests at once from as many threads. The peak resident memory while serving is reported with the latency of the
+requests, the requests rejected with a 503 and the calibration learned from the stage samples.
+
+glibc gives every thread its own malloc arena and keeps the memory freed in them, so the resident memory of a
+threaded worker creeps up to the peak of every thread however its requests are admitted. Workers are run with
+MALLOC_ARENA_MAX set to --malloc-arenas (default 2, 0 for the glibc default).
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _run_worker(size, concurrency, budget):
+    """Serve concurrent requests in this process, returning the peak resident memory, latencies and statuses"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import Client
+
+    from data_cube_wcs import memory
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=size, height=size, times=3)
+    harness.setup_environment([product])
+    parameters = harness.get_coverage_parameters(product, "GeoTIFF", bbox_fraction=1.0, time_depth=3)
+    settings.WCS_MEMORY_BUDGET = budget
+    settings.WCS_MEMORY_WAIT = 120
+    memory.reset()
+    baseline = memory.get_rss()
+
+    def request(_):
+        started = time.perf_counter()
+        response = Client().get("/wcs/", parameters)
+        return time.perf_counter() - started, response.status_code
+
+    # the peak resident memory of the interpreter includes writing the product, so it is sampled while serving
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], memory.get_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(concurrency)))
+    done.set()
+    sampler.join()
+    return {
+        'baseline_mb': baseline / 2**20,
+        'peak_mb': peak[0] / 2**20,
+        'latencies': [latency for latency, _ in results],
+        'statuses': [status for _, status in results],
+        'calibration': memory.get_watchdog().budget.calibration
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1500, help="Width and height of the synthetic product.")
+    parser.add_argument('--concurrency', type=int, default=6, help="Concurrent whole product requests.")
+    parser.add_argument('--budget-mb', type=int, default=400, help="WCS_MEMORY_BUDGET of the budgeted mode.")
+    parser.add_argument('--malloc-arenas', type=int, default=2, help="MALLOC_ARENA_MAX of the workers.")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(_run_worker(args.size, args.concurrency, args.worker)))
+        return 0
+
+    from . import harness
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    if args.malloc_arenas:
+        environment['MALLOC_ARENA_MAX'] = str(args.malloc_arenas)
+    for name, budget in (("unbudgeted", 0), ("budget={}MB".format(args.budget_mb), args.budget_mb * 2**20)):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_memory', '--worker', str(budget), '--size', str(args.size),
+             '--concurrency', str(args.concurrency)],
+            cwd=root, env=environment, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        summary = harness.summarize(result['latencies'])
+        print("{:<14} peak {:>7.1f}MB (+{:>6.1f}MB)  p50 {:>8.1f}ms  max {:>8.1f}ms  {} rejected  "
+              "calibration {:.2f}".format(name, result['peak_mb'], result['peak_mb'] - result['baseline_mb'],
+                                          summary['p50_ms'], summary['max_ms'],
+                                          result['statuses'].count(503), result['calibration']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
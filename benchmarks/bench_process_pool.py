@@ -0,0 +1,65 @@
+"""Compare GetCoverage throughput with processing and encoding in the request threads and in the process pool
+
+Usage:
+    python -m benchmarks.bench_process_pool --format Filtered_GeoTIFF --concurrency 4 --pool-sizes 0,2,4
+
+Every request covers the whole synthetic product and is repeated by --concurrency threads at once. A pool size of 0
+processes and encodes in the request threads.
+
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=800, help="Width and height of the synthetic product.")
+    parser.add_argument('--format', default="Filtered_GeoTIFF")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=16)
+    parser.add_argument('--pool-sizes', default="0,2,4", help="WCS_PROCESS_POOL_SIZE values to compare.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import Client
+
+    from data_cube_wcs import process_pool
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=2)
+    harness.setup_environment([product])
+    parameters = harness.get_coverage_parameters(product, args.format, bbox_fraction=1.0)
+    settings.WCS_PROCESS_POOL_MIN_BYTES = 0
+
+    def request(_):
+        started = time.perf_counter()
+        response = Client().get("/wcs/", parameters)
+        return time.perf_counter() - started, len(response.content)
+
+    baseline = None
+    for pool_size in [int(size) for size in args.pool_sizes.split(",")]:
+        settings.WCS_PROCESS_POOL_SIZE = pool_size
+        process_pool.shutdown()
+        # start the workers and fill the caches before timing
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(request, range(args.concurrency)))
+            started = time.perf_counter()
+            results = list(executor.map(request, range(args.requests)))
+        throughput = args.requests / (time.perf_counter() - started)
+        baseline = baseline or throughput
+        summary = harness.summarize([latency for latency, _ in results])
+        print("pool={:<3} p50 {:>9.1f}ms  p95 {:>9.1f}ms  {:>6.2f} requests/s  ({:.2f}x)".format(
+            pool_size, summary['p50_ms'], summary['p95_ms'], throughput, throughput / baseline))
+    process_pool.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Benchmark the cost of native crs GetCoverage requests against reprojected ones
+
+Usage:
+    python -m benchmarks.bench_reprojection --response-crs EPSG:3857,EPSG:32636 --threads 1,4
+
+The synthetic product is stored in EPSG:4326 so EPSG:4326 responses are served without a warp.
+
+"""
+import argparse
+import os
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help="Width and height of the synthetic product.")
+    parser.add_argument('--bbox-fraction', type=float, default=0.5)
+    parser.add_argument('--response-crs', default="EPSG:3857,EPSG:32636")
+    parser.add_argument('--threads', default="1,4", help="WCS_WARP_THREADS values to compare.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import Client
+
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=1)
+    harness.setup_environment([product])
+    client = Client()
+
+    def _report(name, parameters):
+        result = harness.run_scenario(client, parameters, repeat=args.repeat)
+        print("{:<32} p50 {:>9.1f}ms  p95 {:>9.1f}ms  peak {:>8.1f}MB  [{}]".format(
+            name, result['p50_ms'], result['p95_ms'], result['peak_memory_bytes'] / 2**20, result['status']))
+
+    parameters = harness.get_coverage_parameters(product, bbox_fraction=args.bbox_fraction)
+    _report("native EPSG:4326", parameters)
+    for thread_count in args.threads.split(","):
+        settings.WCS_WARP_THREADS = int(thread_count)
+        for response_crs in args.response_crs.split(","):
+            _report("{} threads={}".format(response_crs, thread_count), dict(parameters, RESPONSE_CRS=response_crs))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Compare the latency of small GetCoverage requests under a load of large exports with and without the scheduler
+
+Usage:
+    python -m benchmarks.bench_scheduler --workers 4 --exports 8 --interactive 40 --read-latency 0.02
+
+All requests arrive at once and are served by a pool of --workers threads, like a threaded WSGI server. Without
+the scheduler the exports and interactive requests compete for every thread. With it, exports are limited to their
+lane's concurrency and the requests over its queue are rejected with a 503, so interactive requests keep the
+remaining threads. Rejected exports are counted and excluded from the latencies.
+
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=600, help="Width and height of the synthetic product.")
+    parser.add_argument('--workers', type=int, default=4, help="Server worker threads.")
+    parser.add_argument('--exports', type=int, default=8, help="Concurrent whole product exports.")
+    parser.add_argument('--interactive', type=int, default=40, help="Concurrent small tile requests.")
+    parser.add_argument('--read-latency', type=float, default=0.02, help="Seconds added to every band read.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.test import RequestFactory, override_settings
+
+    from data_cube_wcs import scheduler, views
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=4,
+                                             read_latency=args.read_latency)
+    harness.setup_environment([product])
+
+    factory = RequestFactory()
+    export = harness.get_coverage_parameters(product, bbox_fraction=1.0, time_depth=4)
+    interactive = harness.get_coverage_parameters(product, bbox_fraction=0.1)
+    view = views.WebService.as_view()
+    lanes = [
+        {'name': 'interactive', 'max_cost': 256 * 256 * 8, 'concurrency': args.workers, 'queue': args.interactive,
+         'timeout': 60, 'retry_after': 1},
+        {'name': 'export', 'max_cost': None, 'concurrency': 1, 'queue': 1, 'timeout': 60, 'retry_after': 30},
+    ]
+
+    def _timed(kind, parameters, submitted):
+        response = view(factory.get("/wcs/", parameters))
+        return kind, response.status_code, time.perf_counter() - submitted
+
+    # fill the caches before timing
+    view(factory.get("/wcs/", export))
+    view(factory.get("/wcs/", interactive))
+
+    for name, scheduler_settings in (("unscheduled", {}), ("scheduled", {'WCS_SCHEDULER': True,
+                                                                       'WCS_SCHEDULER_LANES': lanes,
+                                                                       'WCS_SCHEDULER_MAX_ACTIVE': args.workers})):
+        with override_settings(**scheduler_settings):
+            scheduler.reset()
+            requests = [('export', export)] * args.exports + [('interactive', interactive)] * args.interactive
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                futures = [executor.submit(_timed, kind, parameters, time.perf_counter())
+                           for kind, parameters in requests]
+                results = [future.result() for future in futures]
+            scheduler.reset()
+        for kind in ('interactive', 'export'):
+            latencies = [latency for _kind, status, latency in results if _kind == kind and status == 200]
+            rejected = sum(1 for _kind, status, _ in results if _kind == kind and status == 503)
+            summary = harness.summarize(latencies)
+            print("{:<12} {:<12} p50 {:>9.1f}ms  p99 {:>9.1f}ms  {:>3} served  {:>3} rejected".format(
+                name, kind, summary['p50_ms'], summary['p99_ms'], len(latencies), rejected))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
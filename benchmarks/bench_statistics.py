@@ -0,0 +1,77 @@
+"""Compare per band statistics computed by clients from GetCoverage responses with the GetStatistics operation
+
+Usage:
+    python -m benchmarks.bench_statistics --size 1000 --times 10
+
+The client path downloads a GeoTIFF mosaic of the whole product at native resolution and reduces it with numpy,
+or one GeoTIFF per scene for the statistics of every observation. The server path makes a single GetStatistics
+request. Latencies include the client side reduction.
+
+"""
+import argparse
+import os
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000, help="Width and height of the synthetic product.")
+    parser.add_argument('--times', type=int, default=10, help="Acquisitions in the time range.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    import numpy as np
+    from django.test import Client
+    from rasterio.io import MemoryFile
+
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=args.times)
+    harness.setup_environment([product])
+    coverage = harness.get_coverage_parameters(product, bbox_fraction=1.0, time_depth=args.times)
+    statistics = {key: value for key, value in coverage.items() if key not in ('FORMAT', 'WIDTH', 'HEIGHT')}
+    statistics['REQUEST'] = "GetStatistics"
+    client = Client()
+
+    def get(parameters):
+        return harness._get(client, "/wcs/", parameters).body
+
+    def reduce(contents):
+        bands = None
+        for content in contents:
+            with MemoryFile(content) as memfile, memfile.open() as src:
+                values = src.read()
+            bands = [[] for _ in values] if bands is None else bands
+            for band, band_values in zip(bands, values):
+                band.append(band_values[band_values != product.nodata])
+        return [(band.size, band.mean(), band.std(), band.min(), band.max())
+                for band in (np.concatenate(parts) for parts in bands)]
+
+    scenes = [dict(coverage, TIME=acquisition.isoformat()) for acquisition in product.acquisition_times]
+    modes = [
+        ("mosaic GetCoverage", [coverage], True),
+        ("mosaic GetStatistics", [dict(statistics, COMPOSITE="mosaic")], False),
+        ("scenes GetCoverage", scenes, True),
+        ("scenes GetStatistics", [statistics], False),
+    ]
+    for name, requests, client_reduce in modes:
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            contents = [get(parameters) for parameters in requests]
+            if client_reduce:
+                reduce(contents)
+            latencies.append(time.perf_counter() - started)
+        summary = harness.summarize(latencies)
+        print("{:<22} p50 {:>9.1f}ms  {:>12,} bytes transferred".format(
+            name, summary['p50_ms'], sum(len(content) for content in contents)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Compare large GetCoverage requests rendered in one piece, split into tiles in-process and tiles sent to peers
+
+Usage:
+    python -m benchmarks.bench_tiles --size 2000 --tile-size 512 --peers 2
+
+Peers are WCS servers on localhost ports started in this process, standing in for other nodes. In a real
+deployment they are separate processes or machines, so the tiles are also rendered in parallel.
+
+"""
+import argparse
+import os
+import sys
+import threading
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def start_peer():
+    """Serve the WCS on a free localhost port in a daemon thread, returning its url"""
+    from django.core.wsgi import get_wsgi_application
+
+    server = make_server('127.0.0.1', 0, get_wsgi_application(), server_class=_ThreadingWSGIServer,
+                         handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}/wcs/".format(server.server_port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help="Width and height of the synthetic product.")
+    parser.add_argument('--tile-size', type=int, default=512, help="WCS_TILE_SIZE.")
+    parser.add_argument('--peers', type=int, default=2, help="Number of localhost peers.")
+    parser.add_argument('--format', default="GeoTIFF")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.test import Client, override_settings
+
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=3,
+                                             storage='geotiff')
+    harness.setup_environment([product])
+    parameters = harness.get_coverage_parameters(product, args.format, bbox_fraction=1.0, time_depth=2)
+    peers = [start_peer() for _ in range(args.peers)]
+
+    modes = [
+        ("untiled", {}),
+        ("tiled", {'WCS_TILE_MIN_PIXELS': 1, 'WCS_TILE_SIZE': args.tile_size}),
+        ("peers={}".format(args.peers), {'WCS_TILE_MIN_PIXELS': 1, 'WCS_TILE_SIZE': args.tile_size,
+                                        'WCS_TILE_PEERS': peers}),
+    ]
+    client = Client()
+    for name, tile_settings in modes:
+        with override_settings(**tile_settings):
+            result = harness.run_scenario(client, parameters, repeat=args.repeat)
+        print("{:<10} p50 {:>9.1f}ms  p95 {:>9.1f}ms  peak {:>8.1f}MB  {:>8.1f}MB response [{}]".format(
+            name, result['p50_ms'], result['p95_ms'], result['peak_memory_bytes'] / 2**20,
+            result['response_bytes'] / 2**20, result['status']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
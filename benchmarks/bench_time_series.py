@@ -0,0 +1,81 @@
+"""Compare extracting the time series of a point with a GetCoverage request per scene and with GetTimeSeries
+
+Usage:
+    python -m benchmarks.bench_time_series --size 1000 --times 40 --points 20
+
+Every point is drilled at a random pixel of the synthetic product. The cold GetTimeSeries run starts with an empty
+block cache, the warm run drills points next to the cold ones, within the blocks that were read. The synthetic
+storage units are uncompressed and in the page cache, so cold blocks are cheap here - the block cache saves more
+with compressed or remote storage.
+
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000, help="Width and height of the synthetic product.")
+    parser.add_argument('--times', type=int, default=40, help="Acquisitions in the time range.")
+    parser.add_argument('--points', type=int, default=20, help="Points drilled per mode.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.test import Client
+
+    from data_cube_wcs import raster_io
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=args.size, height=args.size, times=args.times,
+                                             storage='geotiff')
+    harness.setup_environment([product])
+    client = Client()
+    rng = random.Random(0)
+    pixels = [(rng.randrange(args.size - 1), rng.randrange(args.size - 1)) for _ in range(args.points)]
+
+    def center(column, row):
+        return (product.extent[0] + (column + 0.5) * product.x_resolution,
+                product.extent[3] + (row + 0.5) * product.y_resolution)
+
+    def per_scene(column, row):
+        x, y = center(column, row)
+        bbox = (x - product.x_resolution / 2, y + product.y_resolution / 2, x + product.x_resolution / 2,
+                y - product.y_resolution / 2)
+        for acquisition in product.acquisition_times:
+            client.get("/wcs/", {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCoverage",
+                                 'COVERAGE': product.name, 'CRS': "EPSG:4326", 'BBOX': ",".join(map(repr, bbox)),
+                                 'WIDTH': 1, 'HEIGHT': 1, 'FORMAT': "netCDF", 'TIME': acquisition.isoformat()})
+
+    def drill(column, row):
+        client.get("/wcs/", {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetTimeSeries",
+                             'COVERAGE': product.name, 'CRS': "EPSG:4326", 'POINT': "{!r},{!r}".format(
+                                 *center(column, row))})
+
+    modes = [
+        ("GetCoverage per scene", per_scene, pixels),
+        ("GetTimeSeries cold", drill, pixels),
+        ("GetTimeSeries warm", drill, [(column + 1, row + 1) for column, row in pixels]),
+    ]
+    # open the storage units once, as any running server would have
+    drill(*pixels[0])
+    raster_io.get_block_cache().clear()
+    for name, run, points in modes:
+        latencies = []
+        for point in points:
+            started = time.perf_counter()
+            run(*point)
+            latencies.append(time.perf_counter() - started)
+        summary = harness.summarize(latencies)
+        print("{:<22} p50 {:>8.1f}ms  p95 {:>8.1f}ms per {}-scene series".format(
+            name, summary['p50_ms'], summary['p95_ms'], args.times))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
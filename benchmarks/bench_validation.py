@@ -0,0 +1,62 @@
+"""Microbenchmark of GetCoverage request validation
+
+Usage:
+    python -m benchmarks.bench_validation --iterations 2000
+
+Reports the time per validation and the number of database queries made per validation once the catalog
+snapshot is warm - the hot path should not touch the database at all.
+
+"""
+import argparse
+import os
+import sys
+import timeit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--times', type=int, default=500, help="Number of acquisitions in the temporal domain.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from data_cube_wcs import catalog, forms
+    from . import fake_datacube, harness
+
+    # the data itself is never read, keep the files tiny
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=8, height=8, times=args.times)
+    harness.setup_environment([product])
+
+    cases = {
+        'single time': harness.get_coverage_parameters(product, time_depth=1),
+        'time range': harness.get_coverage_parameters(product, time_depth=10),
+        'measurements': harness.get_coverage_parameters(product, measurements=['red', 'green', 'blue']),
+    }
+
+    catalog.get_catalog()
+    for name, parameters in cases.items():
+        get_data = {key.lower(): value for key, value in parameters.items()}
+
+        def _validate():
+            form = forms.GetCoverageForm(get_data)
+            assert form.is_valid(), form.errors
+
+        with CaptureQueriesContext(connection) as queries:
+            _validate()
+        elapsed = timeit.timeit(_validate, number=args.iterations)
+        print("{:<14} {:>9.1f}us per validation  {} queries".format(name, elapsed / args.iterations * 1e6,
+                                                                      len(queries)))
+
+    snapshot_time = timeit.timeit(catalog.reload, number=10) / 10
+    print("catalog snapshot rebuild: {:.2f}ms".format(snapshot_time * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Compare first request latencies of a fresh worker with and without the warmup
+
+Usage:
+    python -m benchmarks.bench_warmup --size 200 --repeat 5
+
+Every mode runs in a fresh interpreter: the synthetic product is written, the warm mode runs every warmup step
+(as the app does in the background when WCS_WARMUP is set), then the first GetCapabilities, DescribeCoverage and
+GetCoverage requests are timed against the median of the requests that follow.
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+OPERATIONS = ('GetCapabilities', 'DescribeCoverage', 'GetCoverage')
+
+
+def _run_worker(size, warm, repeat):
+    """Time the first and steady state requests of this process, returning {operation: (first ms, steady ms)}"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    from django.test import Client
+
+    from data_cube_wcs import warmup
+    from . import fake_datacube, harness
+
+    product = fake_datacube.SyntheticProduct("ls8_synthetic", width=size, height=size, times=5)
+    harness.setup_environment([product])
+    timings = warmup.run(list(warmup.WARMUP_STEPS)) if warm else {}
+
+    requests = {
+        'GetCapabilities': {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCapabilities"},
+        'DescribeCoverage': {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "DescribeCoverage",
+                             'COVERAGE': product.name},
+        'GetCoverage': harness.get_coverage_parameters(product)
+    }
+    client = Client()
+    results = {}
+    for operation in OPERATIONS:
+        latencies = []
+        for _ in range(repeat + 1):
+            started = time.perf_counter()
+            client.get("/wcs/", requests[operation])
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[operation] = (latencies[0], sorted(latencies[1:])[len(latencies[1:]) // 2])
+    return {'warmup_ms': timings, 'requests': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200, help="Width and height of the synthetic product.")
+    parser.add_argument('--repeat', type=int, default=5, help="Steady state requests per operation.")
+    parser.add_argument('--worker', choices=('cold', 'warm'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(_run_worker(args.size, args.worker == 'warm', args.repeat)))
+        return 0
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for mode in ('cold', 'warm'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_warmup', '--worker', mode, '--size', str(args.size),
+             '--repeat', str(args.repeat)],
+            cwd=root, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if result['warmup_ms']:
+            print("{} warmup: {}".format(mode, ", ".join(
+                "{} {:.1f}ms".format(step, duration) for step, duration in result['warmup_ms'].items())))
+        for operation in OPERATIONS:
+            first, steady = result['requests'][operation]
+            print("{:<5} {:<17} first {:>8.1f}ms  steady {:>8.1f}ms  ({:.1f}x)".format(
+                mode, operation, first, steady, first / steady))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
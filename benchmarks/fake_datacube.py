@@ -0,0 +1,360 @@
+"""A synthetic, file backed stand-in for the Data Cube used to run the WCS app without an index database
+
+Products are written to local netCDF or GeoTIFF files - one file per acquisition - and FakeDatacube.load reads and
+regrids them in the same way the pipeline uses datacube.Datacube.load. Regridding is always nearest neighbour and is
+skipped when the requested grid is the storage grid.
+
+"""
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from time import sleep
+
+import numpy as np
+import pandas as pd
+import pytz
+import xarray as xr
+
+PRODUCTS = {}
+# every FakeDatacube.load call, so tests can assert on what the pipeline asked for
+LOAD_CALLS = []
+# the netCDF4/HDF5 library isn't thread safe and loads are fanned out over threads
+_netcdf_lock = threading.Lock()
+
+LANDSAT_BANDS = ('red', 'green', 'blue', 'nir', 'swir1', 'swir2', 'pixel_qa')
+FORMATS = (('GeoTIFF', 'image/tiff'), ('netCDF', 'application/x-netcdf'), ('RGB_GeoTIFF', 'image/tiff'),
+           ('Filtered_GeoTIFF', 'image/tiff'))
+
+
+class SyntheticProduct(object):
+    """Describes a synthetic product and writes its acquisitions to disk
+
+    Args:
+        name: product name - include ls5/ls7/ls8 to get the landsat format processing.
+        width, height: grid size in pixels.
+        bands: band names. pixel_qa bands are filled with random qa bits.
+        dtype: numpy dtype of all bands.
+        times: number of acquisitions.
+        extent: (min lon, min lat, max lon, max lat).
+        nodata_fraction: fraction of pixels set to nodata in each acquisition so mosaics have work to do.
+        footprint: (min lon, min lat, max lon, max lat) of the acquisitions' datasets, the whole extent by default.
+            Pixels outside it are nodata.
+        storage: 'netcdf' or 'geotiff'.
+        scenes_per_pass: acquisitions pass_interval apart at each interval, like adjacent path/row scenes.
+        group_by: group_by mode of the coverage - '', 'solar_day' or 'window' with a window spanning a pass.
+        read_latency: seconds added to every band read, to emulate network or object storage - the Data Cube reads
+            each band of a dataset separately.
+
+    """
+
+    def __init__(self,
+                 name,
+                 width=1000,
+                 height=1000,
+                 bands=LANDSAT_BANDS,
+                 dtype='int16',
+                 times=10,
+                 extent=(35.0, 0.0, 36.0, 1.0),
+                 nodata=-9999,
+                 nodata_fraction=0.3,
+                 footprint=None,
+                 storage='netcdf',
+                 start=datetime(2015, 1, 1, 7, 30),
+                 interval=timedelta(days=16),
+                 scenes_per_pass=1,
+                 pass_interval=timedelta(seconds=25),
+                 group_by="",
+                 read_latency=0.0,
+                 seed=0):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.bands = tuple(bands)
+        self.dtype = dtype
+        self.extent = extent
+        self.nodata = nodata
+        self.nodata_fraction = nodata_fraction
+        self.footprint = footprint or extent
+        self.storage = storage
+        self.seed = seed
+        self.group_by = group_by
+        self.read_latency = read_latency
+        self.group_window = int((pass_interval * scenes_per_pass).total_seconds())
+        self.acquisition_times = [start + interval * index + pass_interval * scene
+                                  for index in range(times) for scene in range(scenes_per_pass)]
+        self.paths = {}
+
+        self.x_resolution = (extent[2] - extent[0]) / width
+        self.y_resolution = -(extent[3] - extent[1]) / height
+        self.longitude = extent[0] + self.x_resolution * (np.arange(width) + 0.5)
+        self.latitude = extent[3] + self.y_resolution * (np.arange(height) + 0.5)
+
+    def write(self, directory):
+        """Write every acquisition to its own file in directory and register the product"""
+        rng = np.random.RandomState(self.seed)
+        extension = 'nc' if self.storage == 'netcdf' else 'tif'
+        for time in self.acquisition_times:
+            path = os.path.join(directory, "{}_{}.{}".format(self.name, time.strftime("%Y%m%d%H%M%S"), extension))
+            missing = rng.random_sample((self.height, self.width)) < self.nodata_fraction
+            missing |= ~(((self.latitude >= self.footprint[1]) & (self.latitude <= self.footprint[3]))[:, None] &
+                         (self.longitude >= self.footprint[0]) & (self.longitude <= self.footprint[2]))
+            bands = {}
+            for band in self.bands:
+                if band == 'pixel_qa':
+                    data = rng.choice([1 << 1, 1 << 2, 1 << 3, 1 << 5], size=(self.height, self.width))
+                else:
+                    data = rng.randint(0, 3000, size=(self.height, self.width))
+                bands[band] = np.where(missing, self.nodata, data).astype(self.dtype)
+            if self.storage == 'netcdf':
+                self._write_netcdf(path, bands)
+            else:
+                self._write_geotiff(path, bands)
+            self.paths[time] = path
+        PRODUCTS[self.name] = self
+        return self
+
+    def _write_netcdf(self, path, bands):
+        from rasterio.crs import CRS
+
+        # georeferenced with a grid mapping variable like ingested Data Cube storage units
+        dataset = xr.Dataset(
+            {band: (('latitude', 'longitude'), data, {'grid_mapping': 'crs', 'nodata': self.nodata})
+             for band, data in bands.items()},
+            coords={'latitude': self.latitude,
+                    'longitude': self.longitude})
+        dataset['crs'] = xr.DataArray(0, attrs={'spatial_ref': CRS.from_epsg(4326).to_wkt()})
+        dataset.to_netcdf(path)
+
+    def _write_geotiff(self, path, bands):
+        import rasterio
+        from rasterio.transform import from_origin
+
+        with rasterio.open(
+                path,
+                'w',
+                driver='GTiff',
+                width=self.width,
+                height=self.height,
+                count=len(bands),
+                dtype=self.dtype,
+                crs='EPSG:4326',
+                transform=from_origin(self.extent[0], self.extent[3], self.x_resolution, -self.y_resolution),
+                nodata=self.nodata,
+                tiled=True) as dst:
+            for index, band in enumerate(self.bands, start=1):
+                dst.write(bands[band], index)
+                dst.set_band_description(index, band)
+
+    def read(self, time, latitude, longitude, measurements):
+        """Read the native pixels of one acquisition that fall within the lat/lon ranges"""
+        lat_mask = (self.latitude >= latitude[0] - abs(self.y_resolution)) & (
+            self.latitude <= latitude[1] + abs(self.y_resolution))
+        lon_mask = (self.longitude >= longitude[0] - self.x_resolution) & (
+            self.longitude <= longitude[1] + self.x_resolution)
+        rows, cols = np.flatnonzero(lat_mask), np.flatnonzero(lon_mask)
+        if not len(rows) or not len(cols):
+            return None
+        rows, cols = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+        if self.read_latency:
+            sleep(self.read_latency * len(measurements))
+
+        if self.storage == 'netcdf':
+            with _netcdf_lock, xr.open_dataset(self.paths[time]) as dataset:
+                return dataset[list(measurements)].isel(latitude=rows, longitude=cols).load()
+
+        import rasterio
+        from rasterio.windows import Window
+
+        window = Window.from_slices(rows, cols)
+        with rasterio.open(self.paths[time]) as src:
+            return xr.Dataset(
+                {
+                    band: (('latitude', 'longitude'), src.read(self.bands.index(band) + 1, window=window))
+                    for band in measurements
+                },
+                coords={'latitude': self.latitude[rows],
+                        'longitude': self.longitude[cols]})
+
+    def catalog_fields(self):
+        """Fields for the CoverageOffering model describing this product"""
+        return {
+            'name': self.name,
+            'description': "Synthetic {} band {} product".format(len(self.bands), self.dtype),
+            'label': "synthetic - {}".format(self.name),
+            'min_latitude': self.extent[1],
+            'max_latitude': self.extent[3],
+            'min_longitude': self.extent[0],
+            'max_longitude': self.extent[2],
+            'start_time': self.acquisition_times[0].replace(tzinfo=pytz.UTC),
+            'end_time': self.acquisition_times[-1].replace(tzinfo=pytz.UTC),
+            'crs': 'EPSG:4326',
+            'origin_x': self.extent[0],
+            'origin_y': self.extent[3],
+            'x_resolution': self.x_resolution,
+            'y_resolution': self.y_resolution,
+            'grid_high_x': self.width,
+            'grid_high_y': self.height,
+            'group_by': self.group_by,
+            'group_window': self.group_window
+        }
+
+
+def create_coverages(products):
+    """Create the formats and the CoverageOffering, rangeset, temporal domain and footprint models for products"""
+    import json
+
+    from data_cube_wcs import models
+
+    formats = [models.Format.objects.update_or_create(name=name, defaults={'content_type': content_type})[0]
+               for name, content_type in FORMATS]
+    for product in products:
+        coverage, _ = models.CoverageOffering.objects.update_or_create(
+            name=product.name, defaults=product.catalog_fields())
+        coverage.available_formats.add(*formats)
+        models.CoverageRangesetEntry.objects.filter(coverage_offering=coverage).delete()
+        models.CoverageRangesetEntry.objects.bulk_create([
+            models.CoverageRangesetEntry(coverage_offering=coverage, band_name=band, null_value=product.nodata)
+            for band in product.bands
+        ])
+        models.CoverageTemporalDomainEntry.objects.filter(coverage_offering=coverage).delete()
+        models.CoverageTemporalDomainEntry.objects.bulk_create([
+            models.CoverageTemporalDomainEntry(coverage_offering=coverage, date=time.replace(tzinfo=pytz.UTC))
+            for time in product.acquisition_times
+        ])
+        models.CoverageDatasetFootprint.objects.filter(coverage_offering=coverage).delete()
+        models.CoverageDatasetFootprint.objects.bulk_create([
+            models.CoverageDatasetFootprint(
+                coverage_offering=coverage,
+                dataset_id="{}-{}".format(product.name, index),
+                time=time.replace(tzinfo=pytz.UTC),
+                min_longitude=product.footprint[0],
+                min_latitude=product.footprint[1],
+                max_longitude=product.footprint[2],
+                max_latitude=product.footprint[3],
+                uri=product.paths.get(time, ""),
+                band_paths=json.dumps({band: product.paths.get(time, "") for band in product.bands}))
+            for index, time in enumerate(product.acquisition_times)
+        ])
+
+
+def _naive_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.UTC).replace(tzinfo=None)
+    return value
+
+
+def _align(bounds, resolution, offset):
+    """Expand bounds outwards to the edges of the pixels of a grid with a pixel edge at offset"""
+    return (offset + math.floor((bounds[0] - offset) / resolution) * resolution,
+            offset + math.ceil((bounds[1] - offset) / resolution) * resolution)
+
+
+def _same_grid(native, latitude, longitude):
+    """Check if native pixels are exactly the requested grid, so they can be returned without a reindex"""
+    tolerance = 1e-3 * abs(latitude[1] - latitude[0]) if len(latitude) > 1 else 1e-9
+    return (native.latitude.shape == latitude.shape and native.longitude.shape == longitude.shape and
+            np.allclose(native.latitude.values, latitude, rtol=0, atol=tolerance) and
+            np.allclose(native.longitude.values, longitude, rtol=0, atol=tolerance))
+
+
+def _fuse_solar_days(slices, longitude, nodata):
+    """Fuse time sorted single slice datasets of the same solar day, the earliest valid pixel winning"""
+    fused = []
+    day = None
+    for dataset_slice in slices:
+        time = dataset_slice.time.values[0].astype('datetime64[s]').astype(datetime)
+        slice_day = (time + timedelta(hours=longitude * 24 / 360)).date()
+        if slice_day != day:
+            fused.append(dataset_slice.copy(deep=True))
+            day = slice_day
+            continue
+        for band in dataset_slice.data_vars:
+            missing = fused[-1][band].values == nodata
+            fused[-1][band].values[missing] = dataset_slice[band].values[missing]
+    return fused
+
+
+class FakeDatacube(object):
+    """Implements the subset of the datacube.Datacube api used by the WCS pipeline over the registered products"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def list_products(self):
+        return pd.DataFrame({'name': list(PRODUCTS)})
+
+    def load(self,
+             product,
+             time=None,
+             measurements=None,
+             latitude=None,
+             longitude=None,
+             resolution=None,
+             dask_chunks=None,
+             align=None,
+             group_by=None,
+             **kwargs):
+        """Load and regrid a product - only the lat/lon query form used by the WCS is supported
+
+        As with datacube.Datacube.load, align is a (y, x) point that lies on a pixel edge and the query bounds are
+        expanded to the pixel edges of the aligned grid. Without align the grid starts at the query bounds. Grouping
+        by solar_day fuses the acquisitions of a day into the slice of its first acquisition, first valid pixel first.
+
+        """
+        LOAD_CALLS.append(dict(product=product, time=time, measurements=measurements, align=align, group_by=group_by,
+                               **kwargs))
+        spec = PRODUCTS[product]
+        measurements = list(measurements or spec.bands)
+        latitude = tuple(sorted(latitude)) if latitude else (spec.extent[1], spec.extent[3])
+        longitude = tuple(sorted(longitude)) if longitude else (spec.extent[0], spec.extent[2])
+        y_resolution, x_resolution = resolution if resolution else (spec.y_resolution, spec.x_resolution)
+        if align is not None:
+            latitude = _align(latitude, abs(y_resolution), align[0])
+            longitude = _align(longitude, abs(x_resolution), align[1])
+
+        target_latitude = np.arange(latitude[1] + y_resolution / 2, latitude[0], y_resolution)
+        target_longitude = np.arange(longitude[0] + x_resolution / 2, longitude[1], x_resolution)
+
+        times = spec.acquisition_times
+        if time is not None:
+            start, end = map(_naive_utc, time)
+            times = [acquisition for acquisition in times if start <= acquisition <= end]
+
+        if not times:
+            return xr.Dataset()
+
+        # lazy loads are only used to get the output grid
+        if dask_chunks is not None:
+            return xr.Dataset(coords={'latitude': target_latitude, 'longitude': target_longitude})
+
+        slices = []
+        for acquisition in times:
+            native = spec.read(acquisition, latitude, longitude, measurements)
+            if native is None:
+                continue
+            if _same_grid(native, target_latitude, target_longitude):
+                slices.append(native.expand_dims(time=[np.datetime64(acquisition, 'ns')]))
+                continue
+            regridded = native.reindex(
+                latitude=target_latitude,
+                longitude=target_longitude,
+                method='nearest',
+                tolerance=max(abs(spec.y_resolution), abs(spec.x_resolution)),
+                fill_value=spec.nodata)
+            slices.append(regridded.astype(spec.dtype).expand_dims(time=[np.datetime64(acquisition, 'ns')]))
+
+        if not slices:
+            return xr.Dataset()
+        if group_by == 'solar_day':
+            slices = _fuse_solar_days(slices, (spec.extent[0] + spec.extent[2]) / 2, spec.nodata)
+        return xr.concat(slices, 'time')
@@ -0,0 +1,205 @@
+"""In-process benchmark harness for the WCS operations
+
+Requests are made through the Django test client so the measurements cover form validation, the catalog
+queries, the (synthetic) Data Cube loads, processing and encoding - without any http or network overhead.
+
+"""
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def setup_environment(products, directory=None):
+    """Create the app tables, write the synthetic products to directory and create their coverages
+
+    Requires django to be set up with benchmarks.settings (or equivalent) beforehand.
+
+    """
+    from django.core.management import call_command
+
+    from . import fake_datacube
+
+    directory = directory or tempfile.mkdtemp(prefix="wcs_benchmark_")
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    for product in products:
+        product.write(directory)
+    fake_datacube.create_coverages(products)
+    return directory
+
+
+def _bbox(product, fraction):
+    """A bbox centered on the product extent covering fraction of its width and height"""
+    min_lon, min_lat, max_lon, max_lat = product.extent
+    center_lon, center_lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+    half_width, half_height = (max_lon - min_lon) * fraction / 2, (max_lat - min_lat) * fraction / 2
+    return (center_lon - half_width, center_lat - half_height, center_lon + half_width, center_lat + half_height)
+
+
+def _time(product, depth):
+    """A TIME parameter selecting the depth most recent acquisitions"""
+    times = product.acquisition_times[-depth:]
+    if depth == 1:
+        return times[0].isoformat()
+    return "{}/{}".format(times[0].isoformat(), times[-1].isoformat())
+
+
+def get_coverage_parameters(product, _format="GeoTIFF", bbox_fraction=0.25, time_depth=1, measurements=None):
+    """GetCoverage parameters for a native resolution request over a fraction of the product extent"""
+    bbox = _bbox(product, bbox_fraction)
+    parameters = {
+        'SERVICE': "WCS",
+        'VERSION': "1.0.0",
+        'REQUEST': "GetCoverage",
+        'COVERAGE': product.name,
+        'CRS': "EPSG:4326",
+        'RESPONSE_CRS': "EPSG:4326",
+        'BBOX': ",".join(map(repr, bbox)),
+        'WIDTH': max(1, int(round(product.width * bbox_fraction))),
+        'HEIGHT': max(1, int(round(product.height * bbox_fraction))),
+        'FORMAT': _format,
+        'TIME': _time(product, time_depth)
+    }
+    if measurements:
+        parameters['MEASUREMENTS'] = ",".join(measurements)
+    return parameters
+
+
+def build_scenarios(product, formats=("GeoTIFF", "netCDF"), bbox_fractions=(0.1, 0.5, 1.0), time_depths=(1, 5)):
+    """Build the scenario matrix for a product as a list of (name, GET parameters) pairs"""
+    scenarios = [
+        ("GetCapabilities", {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCapabilities"}),
+        ("DescribeCoverage", {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "DescribeCoverage",
+                              'COVERAGE': product.name}),
+    ]
+    for _format in formats:
+        for bbox_fraction in bbox_fractions:
+            for time_depth in time_depths:
+                if time_depth > len(product.acquisition_times):
+                    continue
+                name = "GetCoverage/{}/{}/bbox={}/times={}".format(product.name, _format, bbox_fraction, time_depth)
+                scenarios.append((name, get_coverage_parameters(product, _format, bbox_fraction, time_depth)))
+    return scenarios
+
+
+def summarize(latencies):
+    """Latency distribution in milliseconds"""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'count': len(latencies),
+        'mean_ms': float(latencies.mean()),
+        'min_ms': float(latencies.min()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max())
+    }
+
+
+def _get(client, url, parameters):
+    """Make a request, reading the whole body of streaming responses"""
+    response = client.get(url, parameters)
+    if response.streaming:
+        response.body = b"".join(response.streaming_content)
+    else:
+        response.body = response.content
+    return response
+
+
+async def asgi_get(application, url, parameters):
+    """Make a GET request through an ASGI application, returning the response status, headers and body
+
+    The client stays connected until the whole response has been sent.
+
+    """
+    import asyncio
+    from urllib.parse import urlencode
+
+    scope = {'type': 'http', 'asgi': {'version': "3.0"}, 'http_version': "1.1", 'method': "GET", 'scheme': "http",
+             'path': url, 'raw_path': url.encode(), 'query_string': urlencode(parameters).encode(),
+             'headers': [(b'host', b'localhost')], 'server': ("localhost", 80), 'client': ("127.0.0.1", 50000)}
+    requests, messages = [{'type': 'http.request', 'body': b"", 'more_body': False}], []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    body = b"".join(message.get('body', b"") for message in messages if message['type'] == 'http.response.body')
+    return start['status'], dict(start['headers']), body
+
+
+def run_scenario(client, parameters, repeat=5, warmup=1, url="/wcs/"):
+    """Run a single scenario, returning latency, throughput and peak traced memory
+
+    Latencies are measured without memory tracing - peak memory comes from one extra traced request.
+
+    """
+    for _ in range(warmup):
+        _get(client, url, parameters)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        request_started = time.perf_counter()
+        response = _get(client, url, parameters)
+        latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    _get(client, url, parameters)
+    peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+    if not tracing:
+        tracemalloc.stop()
+
+    result = summarize(latencies)
+    result.update({
+        'status': response.status_code,
+        'content_type': response.get('Content-Type'),
+        'response_bytes': len(response.body),
+        'throughput_rps': repeat / elapsed,
+        'peak_memory_bytes': peak_memory
+    })
+    return result
+
+
+def run(client, scenarios, repeat=5, warmup=1, url="/wcs/", callback=None):
+    """Run every scenario and build a report that can be compared against a baseline"""
+    results = {}
+    for name, parameters in scenarios:
+        results[name] = run_scenario(client, parameters, repeat=repeat, warmup=warmup, url=url)
+        if callback:
+            callback(name, results[name])
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        'scenarios': results
+    }
+
+
+def compare(report, baseline, threshold=0.2, metric='p50_ms'):
+    """List the scenarios whose metric regressed by more than threshold (a fraction) relative to the baseline"""
+    regressions = []
+    for name, result in report['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous or not previous.get(metric):
+            continue
+        change = (result[metric] - previous[metric]) / previous[metric]
+        if change > threshold:
+            regressions.append((name, previous[metric], result[metric], change))
+    return regressions
@@ -0,0 +1,96 @@
+"""Run the WCS benchmark suite against a synthetic Data Cube
+
+Usage:
+    python -m benchmarks.run --output report.json
+    python -m benchmarks.run --output new.json --compare report.json --threshold 0.2
+
+Exits with a non-zero status if any scenario regressed relative to the --compare report.
+
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help="Write the json report to this path.")
+    parser.add_argument('--compare', help="Baseline json report to compare against.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed fractional p50 latency increase.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--bands', type=int, default=7, help="Number of landsat style bands, at most 7.")
+    parser.add_argument('--dtype', default='int16')
+    parser.add_argument('--times', type=int, default=10, help="Number of acquisitions in the product.")
+    parser.add_argument('--storage', choices=('netcdf', 'geotiff'), default='netcdf')
+    parser.add_argument('--formats', default="GeoTIFF,netCDF,RGB_GeoTIFF")
+    parser.add_argument('--bbox-fractions', default="0.1,0.5,1.0")
+    parser.add_argument('--time-depths', default="1,5")
+    parser.add_argument('--data-dir', help="Directory for the synthetic data, a temporary directory by default.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+    import django
+    django.setup()
+
+    from django.test import Client
+
+    from . import fake_datacube, harness
+
+    bands = fake_datacube.LANDSAT_BANDS[:args.bands]
+    if args.bands < len(fake_datacube.LANDSAT_BANDS):
+        # keep the qa band so the filtered format can still be benchmarked
+        bands = bands + ('pixel_qa',)
+    product = fake_datacube.SyntheticProduct(
+        "ls8_synthetic",
+        width=args.width,
+        height=args.height,
+        bands=bands,
+        dtype=args.dtype,
+        times=args.times,
+        storage=args.storage)
+
+    directory = harness.setup_environment([product], args.data_dir)
+    try:
+        scenarios = harness.build_scenarios(
+            product,
+            formats=args.formats.split(","),
+            bbox_fractions=[float(fraction) for fraction in args.bbox_fractions.split(",")],
+            time_depths=[int(depth) for depth in args.time_depths.split(",")])
+
+        def _print(name, result):
+            print("{:<60} p50 {:>9.1f}ms  p95 {:>9.1f}ms  {:>7.2f} req/s  peak {:>8.1f}MB  [{}]".format(
+                name, result['p50_ms'], result['p95_ms'], result['throughput_rps'],
+                result['peak_memory_bytes'] / 2**20, result['status']))
+
+        report = harness.run(Client(), scenarios, repeat=args.repeat, warmup=args.warmup, callback=_print)
+        report['parameters'] = vars(args)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = harness.compare(report, baseline, threshold=args.threshold)
+        for name, previous, current, change in regressions:
+            print("REGRESSION {}: p50 {:.1f}ms -> {:.1f}ms (+{:.0%})".format(name, previous, current, change))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Minimal Django settings used to run the WCS app in-process against the synthetic Data Cube"""
+import os
+import tempfile
+
+SECRET_KEY = 'data-cube-wcs-benchmarks'
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'data_cube_wcs',
+]
+
+# the app ships without migrations - create its tables directly with migrate --run-syncdb
+MIGRATION_MODULES = {'data_cube_wcs': None}
+
+# a file rather than :memory: so that every thread of the concurrent drivers sees the same catalog
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('WCS_BENCHMARK_DB', os.path.join(tempfile.gettempdir(), 'wcs_benchmarks.sqlite3')),
+    }
+}
+
+ROOT_URLCONF = 'benchmarks.urls'
+
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'APP_DIRS': True,
+}]
+
+USE_TZ = True
+
+WCS_DATACUBE_FACTORY = 'benchmarks.fake_datacube.FakeDatacube'
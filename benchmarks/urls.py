@@ -0,0 +1,7 @@
+try:
+    from django.urls import include, re_path
+except ImportError:
+    # Django < 2.0
+    from django.conf.urls import include, url as re_path
+
+urlpatterns = [re_path(r'^wcs/', include('data_cube_wcs.urls'))]
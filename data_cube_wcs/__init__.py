@@ -0,0 +1 @@
+default_app_config = 'data_cube_wcs.apps.DataCubeWcsConfig'
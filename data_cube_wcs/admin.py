@@ -12,6 +12,12 @@ class CoverageRangesetAdmin(admin.ModelAdmin):
     list_filter = ('coverage_offering',)
 
 
+class CoverageDatasetFootprintAdmin(admin.ModelAdmin):
+    list_display = ('coverage_offering', 'time', 'uri')
+    list_filter = ('coverage_offering',)
+
+
 admin.site.register(models.CoverageOffering, CoverageOfferingAdmin)
 admin.site.register(models.CoverageRangesetEntry, CoverageRangesetAdmin)
+admin.site.register(models.CoverageDatasetFootprint, CoverageDatasetFootprintAdmin)
 admin.site.register(models.Format)
@@ -1,5 +1,32 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class DataCubeWcsConfig(AppConfig):
     name = 'data_cube_wcs'
+
+    def ready(self):
+        """Configure GDAL, invalidate the catalog snapshot whenever the catalog models change and start the warmup
+
+        The warmup queries the database, so it never runs from management commands like migrate, whose tables may
+        not exist yet, or test runs - see warmup.is_serving.
+
+        """
+        from . import catalog
+        from . import raster_io
+        from . import warmup
+
+        raster_io.configure_gdal()
+
+        for model_name in ('CoverageOffering', 'CoverageRangesetEntry', 'CoverageTemporalDomainEntry',
+                           'CoverageDatasetFootprint', 'Format'):
+            model = self.get_model(model_name)
+            post_save.connect(catalog.invalidate, sender=model, dispatch_uid='wcs_catalog_save_' + model_name)
+            post_delete.connect(catalog.invalidate, sender=model, dispatch_uid='wcs_catalog_delete_' + model_name)
+        m2m_changed.connect(
+            catalog.invalidate,
+            sender=self.get_model('CoverageOffering').available_formats.through,
+            dispatch_uid='wcs_catalog_formats')
+
+        if warmup.is_serving():
+            warmup.start()
@@ -0,0 +1,511 @@
+import array
+import bisect
+import calendar
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+
+SNAPSHOT_MAGIC = b'WCSCAT02'
+# magic followed by the little endian header length
+SNAPSHOT_PREAMBLE = struct.Struct('<8sQ')
+
+DAY_MILLISECONDS = 24 * 60 * 60 * 1000
+# local solar time is 4 minutes ahead of UTC per degree of longitude east
+SOLAR_MILLISECONDS_PER_DEGREE = 4 * 60 * 1000
+
+
+def to_timestamp(date):
+    """Convert a datetime to integer milliseconds since the epoch - naive datetimes are treated as UTC"""
+    return calendar.timegm(date.utctimetuple()) * 1000 + date.microsecond // 1000
+
+
+def from_timestamp(timestamp):
+    """Convert integer milliseconds since the epoch to a naive UTC datetime"""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(timestamp))
+
+
+def group_timestamps(timestamps, group_by="", window=0, longitude=0):
+    """Group sorted acquisition timestamps into the time slices that are fused together when loaded
+
+    Args:
+        timestamps: sorted acquisition times as integer milliseconds since the epoch
+        group_by: '' for a slice per acquisition, 'solar_day' for a slice per day of local solar time at longitude
+            or 'window' for a slice per run of acquisitions within window seconds of the run's first acquisition
+        window: window length in seconds
+        longitude: longitude used for solar days, usually the center of the coverage
+
+    Returns:
+        list of (first, last) timestamps of each group in time order
+
+    """
+    groups = []
+    solar_offset = int(round(longitude * SOLAR_MILLISECONDS_PER_DEGREE))
+    for timestamp in timestamps:
+        timestamp = int(timestamp)
+        if groups and group_by == 'solar_day':
+            fuse = (timestamp + solar_offset) // DAY_MILLISECONDS == (groups[-1][0] + solar_offset) // DAY_MILLISECONDS
+        elif groups and group_by == 'window':
+            fuse = timestamp - groups[-1][0] <= window * 1000
+        else:
+            fuse = False
+        if fuse:
+            groups[-1][1] = timestamp
+        else:
+            groups.append([timestamp, timestamp])
+    return [tuple(group) for group in groups]
+
+
+class FootprintIndex(object):
+    """Time sorted dataset footprints of a coverage, searchable by time range and lat/lon bbox
+
+    A time range is found with a bisection of the sorted times and the bboxes within it are filtered with a single
+    vectorized intersection test.
+
+    Args:
+        times: sorted int64 array of dataset times as milliseconds since the epoch
+        bounds: float64 array of (min lon, min lat, max lon, max lat) rows matching times
+        uris: dataset uris matching times
+        band_paths: json objects mapping band names to file paths, matching times
+
+    """
+
+    def __init__(self, times, bounds, uris=(), band_paths=()):
+        self.times = times
+        self.bounds = bounds.reshape(-1, 4)
+        self.uris = uris
+        self.band_paths = band_paths
+
+    def __len__(self):
+        return len(self.times)
+
+    def search(self, bounds, time_ranges):
+        """Get the sorted indices of the footprints intersecting bounds within any of the [start, end] time ranges"""
+        import numpy as np
+
+        matches = []
+        for start, end in time_ranges:
+            first = np.searchsorted(self.times, to_timestamp(start), side='left')
+            last = np.searchsorted(self.times, to_timestamp(end), side='right')
+            candidates = self.bounds[first:last]
+            intersects = ((candidates[:, 0] <= bounds[2]) & (candidates[:, 2] >= bounds[0]) &
+                          (candidates[:, 1] <= bounds[3]) & (candidates[:, 3] >= bounds[1]))
+            matches.append(first + np.flatnonzero(intersects))
+        if len(matches) == 1:
+            return matches[0]
+        return np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+
+    def get_footprint(self, index):
+        """Get the time, bbox, uri and band paths of a single footprint"""
+        return {
+            'time': int(self.times[index]),
+            'bounds': tuple(float(value) for value in self.bounds[index]),
+            'uri': self.uris[index],
+            'band_paths': json.loads(self.band_paths[index])
+        }
+
+    @classmethod
+    def empty(cls):
+        """Get the shared index of a coverage without footprints"""
+        global _empty_footprints
+        if _empty_footprints is None:
+            import numpy as np
+
+            _empty_footprints = cls(np.empty(0, dtype=np.int64), np.empty((0, 4)))
+        return _empty_footprints
+
+
+_empty_footprints = None
+
+
+class CoverageEntry(object):
+    """Everything the GetCoverage hot path needs to know about a coverage, held in memory
+
+    Args:
+        offering: CoverageOffering model instance
+        measurements: ordered band names
+        nodata_values: nodata values matching measurements
+        formats: names of the available formats
+        timestamps: sorted acquisition times as integer milliseconds since the epoch
+        footprints: FootprintIndex of the coverage's datasets, empty if they have not been synced
+
+    Coverages with a group_by mode fuse the acquisitions of a pass into a single time slice. Their temporal domain
+    is the first acquisition of each group, and requesting that time loads the whole group.
+
+    """
+
+    def __init__(self, offering, measurements, nodata_values, formats, timestamps, footprints=None):
+        self.offering = offering
+        self.name = offering.name
+        self.measurements = tuple(measurements)
+        self.measurement_set = frozenset(self.measurements)
+        self.nodata = dict(zip(self.measurements, nodata_values))
+        self.formats = tuple(formats)
+        self.timestamps = timestamps
+        self.footprints = footprints if footprints is not None else FootprintIndex.empty()
+        self._groups = None
+
+    @property
+    def groups(self):
+        """(first, last) timestamps of the acquisition groups, grouped on first use"""
+        if self._groups is None:
+            if self.offering.group_by:
+                groups = group_timestamps(self.timestamps, self.offering.group_by, self.offering.group_window,
+                                          (self.offering.min_longitude + self.offering.max_longitude) / 2)
+                self._groups = ([first for first, _ in groups], [last for _, last in groups])
+            else:
+                self._groups = (self.timestamps, self.timestamps)
+        return self._groups
+
+    def get_group_index(self, timestamp):
+        """Get the index of the group a timestamp falls in, or the nearest earlier group"""
+        return max(bisect.bisect_right(self.groups[0], timestamp) - 1, 0)
+
+    def get_time_range(self, date):
+        """Get the load time range of a time of the temporal domain, spanning its whole group"""
+        if not self.offering.group_by or not len(self.groups[0]):
+            return date - timedelta(seconds=1), date + timedelta(seconds=1)
+        index = self.get_group_index(to_timestamp(date))
+        first, last = (from_timestamp(self.groups[0][index]), from_timestamp(self.groups[1][index]))
+        if date.tzinfo is not None:
+            first, last = first.replace(tzinfo=timezone.utc), last.replace(tzinfo=timezone.utc)
+        return first - timedelta(seconds=1), last + timedelta(seconds=1)
+
+    def get_nodata_values(self, bands):
+        """Nodata values for a list of bands, 0 for bands without a rangeset entry"""
+        return [self.nodata.get(band, 0) for band in bands]
+
+    def has_time(self, date):
+        """Check if date exactly matches a time of the temporal domain using a bisection of the sorted timestamps"""
+        timestamp = to_timestamp(date)
+        times = self.groups[0]
+        index = bisect.bisect_left(times, timestamp)
+        return index < len(times) and times[index] == timestamp
+
+    def count_times(self, start, end):
+        """Count the times of the temporal domain within [start, end]"""
+        times = self.groups[0]
+        return bisect.bisect_right(times, to_timestamp(end)) - bisect.bisect_left(times, to_timestamp(start))
+
+
+class CatalogSnapshot(object):
+    """Immutable snapshot of the coverages and formats served by the WCS
+
+    Also caches the documents rendered from the catalog, e.g. capabilities, which are dropped along with it.
+
+    """
+
+    def __init__(self, coverages, formats, version=0, identity=None):
+        self.coverages = coverages
+        self.formats = formats
+        self.version = version
+        self.identity = identity
+        self.created = time.monotonic()
+        self._documents = collections.OrderedDict()
+
+    def get_coverage(self, name):
+        return self.coverages.get(name)
+
+    def get_format(self, name):
+        return self.formats.get(name)
+
+    def get_document(self, key):
+        """Get a document rendered from this snapshot, None if it isn't cached"""
+        document = self._documents.get(key)
+        metrics.record_cache('document', document is not None)
+        return document
+
+    def set_document(self, key, document):
+        """Cache a document rendered from this snapshot, keeping the WCS_DOCUMENT_CACHE_SIZE newest (default 128)"""
+        self._documents[key] = document
+        while len(self._documents) > getattr(settings, 'WCS_DOCUMENT_CACHE_SIZE', 128):
+            try:
+                self._documents.popitem(last=False)
+            except KeyError:
+                break
+
+    @classmethod
+    def from_database(cls, version=0):
+        """Build a snapshot using a fixed number of queries regardless of the number of coverages"""
+        CoverageOffering = apps.get_model("data_cube_wcs.CoverageOffering")
+        CoverageRangesetEntry = apps.get_model("data_cube_wcs.CoverageRangesetEntry")
+        CoverageTemporalDomainEntry = apps.get_model("data_cube_wcs.CoverageTemporalDomainEntry")
+        CoverageDatasetFootprint = apps.get_model("data_cube_wcs.CoverageDatasetFootprint")
+        Format = apps.get_model("data_cube_wcs.Format")
+
+        formats = {_format.name: _format for _format in Format.objects.all()}
+
+        rangesets = {}
+        for coverage_id, band_name, null_value in CoverageRangesetEntry.objects.order_by('pk').values_list(
+                'coverage_offering_id', 'band_name', 'null_value'):
+            rangesets.setdefault(coverage_id, []).append((band_name, null_value))
+
+        timestamps = {}
+        for coverage_id, date in CoverageTemporalDomainEntry.objects.order_by('date').values_list(
+                'coverage_offering_id', 'date'):
+            timestamps.setdefault(coverage_id, []).append(to_timestamp(date))
+
+        available_formats = {}
+        for coverage_id, format_name in CoverageOffering.available_formats.through.objects.order_by(
+                'format_id').values_list('coverageoffering_id', 'format__name'):
+            available_formats.setdefault(coverage_id, []).append(format_name)
+
+        footprints = {}
+        for coverage_id, date, *footprint in CoverageDatasetFootprint.objects.order_by('time', 'pk').values_list(
+                'coverage_offering_id', 'time', 'min_longitude', 'min_latitude', 'max_longitude', 'max_latitude',
+                'uri', 'band_paths'):
+            footprints.setdefault(coverage_id, []).append((to_timestamp(date), *footprint))
+
+        coverages = {}
+        for offering in CoverageOffering.objects.all():
+            rangeset = rangesets.get(offering.pk, [])
+            coverages[offering.name] = CoverageEntry(
+                offering, [band for band, _ in rangeset], [nodata for _, nodata in rangeset],
+                available_formats.get(offering.pk, []), timestamps.get(offering.pk, []),
+                _build_footprint_index(footprints.get(offering.pk, [])))
+
+        return cls(coverages, formats, version=version)
+
+    def write(self, path):
+        """Write the snapshot to a memory mappable file, atomically replacing any existing file at path
+
+        The file is the magic and header length, a json header describing the formats and coverages followed by
+        the packed int64 timestamps of every coverage, the int64 times of every dataset footprint and the float64
+        footprint bboxes, all at 8 byte aligned offsets.
+
+        """
+        import numpy as np
+
+        CoverageOffering = apps.get_model("data_cube_wcs.CoverageOffering")
+        fields = [field.attname for field in CoverageOffering._meta.concrete_fields]
+
+        timestamps = array.array('q')
+        footprint_count = 0
+        coverages = []
+        for entry in self.coverages.values():
+            values = {field: getattr(entry.offering, field) for field in fields}
+            for field in ('start_time', 'end_time'):
+                values[field] = values[field].isoformat() if values[field] else None
+            coverages.append({
+                'fields': values,
+                'measurements': entry.measurements,
+                'nodata': entry.get_nodata_values(entry.measurements),
+                'formats': entry.formats,
+                'times_offset': len(timestamps),
+                'times_count': len(entry.timestamps),
+                'footprints_offset': footprint_count,
+                'footprints_count': len(entry.footprints),
+                'footprint_uris': list(entry.footprints.uris),
+                'footprint_band_paths': list(entry.footprints.band_paths)
+            })
+            timestamps.extend(entry.timestamps)
+            footprint_count += len(entry.footprints)
+        if sys.byteorder != 'little':
+            timestamps.byteswap()
+        footprint_times = np.concatenate([np.empty(0, dtype='<i8')] + [
+            entry.footprints.times for entry in self.coverages.values()]).astype('<i8')
+        footprint_bounds = np.concatenate([np.empty((0, 4), dtype='<f8')] + [
+            entry.footprints.bounds for entry in self.coverages.values()]).astype('<f8')
+
+        header = json.dumps({
+            'version': self.version,
+            'formats': [{'id': _format.pk, 'name': _format.name, 'content_type': _format.content_type}
+                        for _format in self.formats.values()],
+            'timestamps_count': len(timestamps),
+            'footprints_count': footprint_count,
+            'coverages': coverages
+        }).encode('utf-8')
+        header += b' ' * (-(SNAPSHOT_PREAMBLE.size + len(header)) % 8)
+
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary_path, 'wb') as output:
+            output.write(SNAPSHOT_PREAMBLE.pack(SNAPSHOT_MAGIC, len(header)))
+            output.write(header)
+            output.write(timestamps.tobytes())
+            output.write(footprint_times.tobytes())
+            output.write(footprint_bounds.tobytes())
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def from_file(cls, path):
+        """Map a snapshot file read-only - timestamps are read through the mapping and never copied"""
+        import numpy as np
+
+        CoverageOffering = apps.get_model("data_cube_wcs.CoverageOffering")
+        Format = apps.get_model("data_cube_wcs.Format")
+
+        with open(path, 'rb') as snapshot_file:
+            identity = _file_identity(snapshot_file.fileno())
+            mapping = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = SNAPSHOT_PREAMBLE.unpack_from(mapping)
+        if magic != SNAPSHOT_MAGIC:
+            mapping.close()
+            raise ValueError("{} is not a catalog snapshot.".format(path))
+        header = json.loads(mapping[SNAPSHOT_PREAMBLE.size:SNAPSHOT_PREAMBLE.size + header_length].decode('utf-8'))
+        offset = SNAPSHOT_PREAMBLE.size + header_length
+        timestamps = memoryview(mapping)[offset:offset + header['timestamps_count'] * 8].cast('q')
+        offset += header['timestamps_count'] * 8
+        footprint_times = np.frombuffer(mapping, dtype='<i8', count=header['footprints_count'], offset=offset)
+        offset += header['footprints_count'] * 8
+        footprint_bounds = np.frombuffer(mapping, dtype='<f8', count=header['footprints_count'] * 4,
+                                         offset=offset).reshape(-1, 4)
+
+        formats = {_format['name']: Format(**_format) for _format in header['formats']}
+        coverages = {}
+        for coverage in header['coverages']:
+            values = coverage['fields']
+            for field in ('start_time', 'end_time'):
+                values[field] = parse_datetime(values[field]) if values[field] else None
+            offering = CoverageOffering(**values)
+            start = coverage['times_offset']
+            footprints_start, footprints_end = (coverage['footprints_offset'],
+                                                coverage['footprints_offset'] + coverage['footprints_count'])
+            footprints = FootprintIndex(footprint_times[footprints_start:footprints_end],
+                                        footprint_bounds[footprints_start:footprints_end],
+                                        coverage['footprint_uris'], coverage['footprint_band_paths'])
+            coverages[offering.name] = CoverageEntry(offering, coverage['measurements'], coverage['nodata'],
+                                                     coverage['formats'],
+                                                     timestamps[start:start + coverage['times_count']], footprints)
+
+        return cls(coverages, formats, version=header['version'], identity=identity)
+
+
+def _build_footprint_index(rows):
+    """Build a FootprintIndex from time sorted (timestamp, min lon, min lat, max lon, max lat, uri, band paths) rows"""
+    import numpy as np
+
+    if not rows:
+        return FootprintIndex.empty()
+    return FootprintIndex(
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1:5] for row in rows], dtype=np.float64), [row[5] for row in rows], [row[6] for row in rows])
+
+
+def _file_identity(fileno=None, path=None):
+    """Identifies a version of the snapshot file - a new file is swapped in with a new inode"""
+    stat = os.fstat(fileno) if fileno is not None else os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def write_snapshot(path=None):
+    """Write the current database catalog to the WCS_CATALOG_SNAPSHOT_PATH file, if configured
+
+    Called by the catalog sync so that every worker can map the new catalog.
+
+    """
+    path = path or getattr(settings, 'WCS_CATALOG_SNAPSHOT_PATH', None)
+    if not path:
+        return None
+    snapshot = CatalogSnapshot.from_database(version=int(time.time() * 1000))
+    snapshot.write(path)
+    return snapshot
+
+
+_snapshot = None
+_last_check = 0
+_version = 0
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """Get the catalog snapshot for this process, building it on first use or when it has expired
+
+    If WCS_CATALOG_SNAPSHOT_PATH is set, the snapshot file is mapped read-only and remapped when a new version is
+    swapped in, checked at most every WCS_CATALOG_CHECK_INTERVAL seconds. Otherwise the snapshot is built from
+    the database - changes made through the models in this process invalidate it immediately while changes made
+    by other processes are picked up after WCS_CATALOG_TTL seconds.
+
+    """
+    path = getattr(settings, 'WCS_CATALOG_SNAPSHOT_PATH', None)
+    if path:
+        return _get_file_catalog(path)
+
+    snapshot = _snapshot
+    if snapshot is not None and not _expired(snapshot, time.monotonic()):
+        metrics.record_cache('catalog', True)
+        return snapshot
+
+    metrics.record_cache('catalog', False)
+    return reload()
+
+
+def get_current():
+    """Get the snapshot in use if it is still fresh, without any database or file access - None otherwise
+
+    For callers that must not block, e.g. async views, which fall back to get_catalog in a thread on None.
+
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        return None
+    now = time.monotonic()
+    if getattr(settings, 'WCS_CATALOG_SNAPSHOT_PATH', None):
+        return snapshot if now - _last_check < getattr(settings, 'WCS_CATALOG_CHECK_INTERVAL', 1) else None
+    return None if _expired(snapshot, now) else snapshot
+
+
+def _expired(snapshot, now):
+    ttl = getattr(settings, 'WCS_CATALOG_TTL', 60)
+    return ttl is not None and now - snapshot.created >= ttl
+
+
+def _get_file_catalog(path):
+    global _snapshot, _last_check
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _last_check < getattr(settings, 'WCS_CATALOG_CHECK_INTERVAL', 1):
+        metrics.record_cache('catalog', True)
+        return snapshot
+
+    with _lock:
+        _last_check = now
+        try:
+            identity = _file_identity(path=path)
+        except FileNotFoundError:
+            # the sync has not written a snapshot yet - fall back to the database until it does
+            identity = None
+        snapshot = _snapshot
+        if snapshot is not None and snapshot.identity == identity and (identity is not None or
+                                                                        not _expired(snapshot, now)):
+            metrics.record_cache('catalog', True)
+            return snapshot
+
+        metrics.record_cache('catalog', False)
+        _snapshot = None
+        if identity:
+            try:
+                _snapshot = CatalogSnapshot.from_file(path)
+            except ValueError:
+                # written by another version of the app - the database is used until the next sync rewrites it
+                pass
+        _snapshot = _snapshot or CatalogSnapshot.from_database()
+        return _snapshot
+
+
+def reload():
+    """Rebuild the snapshot from the database"""
+    global _snapshot, _version
+    with _lock:
+        _version += 1
+        _snapshot = CatalogSnapshot.from_database(version=_version)
+        return _snapshot
+
+
+def invalidate(*args, **kwargs):
+    """Signal receiver dropping the snapshot so that the next request rebuilds it"""
+    global _snapshot
+    _snapshot = None
@@ -0,0 +1,226 @@
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+import numpy as np
+
+from . import catalog
+from . import metrics
+from . import profiling
+from . import utils
+
+# GeoTIFF tag holding the time of the newest scene included in a composite, in milliseconds since the epoch
+LATEST_TIME_TAG = 'WCS_LATEST_TIME'
+NODATA_TAG = 'WCS_NODATA'
+
+
+def get_composite_path(coverage_name):
+    """Get the path of a coverage's materialized composite, None if WCS_COMPOSITE_DIR is not set"""
+    directory = getattr(settings, 'WCS_COMPOSITE_DIR', None)
+    if not directory:
+        return None
+    return os.path.join(directory, "{}.tif".format(coverage_name))
+
+
+def get_scene_times(coverage_name):
+    """Get the sorted scene times of a coverage from its footprints, or its temporal domain without footprints"""
+    entry = catalog.get_catalog().get_coverage(coverage_name)
+    if entry is None:
+        return []
+    times = entry.footprints.times if len(entry.footprints) else entry.timestamps
+    return sorted(set(int(timestamp) for timestamp in times))
+
+
+def update_composite(coverage_offering):
+    """Bring the most recent pixel composite of a coverage up to date with its newest scenes
+
+    An existing composite is updated incrementally - only scenes newer than the newest scene it includes are loaded,
+    and their valid pixels replace the composite's. Otherwise the composite is built from every scene, newest first
+    and stopping early for each block of WCS_COMPOSITE_BLOCK_SIZE pixels once it is complete. The composite is a tiled
+    GeoTIFF on the coverage's storage grid that is atomically swapped into place.
+
+    Returns:
+        the number of new scenes included in the composite
+
+    """
+    import rasterio
+
+    path = get_composite_path(coverage_offering.name)
+    scene_times = get_scene_times(coverage_offering.name)
+    if not path or not scene_times:
+        return 0
+
+    width, height = coverage_offering.grid_high_x, coverage_offering.grid_high_y
+    transform = rasterio.transform.Affine(coverage_offering.x_resolution, 0, coverage_offering.origin_x, 0,
+                                          coverage_offering.y_resolution, coverage_offering.origin_y)
+
+    latest = None
+    if os.path.exists(path):
+        with rasterio.open(path) as src:
+            if (src.width, src.height) == (width, height) and src.transform.almost_equals(transform):
+                latest = int(src.tags().get(LATEST_TIME_TAG, 0))
+
+    new_times = [timestamp for timestamp in scene_times if latest is None or timestamp > latest]
+    if not new_times:
+        return 0
+    time_range = (catalog.from_timestamp(new_times[0]) - timedelta(seconds=1),
+                  catalog.from_timestamp(new_times[-1]) + timedelta(seconds=1))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    if latest is not None:
+        shutil.copyfile(path, temporary_path)
+
+    block_size = getattr(settings, 'WCS_COMPOSITE_BLOCK_SIZE', 2048)
+    dst = None
+    try:
+        if latest is not None:
+            dst = rasterio.open(temporary_path, 'r+')
+        for row in range(0, height, block_size):
+            for column in range(0, width, block_size):
+                window = rasterio.windows.Window(column, row, min(block_size, width - column),
+                                                 min(block_size, height - row))
+                block = _load_block(coverage_offering, transform, window, time_range)
+                if dst is None:
+                    dst = _create_composite(temporary_path, coverage_offering, block, width, height, transform)
+                band_indexes = {band: index for index, band in enumerate(dst.descriptions, start=1)}
+                for band in block.data_vars:
+                    index = band_indexes[band]
+                    values = block[band].values.astype(dst.dtypes[index - 1])
+                    if latest is not None:
+                        # the new scenes only replace the pixels they have valid data for
+                        existing = dst.read(index, window=window)
+                        valid = utils.get_valid_mask(values, float(dst.tags(index)[NODATA_TAG]))
+                        values = np.where(valid, values, existing)
+                    dst.write(values, index, window=window)
+        dst.update_tags(**{LATEST_TIME_TAG: str(new_times[-1])})
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    finally:
+        if dst is not None:
+            dst.close()
+
+    os.replace(temporary_path, path)
+    return len(new_times)
+
+
+def _load_block(coverage_offering, transform, window, time_range):
+    """Load the most recent pixel mosaic of a block of the storage grid over a time range"""
+    min_x, max_y = transform * (window.col_off, window.row_off)
+    max_x, min_y = transform * (window.col_off + window.width, window.row_off + window.height)
+    crs = utils.normalize_crs(coverage_offering.crs)
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name)
+
+    parameters = {
+        'product': coverage_offering.name,
+        'measurements': list(entry.measurements) if entry else None,
+        'output_crs': crs
+    }
+    parameters.update(utils.get_grid_query((min_x, min_y, max_x, max_y), crs, coverage_offering))
+    parameters.update(utils.get_group_query(coverage_offering))
+    block = utils.get_stacked_dataset(coverage_offering, parameters, [], [time_range])
+
+    # guard against the Data Cube returning a grid a pixel off from the block
+    y_dim, x_dim = utils._spatial_dims(block)
+    x = min_x + transform.a * (np.arange(window.width) + 0.5)
+    y = max_y + transform.e * (np.arange(window.height) + 0.5)
+    if block.sizes[x_dim] != window.width or block.sizes[y_dim] != window.height:
+        nodata = dict(zip(block.data_vars, utils.get_nodata_values(coverage_offering, block.data_vars)))
+        block = block.reindex({y_dim: y, x_dim: x}, method='nearest', tolerance=abs(transform.a) / 2)
+        block = block.fillna(nodata)
+    return block
+
+
+def _create_composite(path, coverage_offering, block, width, height, transform):
+    """Create an empty tiled GeoTIFF for a composite with the bands and dtype of its first block"""
+    import rasterio
+
+    bands = list(block.data_vars)
+    nodata_values = utils.get_nodata_values(coverage_offering, bands)
+    dtype = np.result_type(*[block[band].dtype for band in bands])
+    dst = rasterio.open(
+        path,
+        'w',
+        driver='GTiff',
+        width=width,
+        height=height,
+        count=len(bands),
+        dtype=dtype,
+        crs=utils.normalize_crs(coverage_offering.crs),
+        transform=transform,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress='deflate',
+        BIGTIFF='IF_SAFER')
+    for index, (band, nodata) in enumerate(zip(bands, nodata_values), start=1):
+        dst.set_band_description(index, band)
+        dst.update_tags(index, **{NODATA_TAG: str(nodata)})
+    return dst
+
+
+def read_composite(coverage_offering, parameters, grid_bounds=None):
+    """Read a request's grid from the materialized composite of a coverage
+
+    Grid aligned requests are windowed reads of the stored pixels, any other grid is resampled from them with GDAL.
+
+    Args:
+        parameters: dc.load parameters of the request
+        grid_bounds: bounds of a grid aligned request on the storage grid
+
+    Returns:
+        the requested dataset or None if the coverage has no composite or it lacks a requested band
+
+    """
+    import rasterio
+    from rasterio.warp import reproject, Resampling
+    import xarray as xr
+
+    path = get_composite_path(coverage_offering.name)
+    if not path or not os.path.exists(path):
+        metrics.record_cache('composite', False)
+        return None
+
+    with profiling.stage('load'), rasterio.open(path) as src:
+        band_indexes = {band: index for index, band in enumerate(src.descriptions, start=1)}
+        if not all(band in band_indexes for band in parameters['measurements']):
+            metrics.record_cache('composite', False)
+            return None
+        metrics.record_cache('composite', True)
+
+        y_dim, x_dim = utils._crs_dims(parameters['output_crs'])
+        nodata_values = utils.get_nodata_values(coverage_offering, parameters['measurements'])
+        if grid_bounds is not None and utils.normalize_crs(src.crs.to_string()) == parameters['output_crs']:
+            inverse = ~src.transform
+            column, row = (int(round(value)) for value in inverse * (grid_bounds[0], grid_bounds[3]))
+            end_column, end_row = (int(round(value)) for value in inverse * (grid_bounds[2], grid_bounds[1]))
+            window = rasterio.windows.Window(column, row, end_column - column, end_row - row)
+            transform = src.window_transform(window)
+            x = transform.c + transform.a * (np.arange(window.width) + 0.5)
+            y = transform.f + transform.e * (np.arange(window.height) + 0.5)
+            bands = {
+                band: ((y_dim, x_dim),
+                       src.read(band_indexes[band], window=window, boundless=True, fill_value=nodata))
+                for band, nodata in zip(parameters['measurements'], nodata_values)
+            }
+        else:
+            transform, y, x = utils.get_target_grid(parameters['output_crs'], utils._query_bounds(parameters),
+                                                    tuple(parameters['resolution']))
+            bands = {}
+            for band, nodata in zip(parameters['measurements'], nodata_values):
+                destination = np.full((len(y), len(x)), nodata, dtype=src.dtypes[band_indexes[band] - 1])
+                reproject(
+                    source=rasterio.band(src, band_indexes[band]),
+                    destination=destination,
+                    src_nodata=nodata,
+                    dst_transform=transform,
+                    dst_crs=utils.get_crs(parameters['output_crs']),
+                    dst_nodata=nodata,
+                    resampling=getattr(Resampling, parameters.get('resampling', 'nearest')))
+                bands[band] = ((y_dim, x_dim), destination)
+        profiling.add_bytes(sum(values.nbytes for _, values in bands.values()))
+
+    return xr.Dataset(bands, coords={y_dim: y, x_dim: x})
@@ -1,9 +1,11 @@
 from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
 
 from dateutil import parser
 
-from . import models
-from . import utils
+from . import catalog
+from . import profiling
 
 exception_codes = [
     'InvalidFormat', 'CoverageNotDefined', 'CurrentUpdateSequence', 'InvalidUpdateSequence', 'MissingParameterValue',
@@ -14,16 +16,41 @@ exception_codes = [
 # AVAILABLE_OUTPUT_CRS = ["EPSG:4326"]
 AVAILABLE_INPUT_CRS = []
 AVAILABLE_OUTPUT_CRS = []
-AVAILABLE_INPUT_OUTPUT_CRS = ["EPSG:4326"]
+# any EPSG code is accepted as request/response crs - these are advertised in addition to each coverage's native crs
+AVAILABLE_INPUT_OUTPUT_CRS = getattr(settings, 'WCS_ADVERTISED_CRS', ["EPSG:4326"])
 INTERPOLATION_OPTIONS = {'nearest neighbor': 'nearest', 'bilinear': 'bilinear', 'bicubic': 'cubic'}
 
 
+class CatalogChoiceField(forms.Field):
+    """Resolves a name to a catalog object using the in-memory catalog snapshot rather than a queryset
+
+    Args:
+        resolver: callable taking the catalog snapshot and the submitted value, returning None for invalid choices
+
+    """
+
+    default_error_messages = {'invalid_choice': 'InvalidParameterValue'}
+
+    def __init__(self, resolver, *args, **kwargs):
+        super(CatalogChoiceField, self).__init__(*args, **kwargs)
+        self.resolver = resolver
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        resolved = self.resolver(catalog.get_catalog(), value)
+        if resolved is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return resolved
+
+
 class BaseRequestForm(forms.Form):
     """Base WCS request parameters as defined by the OGC WCS 1.0 specification"""
 
     request = forms.ChoiceField(
         choices=(("GetCapabilities", "GetCapabilities"), ("DescribeCoverage", "DescribeCoverage"),
-                 ("GetCoverage", "GetCoverage")),
+                 ("GetCoverage", "GetCoverage"), ("GetStatistics", "GetStatistics"),
+                 ("GetTimeSeries", "GetTimeSeries")),
         initial="GetCapabilities")
     version = forms.CharField(required=False, initial="1.0.0")
     service = forms.ChoiceField(choices=(("WCS", "WCS"), ("WMS", "WMS")), initial="WCS")
@@ -55,11 +82,13 @@ class GetCapabilitiesForm(BaseRequestForm):
 
 class GetCoverageForm(BaseRequestForm):
     """GetCoverage request form as defined by the OGC WCS 1.0 specification"""
-    coverage = forms.ModelChoiceField(queryset=models.CoverageOffering.objects.all(), to_field_name="name")
+    coverage = CatalogChoiceField(
+        lambda snapshot, name: snapshot.get_coverage(name),
+        error_messages={"required": "MissingParameterValue",
+                        "invalid_choice": "CoverageNotDefined"})
 
-    crs = forms.ChoiceField(choices=((option, option) for option in AVAILABLE_INPUT_OUTPUT_CRS), initial="EPSG:4326")
-    response_crs = forms.ChoiceField(
-        required=False, choices=((option, option) for option in AVAILABLE_INPUT_OUTPUT_CRS), initial="EPSG:4326")
+    crs = forms.CharField(initial="EPSG:4326", error_messages={"required": "MissingParameterValue"})
+    response_crs = forms.CharField(required=False)
 
     # One of the following is required.
     bbox = forms.CharField(required=False)
@@ -76,9 +105,8 @@ class GetCoverageForm(BaseRequestForm):
         choices=((option, option) for option in INTERPOLATION_OPTIONS),
         initial="nearest neighbor",
         error_messages={"invalid_choice": "InvalidParameterValue"})
-    format = forms.ModelChoiceField(
-        queryset=models.Format.objects.all(),
-        to_field_name='name',
+    format = CatalogChoiceField(
+        lambda snapshot, name: snapshot.get_format(name),
         error_messages={"required": "InvalidFormat",
                         "invalid_choice": "InvalidFormat"})
     exceptions = forms.CharField(required=False, initial="application/vnd.ogc.se_xml")
@@ -86,11 +114,43 @@ class GetCoverageForm(BaseRequestForm):
     #measurements are the only parameters available as an AxisDescription/rangeset
     measurements = forms.CharField(required=False)
 
+    # vendor specific - snap requests that are nearly on the storage grid onto it to skip resampling
+    snap = forms.CharField(required=False)
+    # vendor specific - mosaic (most recent pixel) or a temporal reduction, e.g. mean, median or percentile_90
+    composite = forms.CharField(required=False)
+
+    def clean_crs(self):
+        """Normalize the crs and ensure that it is an EPSG code"""
+        from . import utils
+
+        crs = utils.normalize_crs(self.cleaned_data['crs'])
+        if not utils.is_valid_crs(crs):
+            raise ValidationError("InvalidParameterValue")
+        return crs
+
     def clean_response_crs(self):
-        """Meant to provide actual default values for various form fields if missing from GET"""
-        if not self['response_crs'].html_name in self.data:
-            return self.fields['response_crs'].initial
-        return self.cleaned_data['response_crs']
+        """The response crs defaults to the request crs - that default is applied in clean"""
+        from . import utils
+
+        if not self.cleaned_data['response_crs']:
+            return None
+        response_crs = utils.normalize_crs(self.cleaned_data['response_crs'])
+        if not utils.is_valid_crs(response_crs):
+            raise ValidationError("InvalidParameterValue")
+        return response_crs
+
+    def clean_snap(self):
+        """SNAP is a boolean - anything but true/1/yes disables snapping"""
+        return self.cleaned_data['snap'].lower() in ("true", "1", "yes")
+
+    def clean_composite(self):
+        """Defaults to the most recent pixel mosaic - other composites must be known to utils.get_accumulator"""
+        from . import utils
+
+        composite = (self.cleaned_data['composite'] or "mosaic").lower()
+        if composite != "mosaic" and utils.get_accumulator(composite, 'float32', 0) is None:
+            raise ValidationError("InvalidParameterValue")
+        return composite
 
     def clean_interpolation(self):
         """Meant to provide actual default values for various form fields if missing from GET"""
@@ -98,6 +158,7 @@ class GetCoverageForm(BaseRequestForm):
             return self.fields['interpolation'].initial
         return self.cleaned_data['interpolation']
 
+    @profiling.timed('clean')
     def clean(self):
         """Basic validation of the GetCoverage parameters according to the OGC WCS 1.0 specification.
 
@@ -107,6 +168,8 @@ class GetCoverageForm(BaseRequestForm):
             Ensures that the ranges entered actually exist in the coverage
 
         """
+        from . import utils
+
         cleaned_data = super(GetCoverageForm, self).clean()
 
         if 'coverage' not in cleaned_data:
@@ -118,7 +181,17 @@ class GetCoverageForm(BaseRequestForm):
             self.add_error("time", "MissingParameterValue")
             return
 
-        coverage_offering = self.cleaned_data['coverage']
+        if 'crs' not in cleaned_data or 'response_crs' not in cleaned_data:
+            return
+
+        coverage_entry = self.cleaned_data['coverage']
+        coverage_offering = coverage_entry.offering
+        self.cleaned_data['coverage'] = coverage_offering
+        self.cleaned_data['catalog_entry'] = coverage_entry
+
+        request_crs = cleaned_data['crs']
+        response_crs = cleaned_data['response_crs'] or request_crs
+        self.cleaned_data['response_crs'] = response_crs
 
         if cleaned_data.get('bbox', None):
             split_bbox = self.cleaned_data['bbox'].split(",")
@@ -128,20 +201,31 @@ class GetCoverageForm(BaseRequestForm):
                 return
 
             try:
-                latitude_range = (float(split_bbox[1]), float(split_bbox[3]))
-                longitude_range = (float(split_bbox[0]), float(split_bbox[2]))
-            except:
+                bounds = (float(split_bbox[0]), float(split_bbox[1]), float(split_bbox[2]), float(split_bbox[3]))
+            except ValueError:
                 self.add_error('bbox', "InvalidParameterValue")
+                return
+
+            # if the ranges are not well formed...
+            if bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+                self.add_error('bbox', "InvalidParameterValue")
+                return
+
+            try:
+                geographic_bounds = utils.transform_bounds(request_crs, utils.GEOGRAPHIC_CRS, bounds)
+            except Exception:
+                self.add_error('bbox', "InvalidParameterValue")
+                return
+            latitude_range = (geographic_bounds[1], geographic_bounds[3])
+            longitude_range = (geographic_bounds[0], geographic_bounds[2])
 
             validation_cases = [
                 not utils._ranges_intersect(latitude_range,
                                             (coverage_offering.min_latitude, coverage_offering.max_latitude)),
                 not utils._ranges_intersect(longitude_range,
-                                            (coverage_offering.min_longitude, coverage_offering.max_longitude)),
-                latitude_range != tuple(sorted(latitude_range)), longitude_range != tuple(sorted(longitude_range))
+                                            (coverage_offering.min_longitude, coverage_offering.max_longitude))
             ]
 
-            # if the ranges are not well formed...
             if True in validation_cases:
                 self.add_error('bbox', "InvalidParameterValue")
                 return
@@ -151,6 +235,12 @@ class GetCoverageForm(BaseRequestForm):
         else:
             self.cleaned_data['latitude'] = (coverage_offering.min_latitude, coverage_offering.max_latitude)
             self.cleaned_data['longitude'] = (coverage_offering.min_longitude, coverage_offering.max_longitude)
+            bounds = utils.transform_bounds(utils.GEOGRAPHIC_CRS, request_crs,
+                                            (coverage_offering.min_longitude, coverage_offering.min_latitude,
+                                             coverage_offering.max_longitude, coverage_offering.max_latitude))
+
+        response_bounds = utils.transform_bounds(request_crs, response_crs, bounds)
+        self.cleaned_data['response_bounds'] = response_bounds
 
         if cleaned_data.get('time', None):
             time_ranges = []
@@ -172,8 +262,7 @@ class GetCoverageForm(BaseRequestForm):
                 except ValueError:
                     self.add_error("time", "InvalidParameterValue")
                     return
-                valid_times = coverage_offering.get_temporal_domain()
-                if len(list(set(valid_times) & set(date_list))) != len(date_list):
+                if not all(coverage_entry.has_time(time) for time in times):
                     self.add_error("time", "InvalidParameterValue")
 
             self.cleaned_data['time_ranges'] = time_ranges
@@ -192,10 +281,9 @@ class GetCoverageForm(BaseRequestForm):
                 self.add_error('height', "InvalidParameterValue")
                 self.add_error('width', "InvalidParameterValue")
                 return
-            self.cleaned_data['resx'] = (
-                self.cleaned_data['longitude'][1] - self.cleaned_data['longitude'][0]) / cleaned_data['width']
-            self.cleaned_data['resy'] = -1 * (
-                self.cleaned_data['latitude'][1] - self.cleaned_data['latitude'][0]) / cleaned_data['height']
+            # resolutions are expressed in the units of the response crs
+            self.cleaned_data['resx'] = (response_bounds[2] - response_bounds[0]) / cleaned_data['width']
+            self.cleaned_data['resy'] = -1 * (response_bounds[3] - response_bounds[1]) / cleaned_data['height']
         else:
             self.add_error('resx', "MissingParameterValue")
             self.add_error('resy', "MissingParameterValue")
@@ -204,15 +292,222 @@ class GetCoverageForm(BaseRequestForm):
             return
 
         if cleaned_data.get('measurements', None):
-            valid_measurements = coverage_offering.get_measurements()
             request_measurements = cleaned_data['measurements'].split(",")
             # if the measurements aren't all valid, raise
-            if len(list(set(valid_measurements) & set(request_measurements))) != len(request_measurements):
+            if not coverage_entry.measurement_set.issuperset(request_measurements):
                 self.add_error("measurements", "InvalidParameterValue")
             else:
                 self.cleaned_data['measurements'] = request_measurements
         else:
-            self.cleaned_data['measurements'] = coverage_offering.get_measurements()
+            self.cleaned_data['measurements'] = list(coverage_entry.measurements)
+
+        # only load the bands that the format's processing reads
+        _format = self.cleaned_data.get('format')
+        required_bands = _format.get_required_bands(coverage_offering) if _format else None
+        if required_bands and coverage_entry.measurement_set.issuperset(required_bands):
+            self.cleaned_data['measurements'] = list(required_bands)
 
         if 'interpolation' in self.cleaned_data:
             self.cleaned_data['resampling'] = INTERPOLATION_OPTIONS.get(self.cleaned_data['interpolation'], 'nearest')
+
+        self.cleaned_data['load_ranges'] = self._plan_datasets(coverage_entry)
+        self._plan_projection(coverage_offering)
+
+    def _plan_datasets(self, coverage_entry):
+        """Get the time ranges to load, dropping any without a dataset footprint that intersects the bbox
+
+        Coverages whose footprints have not been synced load every range.
+
+        """
+        from . import utils
+
+        load_ranges = utils.get_load_ranges(self.cleaned_data['times'], self.cleaned_data['time_ranges'],
+                                             coverage_entry)
+        if not len(coverage_entry.footprints):
+            return load_ranges
+        bounds = (self.cleaned_data['longitude'][0], self.cleaned_data['latitude'][0],
+                  self.cleaned_data['longitude'][1], self.cleaned_data['latitude'][1])
+        return [load_range for load_range in load_ranges if len(coverage_entry.footprints.search(bounds, [load_range]))]
+
+    def _plan_projection(self, coverage_offering):
+        """Decide how the response crs is produced
+
+        Requests in the coverage's native crs are loaded directly at the requested resolution with no warp. Any
+        other response crs is loaded in the native crs, at the native resolution or coarser when the output is much
+        coarser than the storage grid, and then warped by utils.reproject_dataset.
+
+        """
+        from . import utils
+
+        native_crs = utils.normalize_crs(coverage_offering.crs)
+        response_crs = self.cleaned_data['response_crs']
+        resolution = (self.cleaned_data['resy'], self.cleaned_data['resx'])
+        resampling = self.cleaned_data.get('resampling', 'nearest')
+
+        if response_crs == native_crs:
+            self.cleaned_data.update({
+                'output_crs': native_crs,
+                'resolution': resolution,
+                'load_resampling': resampling,
+                'warp': None,
+                'grid_bounds': self._plan_grid(coverage_offering, resolution)
+            })
+            return
+
+        response_bounds = self.cleaned_data['response_bounds']
+        width = (response_bounds[2] - response_bounds[0]) / abs(resolution[1])
+        height = (response_bounds[3] - response_bounds[1]) / abs(resolution[0])
+        native_bounds = utils.transform_bounds(utils.GEOGRAPHIC_CRS, native_crs,
+                                               (self.cleaned_data['longitude'][0], self.cleaned_data['latitude'][0],
+                                                self.cleaned_data['longitude'][1], self.cleaned_data['latitude'][1]))
+        # sample the source at about twice the output resolution, but never finer than the storage grid
+        source_resolution = (-max(abs(coverage_offering.y_resolution), (native_bounds[3] - native_bounds[1]) /
+                                  (2 * max(height, 1))),
+                             max(abs(coverage_offering.x_resolution), (native_bounds[2] - native_bounds[0]) /
+                                 (2 * max(width, 1))))
+        self.cleaned_data.update({
+            'output_crs': native_crs,
+            'resolution': source_resolution,
+            'load_resampling': 'nearest',
+            'grid_bounds': None,
+            'warp': {
+                'src_crs': native_crs,
+                'dst_crs': response_crs,
+                'bounds': response_bounds,
+                'resolution': resolution,
+                'resampling': resampling
+            }
+        })
+
+    def _plan_grid(self, coverage_offering, resolution):
+        """Get the storage grid aligned bounds of a native crs request, None if it has to be resampled
+
+        Requests on the storage grid are passed through as windowed reads. Requests within WCS_GRID_SNAP_TOLERANCE
+        pixels of it (default 0.1) are snapped onto it if the client allows it with SNAP=true.
+
+        """
+        from . import utils
+
+        tolerance = utils.GRID_ALIGNMENT_TOLERANCE
+        if self.cleaned_data.get('snap'):
+            tolerance = max(tolerance, getattr(settings, 'WCS_GRID_SNAP_TOLERANCE', 0.1))
+        grid_bounds = utils.align_to_grid(self.cleaned_data['response_bounds'], resolution,
+                                          (coverage_offering.origin_x, coverage_offering.origin_y),
+                                          (coverage_offering.y_resolution, coverage_offering.x_resolution), tolerance)
+        if grid_bounds is not None:
+            self.cleaned_data['response_bounds'] = grid_bounds
+            self.cleaned_data['resx'], self.cleaned_data['resy'] = (coverage_offering.x_resolution,
+                                                                    coverage_offering.y_resolution)
+        return grid_bounds
+
+
+class GetStatisticsForm(GetCoverageForm):
+    """Vendor specific GetStatistics request form - GetCoverage parameters summarized as per band statistics
+
+    The statistics are computed in the coverage's native crs. Without WIDTH/HEIGHT or RESX/RESY they are computed
+    at the native resolution, and without COMPOSITE over every valid observation rather than over a composite.
+
+    """
+
+    format = forms.ChoiceField(
+        required=False,
+        choices=(("JSON", "JSON"), ("XML", "XML")),
+        error_messages={"invalid_choice": "InvalidFormat"})
+
+    def clean_format(self):
+        return (self.cleaned_data['format'] or "JSON").upper()
+
+    def clean_composite(self):
+        """Statistics default to every valid observation, named None here"""
+        if not self.cleaned_data['composite']:
+            return None
+        return super(GetStatisticsForm, self).clean_composite()
+
+    def clean(self):
+        from . import utils
+
+        coverage_entry = self.cleaned_data.get('coverage')
+        if coverage_entry is not None:
+            self.cleaned_data['response_crs'] = utils.normalize_crs(coverage_entry.offering.crs)
+            if not (self.data.get('width') or self.data.get('height') or self.data.get('resx') or
+                    self.data.get('resy')):
+                self.cleaned_data['resx'] = coverage_entry.offering.x_resolution
+                self.cleaned_data['resy'] = coverage_entry.offering.y_resolution
+        # the output format is not a coverage Format, and statistics are never split into tiles
+        output_format = self.cleaned_data.pop('format', "JSON")
+        super(GetStatisticsForm, self).clean()
+        self.cleaned_data['format'] = None
+        self.cleaned_data['output_format'] = output_format
+
+
+class GetTimeSeriesForm(GetStatisticsForm):
+    """Vendor specific GetTimeSeries request form - the values of a point or a small polygon in every scene
+
+    POINT is an x,y pair and POLYGON a list of "x y" vertices like "x1 y1,x2 y2,x3 y3", both in the request crs.
+    Either replaces BBOX, which is set to the storage grid pixels covering it, so values are read at the native
+    resolution and crs. Polygons may cover at most WCS_DRILL_MAX_PIXELS storage pixels (default 65536).
+
+    """
+
+    format = forms.ChoiceField(
+        required=False,
+        choices=(("JSON", "JSON"), ("CSV", "CSV")),
+        error_messages={"invalid_choice": "InvalidFormat"})
+    point = forms.CharField(required=False)
+    polygon = forms.CharField(required=False)
+
+    def clean_point(self):
+        if not self.cleaned_data['point']:
+            return None
+        try:
+            x, y = (float(value) for value in self.cleaned_data['point'].split(","))
+        except ValueError:
+            raise ValidationError("InvalidParameterValue")
+        return (x, y)
+
+    def clean_polygon(self):
+        if not self.cleaned_data['polygon']:
+            return None
+        try:
+            vertices = [tuple(float(value) for value in vertex.split()) for vertex in
+                        self.cleaned_data['polygon'].split(",")]
+        except ValueError:
+            raise ValidationError("InvalidParameterValue")
+        if len(vertices) < 3 or any(len(vertex) != 2 for vertex in vertices):
+            raise ValidationError("InvalidParameterValue")
+        return vertices
+
+    def clean(self):
+        from . import utils
+
+        coverage_entry = self.cleaned_data.get('coverage')
+        if coverage_entry is None or 'crs' not in self.cleaned_data or self.errors:
+            return super(GetTimeSeriesForm, self).clean()
+        point, polygon = self.cleaned_data.get('point'), self.cleaned_data.get('polygon')
+        if not (point or polygon):
+            self.add_error('point', "MissingParameterValue")
+            self.add_error('polygon', "MissingParameterValue")
+            return
+
+        offering = coverage_entry.offering
+        native_crs = utils.normalize_crs(offering.crs)
+        try:
+            vertices = utils.transform_points(self.cleaned_data['crs'], native_crs, polygon or [point])
+        except Exception:
+            self.add_error('polygon' if polygon else 'point', "InvalidParameterValue")
+            return
+        grid_bounds = utils.expand_to_grid(
+            (min(x for x, _ in vertices), min(y for _, y in vertices), max(x for x, _ in vertices),
+             max(y for _, y in vertices)), (offering.origin_x, offering.origin_y),
+            (offering.y_resolution, offering.x_resolution))
+        pixels = round((grid_bounds[2] - grid_bounds[0]) / offering.x_resolution) * round(
+            (grid_bounds[3] - grid_bounds[1]) / -offering.y_resolution)
+        if pixels > getattr(settings, 'WCS_DRILL_MAX_PIXELS', 256 * 256):
+            self.add_error('polygon', "InvalidParameterValue")
+            return
+
+        self.cleaned_data['crs'] = native_crs
+        self.cleaned_data['bbox'] = ",".join(repr(value) for value in grid_bounds)
+        self.cleaned_data['geometry'] = {
+            'type': 'Polygon', 'coordinates': [vertices + vertices[:1]]} if polygon else None
+        super(GetTimeSeriesForm, self).clean()
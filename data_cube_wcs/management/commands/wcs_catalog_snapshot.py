@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data_cube_wcs import catalog
+
+
+class Command(BaseCommand):
+    help = ("Write the catalog snapshot file mapped by the workers. The catalog sync writes it automatically, use "
+            "this after editing coverages or formats through the admin panel.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Snapshot path. Defaults to the WCS_CATALOG_SNAPSHOT_PATH setting.")
+
+    def handle(self, *args, **options):
+        snapshot = catalog.write_snapshot(options['path'])
+        if snapshot is None:
+            raise CommandError("Set WCS_CATALOG_SNAPSHOT_PATH or pass --path.")
+        self.stdout.write("Wrote catalog version {} with {} coverages.".format(snapshot.version,
+                                                                               len(snapshot.coverages)))
@@ -0,0 +1,258 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import NoReverseMatch, reverse
+
+from data_cube_wcs import models
+
+LOG_REQUEST_PATTERN = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+
+
+def parse_log(lines):
+    """Extract the GET parameters of each request in access-log style lines
+
+    Lines can be combined/common log format lines or bare urls/query strings.
+
+    """
+    requests = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        match = LOG_REQUEST_PATTERN.search(line)
+        target = match.group(1) if match else line
+        query = urlsplit(target).query if '?' in target else target
+        parameters = dict(parse_qsl(query, keep_blank_values=True))
+        if parameters:
+            requests.append(parameters)
+    return requests
+
+
+def tile_walk(coverage, times, rng, steps=20, tile_size=256, min_zoom=0, max_zoom=6, time_probability=0.5):
+    """Generate the requests of one QGIS-like session panning and zooming over a coverage
+
+    A session starts with GetCapabilities and DescribeCoverage, then requests viewport sized tiles while randomly
+    panning to a neighbouring tile or zooming in/out around the current position.
+
+    """
+    yield {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCapabilities"}
+    yield {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "DescribeCoverage", 'COVERAGE': coverage.name}
+
+    lon_span = coverage.max_longitude - coverage.min_longitude
+    lat_span = coverage.max_latitude - coverage.min_latitude
+    zoom = rng.randint(min_zoom, max_zoom)
+    column, row = rng.randrange(2**zoom), rng.randrange(2**zoom)
+
+    for _ in range(steps):
+        tiles = 2**zoom
+        tile_width, tile_height = lon_span / tiles, lat_span / tiles
+        min_lon = coverage.min_longitude + column * tile_width
+        min_lat = coverage.min_latitude + row * tile_height
+        parameters = {
+            'SERVICE': "WCS",
+            'VERSION': "1.0.0",
+            'REQUEST': "GetCoverage",
+            'COVERAGE': coverage.name,
+            'CRS': "EPSG:4326",
+            'RESPONSE_CRS': "EPSG:4326",
+            'BBOX': "{},{},{},{}".format(min_lon, min_lat, min_lon + tile_width, min_lat + tile_height),
+            'WIDTH': tile_size,
+            'HEIGHT': tile_size,
+            'FORMAT': "GeoTIFF"
+        }
+        if times and rng.random() < time_probability:
+            parameters['TIME'] = rng.choice(times)
+        yield parameters
+
+        action = rng.random()
+        if action < 0.15 and zoom < max_zoom:
+            zoom, column, row = zoom + 1, column * 2 + rng.randint(0, 1), row * 2 + rng.randint(0, 1)
+        elif action < 0.3 and zoom > min_zoom:
+            zoom, column, row = zoom - 1, column // 2, row // 2
+        else:
+            tiles = 2**zoom
+            column = min(max(column + rng.randint(-1, 1), 0), tiles - 1)
+            row = min(max(row + rng.randint(-1, 1), 0), tiles - 1)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class InProcessDriver(object):
+    """Issues requests through the Django test client, one client per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def __call__(self, parameters):
+        if not hasattr(self._local, 'client'):
+            self._local.client = Client()
+        response = self._local.client.get(self.path, parameters)
+        return response.status_code, response.get('Content-Type', ''), len(response.content)
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpDriver(object):
+    """Issues requests to a running server"""
+
+    def __init__(self, url, timeout=300):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, parameters):
+        try:
+            with urlopen("{}?{}".format(self.url, urlencode(parameters)), timeout=self.timeout) as response:
+                return response.status, response.headers.get('Content-Type', ''), len(response.read())
+        except HTTPError as error:
+            return error.code, error.headers.get('Content-Type', ''), 0
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Replay access-log requests or generate QGIS-like tile walks against the WCS concurrently, reporting "
+            "latency percentiles, throughput and error rates per operation.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help="Access log or file of urls/query strings to replay.")
+        parser.add_argument('--coverage', help="Coverage for synthetic tile walks. Defaults to all coverages.")
+        parser.add_argument('--sessions', type=int, default=10, help="Number of synthetic tile walk sessions.")
+        parser.add_argument('--steps', type=int, default=20, help="Tile requests per synthetic session.")
+        parser.add_argument('--tile-size', type=int, default=256)
+        parser.add_argument('--max-zoom', type=int, default=6)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--url', help="Drive a running server at this url instead of the in-process view.")
+        parser.add_argument('--path', help="Url path of the in-process web service. Defaults to the reversed url.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the json report to this path.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sessions = self._load_sessions(options, rng)
+        driver = HttpDriver(options['url']) if options['url'] else InProcessDriver(self._path(options))
+
+        results = defaultdict(list)
+        lock = threading.Lock()
+
+        def _run_session(session):
+            for parameters in session:
+                operation = {key.lower(): value for key, value in parameters.items()}.get('request', "Unknown")
+                started = time.perf_counter()
+                try:
+                    status, content_type, size = driver(parameters)
+                except Exception:
+                    status, content_type, size = None, '', 0
+                elapsed = time.perf_counter() - started
+                error = status != 200 or 'se_xml' in content_type
+                with lock:
+                    results[operation].append((elapsed, error, size))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(_run_session, sessions))
+        elapsed = time.perf_counter() - started
+        driver.close()
+
+        report = self._report(results, elapsed, options['concurrency'])
+        self._print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def _path(self, options):
+        if options['path']:
+            return options['path']
+        try:
+            return reverse('web_service')
+        except NoReverseMatch:
+            raise CommandError("Could not reverse the web_service url - pass --path.")
+
+    def _load_sessions(self, options, rng):
+        """Split the replayed log into one session per worker or generate synthetic tile walk sessions"""
+        if options['log']:
+            with open(options['log']) as log:
+                requests = parse_log(log)
+            if not requests:
+                raise CommandError("No requests found in {}.".format(options['log']))
+            concurrency = options['concurrency']
+            return [requests[index::concurrency] for index in range(concurrency)]
+
+        coverages = models.CoverageOffering.objects.all()
+        if options['coverage']:
+            coverages = coverages.filter(name=options['coverage'])
+        coverages = list(coverages)
+        if not coverages:
+            raise CommandError("No coverages available for synthetic tile walks.")
+        times = {coverage.name: coverage.get_temporal_domain() for coverage in coverages}
+
+        sessions = []
+        for _ in range(options['sessions']):
+            coverage = rng.choice(coverages)
+            session_rng = random.Random(rng.random())
+            sessions.append(
+                list(
+                    tile_walk(
+                        coverage,
+                        times[coverage.name],
+                        session_rng,
+                        steps=options['steps'],
+                        tile_size=options['tile_size'],
+                        max_zoom=options['max_zoom'])))
+        return sessions
+
+    def _report(self, results, elapsed, concurrency):
+        operations = {}
+        for operation, samples in sorted(results.items()):
+            latencies = [sample[0] * 1000 for sample in samples]
+            errors = sum(1 for sample in samples if sample[1])
+            operations[operation] = {
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': errors / len(samples),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'max_ms': max(latencies),
+                'throughput_rps': len(samples) / elapsed,
+                'response_bytes': sum(sample[2] for sample in samples)
+            }
+        total = sum(operation['requests'] for operation in operations.values())
+        return {
+            'concurrency': concurrency,
+            'duration_s': elapsed,
+            'requests': total,
+            'throughput_rps': total / elapsed if elapsed else 0,
+            'operations': operations
+        }
+
+    def _print_report(self, report):
+        self.stdout.write("{} requests in {:.2f}s with concurrency {} - {:.2f} req/s".format(
+            report['requests'], report['duration_s'], report['concurrency'], report['throughput_rps']))
+        self.stdout.write("{:<18} {:>8} {:>8} {:>10} {:>10} {:>10} {:>9}".format("operation", "requests", "errors",
+                                                                                "p50 ms", "p95 ms", "p99 ms",
+                                                                                "req/s"))
+        for operation, stats in report['operations'].items():
+            self.stdout.write("{:<18} {:>8} {:>7.1%} {:>10.1f} {:>10.1f} {:>10.1f} {:>9.2f}".format(
+                operation, stats['requests'], stats['error_rate'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['throughput_rps']))
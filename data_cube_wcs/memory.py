@@ -0,0 +1,257 @@
+"""Per-process memory budget for GetCoverage requests and a watchdog recycling workers whose memory creeps up
+
+Every admitted request reserves its predicted peak memory from the WCS_MEMORY_BUDGET bytes of its process (default
+0, no budget) before it loads anything, waiting up to WCS_MEMORY_WAIT seconds (default 30) for other requests to
+release theirs and getting a 503 with Retry-After: WCS_MEMORY_RETRY_AFTER (default 10) otherwise. A request
+predicted to need more than the whole budget runs once nothing else is reserved.
+
+The prediction is output pixels x bands x WCS_MEMORY_BYTES_PER_SAMPLE (default 8) for every copy held at once - the
+loaded batch of scenes, the mosaic and WCS_MEMORY_COPIES (default 3) processing and encoding copies. The resident
+memory of a request is sampled at the end of each pipeline stage, and the ratio of the growth to the prediction of
+requests that ran alone calibrates later predictions.
+
+With WCS_MEMORY_RECYCLE_RSS (absolute) or WCS_MEMORY_RECYCLE_GROWTH (over the resident memory after the first
+request) set, a watchdog checks the resident memory of the idle process every WCS_MEMORY_WATCHDOG_INTERVAL seconds
+(default 10) and after each request. A process over the limit stops admitting requests and sends itself
+WCS_MEMORY_RECYCLE_SIGNAL (default SIGTERM), which pre-fork servers like gunicorn and uwsgi handle by replacing the
+worker once its requests are done.
+
+"""
+import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+from . import scheduler
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# bounds of the calibration factor applied to predictions and the weight of each new sample
+CALIBRATION_LIMITS = (0.5, 4.0)
+CALIBRATION_WEIGHT = 0.2
+
+
+def get_rss():
+    """Get the resident memory of this process in bytes - the peak resident memory where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def predict_peak(cleaned_data):
+    """Predict the peak memory of a validated GetCoverage request in bytes, before calibration
+
+    Tiled requests only hold the tiles rendered at once.
+
+    """
+    from . import tiling
+
+    width, height, _ = tiling.get_output_grid(cleaned_data)
+    pixels = width * height
+    if tiling.should_tile(cleaned_data):
+        tile_size = getattr(settings, 'WCS_TILE_SIZE', 2048)
+        pixels = min(pixels, tile_size**2 * getattr(settings, 'WCS_TILE_WORKERS', 2))
+    scenes = min(max(len(cleaned_data['load_ranges']), 1), getattr(settings, 'WCS_MOSAIC_BATCH_SIZE', 2))
+    copies = scenes + 1 + getattr(settings, 'WCS_MEMORY_COPIES', 3)
+    return pixels * max(len(cleaned_data['measurements']), 1) * copies * getattr(
+        settings, 'WCS_MEMORY_BYTES_PER_SAMPLE', 8)
+
+
+class Reservation(object):
+    """Memory reserved by a request and the resident memory sampled while it runs"""
+
+    def __init__(self, predicted, reserved):
+        self.predicted = predicted
+        self.reserved = reserved
+        self.start_rss = get_rss()
+        self.peak_rss = self.start_rss
+        self.alone = True
+
+    def sample(self, stage_name):
+        rss = get_rss()
+        self.peak_rss = max(self.peak_rss, rss)
+        metrics.memory_stage_rss.observe(max(rss - self.start_rss, 0), stage=stage_name)
+
+
+class MemoryBudget(object):
+    """Reservations of predicted peak memory against the budget of a process
+
+    Args:
+        limit: bytes that requests may reserve at once
+
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.reserved = 0
+        self.calibration = 1.0
+        self.recycling = False
+        self._reservations = set()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, predicted):
+        """Reserve the calibrated prediction of a request for the duration of the context
+
+        Raises:
+            SchedulerBusy if the memory wasn't released in time
+
+        """
+        nbytes = min(int(predicted * self.calibration), self.limit)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.reserved + nbytes <= self.limit,
+                                            timeout=getattr(settings, 'WCS_MEMORY_WAIT', 30)):
+                self._reject('timeout')
+            self.reserved += nbytes
+            reservation = Reservation(predicted, nbytes)
+            for other in self._reservations:
+                other.alone = reservation.alone = False
+            self._reservations.add(reservation)
+        metrics.memory_reservations.inc(result='reserved')
+        previous, _local.reservation = getattr(_local, 'reservation', None), reservation
+        try:
+            yield reservation
+        finally:
+            _local.reservation = previous
+            with self._condition:
+                self._reservations.discard(reservation)
+                self.reserved -= nbytes
+                if reservation.alone and predicted:
+                    self._calibrate((reservation.peak_rss - reservation.start_rss) / predicted)
+                self._condition.notify_all()
+
+    def _calibrate(self, ratio):
+        # a request that only reused freed memory tells nothing about its peak
+        if ratio <= 0:
+            return
+        calibration = (1 - CALIBRATION_WEIGHT) * self.calibration + CALIBRATION_WEIGHT * ratio
+        self.calibration = min(max(calibration, CALIBRATION_LIMITS[0]), CALIBRATION_LIMITS[1])
+
+    def _reject(self, reason):
+        metrics.memory_reservations.inc(result=reason)
+        raise scheduler.SchedulerBusy('memory', getattr(settings, 'WCS_MEMORY_RETRY_AFTER', 10), reason)
+
+    @property
+    def idle(self):
+        return not self._reservations
+
+
+class Watchdog(object):
+    """Recycles the process once its idle resident memory is over WCS_MEMORY_RECYCLE_RSS or has grown by more than
+    WCS_MEMORY_RECYCLE_GROWTH bytes since the first request
+
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.baseline = None
+        self.stopped = False
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled():
+        return bool(getattr(settings, 'WCS_MEMORY_RECYCLE_RSS', 0) or
+                    getattr(settings, 'WCS_MEMORY_RECYCLE_GROWTH', 0))
+
+    def start(self):
+        """Start the watchdog thread of this process if recycling is enabled"""
+        if not self.enabled():
+            return
+        with self._lock:
+            # threads aren't inherited by forked workers
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="wcs-memory-watchdog", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self.stopped and not self.budget.recycling:
+            time.sleep(getattr(settings, 'WCS_MEMORY_WATCHDOG_INTERVAL', 10))
+            self.check()
+
+    def check(self):
+        """Recycle the process if it is idle and over the limits"""
+        if self.stopped or not self.enabled() or self.budget.recycling or not self.budget.idle:
+            return
+        rss = get_rss()
+        if self.baseline is None:
+            self.baseline = rss
+        limit = getattr(settings, 'WCS_MEMORY_RECYCLE_RSS', 0)
+        growth = getattr(settings, 'WCS_MEMORY_RECYCLE_GROWTH', 0)
+        if (limit and rss > limit) or (growth and rss - self.baseline > growth):
+            self.recycle(rss)
+
+    def recycle(self, rss):
+        with self.budget._condition:
+            if self.budget.recycling:
+                return
+            self.budget.recycling = True
+        logger.warning("Recycling worker %s with %.1fMB resident memory (%.1fMB after the first request).",
+                       os.getpid(), rss / 2**20, (self.baseline or rss) / 2**20)
+        metrics.memory_reservations.inc(result='recycled')
+        metrics.REGISTRY.flush()
+        os.kill(os.getpid(), getattr(settings, 'WCS_MEMORY_RECYCLE_SIGNAL', signal.SIGTERM))
+
+
+_watchdog = None
+_lock = threading.Lock()
+
+
+def get_watchdog():
+    """Get the watchdog of this process and its memory budget, created from the settings on first use"""
+    global _watchdog
+    if _watchdog is None:
+        with _lock:
+            if _watchdog is None:
+                _watchdog = Watchdog(MemoryBudget(getattr(settings, 'WCS_MEMORY_BUDGET', 0)))
+    return _watchdog
+
+
+def reset():
+    """Drop the memory budget and watchdog so that they are rebuilt from the settings"""
+    global _watchdog
+    with _lock:
+        if _watchdog is not None:
+            _watchdog.stopped = True
+        _watchdog = None
+
+
+@contextmanager
+def reserve(cleaned_data):
+    """Reserve the predicted peak memory of a validated GetCoverage request from the budget of this process
+
+    Raises:
+        SchedulerBusy if the memory wasn't available in time or the process is being recycled
+
+    """
+    watchdog = get_watchdog()
+    budget = watchdog.budget
+    watchdog.start()
+    if budget.recycling:
+        budget._reject('recycling')
+    try:
+        # without a budget nothing is reserved, but requests are still tracked for the watchdog and stage metrics
+        with budget.reserve(predict_peak(cleaned_data) if budget.limit else 0) as reservation:
+            yield reservation
+    finally:
+        watchdog.check()
+
+
+def record_stage(name):
+    """Sample the resident memory of the request handled by this thread at the end of a pipeline stage"""
+    reservation = getattr(_local, 'reservation', None)
+    if reservation is not None:
+        reservation.sample(name)
@@ -0,0 +1,320 @@
+import atexit
+import fcntl
+import glob
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+BYTE_BUCKETS = tuple(4**exponent * 1024 for exponent in range(1, 13)) + (math.inf,)
+
+
+class Metric(object):
+    """Base class for a labelled metric whose values are stored by the registry"""
+
+    metric_type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.update(self.name, self._key(labels), lambda value: (value or 0) + amount)
+
+    def collect(self, values):
+        for key, value in sorted(values.items()):
+            yield "{}{} {}".format(self.name, self._format_labels(key), _format_value(value))
+
+    @staticmethod
+    def merge(first, second):
+        return first + second
+
+
+class Histogram(Metric):
+    """Distribution of observed values over a fixed set of cumulative buckets"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(registry, name, documentation, labelnames=labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        """Stored as [per bucket counts..., sum] - the total count is the sum of the bucket counts"""
+
+        def _observe(value):
+            value = value or [0] * (len(self.buckets) + 1)
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[index] += 1
+                    break
+            value[-1] += amount
+            return value
+
+        self.registry.update(self.name, self._key(labels), _observe)
+
+    def collect(self, values):
+        for key, value in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, value[:-1]):
+                cumulative += count
+                yield "{}_bucket{} {}".format(self.name, self._format_labels(key, [('le', _format_value(bound))]),
+                                              cumulative)
+            yield "{}_sum{} {}".format(self.name, self._format_labels(key), _format_value(value[-1]))
+            yield "{}_count{} {}".format(self.name, self._format_labels(key), cumulative)
+
+    @staticmethod
+    def merge(first, second):
+        return [a + b for a, b in zip(first, second)]
+
+
+class Registry(object):
+    """In-process metrics registry
+
+    Values are kept in a plain dictionary guarded by a single lock so recording a value is a dictionary update.
+    For pre-fork servers, set WCS_METRICS_DIR to a directory shared by all workers - each process then
+    periodically writes its values to its own file and the exposition merges the files of every process. The
+    files of exited processes are folded into a retired file, so counters never go backwards when workers are
+    replaced.
+
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        # held while a snapshot is taken and written, so an older snapshot never replaces a newer one
+        self._flush_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_flush = 0
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames=labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames=labelnames, buckets=buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def update(self, name, key, func):
+        with self._lock:
+            if os.getpid() != self._pid:
+                # values recorded before a fork belong to the parent process
+                self._pid = os.getpid()
+                self._values = {}
+            values = self._values.setdefault(name, {})
+            values[key] = func(values.get(key))
+        self._maybe_flush()
+
+    def _directory(self):
+        return getattr(settings, 'WCS_METRICS_DIR', None)
+
+    def _maybe_flush(self):
+        directory = self._directory()
+        if directory and time.monotonic() - self._last_flush > getattr(settings, 'WCS_METRICS_FLUSH_INTERVAL', 1):
+            # requests never wait for another thread's flush
+            if self._flush_lock.acquire(blocking=False):
+                try:
+                    self._flush(directory)
+                finally:
+                    self._flush_lock.release()
+
+    def flush(self, directory=None):
+        """Write this process's values to its file in the shared metrics directory"""
+        directory = directory or self._directory()
+        if not directory:
+            return
+        with self._flush_lock:
+            self._flush(directory)
+
+    def _flush(self, directory):
+        self._last_flush = time.monotonic()
+        with self._lock:
+            data = _serialize(self._values)
+        _write_json(os.path.join(directory, "metrics_{}.json".format(os.getpid())), data)
+
+    def _collect_values(self):
+        """Merge the values of this process with those written by every other process"""
+        with self._lock:
+            merged = {name: dict(values) for name, values in self._values.items()}
+
+        directory = self._directory()
+        if not directory:
+            return merged
+
+        for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+            pid = _get_file_pid(path)
+            if pid is not None and not _is_alive(pid):
+                self._retire(directory, path)
+
+        # a retirement moves values between files, which must not be seen half done
+        with _directory_lock(directory, fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+                if _get_file_pid(path) != os.getpid():
+                    self._merge(merged, _read_json(path) or {})
+        return merged
+
+    def _merge(self, merged, data):
+        """Merge the values of a metrics file into a dictionary of values by metric name"""
+        for name, entries in data.items():
+            if name not in self.metrics:
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in entries:
+                key = tuple(key)
+                values[key] = self.metrics[name].merge(values[key], value) if key in values else value
+        return merged
+
+    def _retire(self, directory, path):
+        """Fold the file of an exited process into the retired file of the metrics directory"""
+        with _directory_lock(directory, fcntl.LOCK_EX):
+            data = _read_json(path)
+            if data is None:
+                # already retired by another process
+                return
+            retired_path = os.path.join(directory, RETIRED_FILE)
+            retired = self._merge(self._merge({}, _read_json(retired_path) or {}), data)
+            _write_json(retired_path, _serialize(retired))
+            os.remove(path)
+
+    def exposition(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        values = self._collect_values()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append("# HELP {} {}".format(name, metric.documentation))
+            lines.append("# TYPE {} {}".format(name, metric.metric_type))
+            lines.extend(metric.collect(values.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+RETIRED_FILE = "metrics_retired.json"
+
+
+def _get_file_pid(path):
+    """Get the pid of the process that writes a metrics file, None for the retired file"""
+    name = os.path.basename(path)[len("metrics_"):-len(".json")]
+    return int(name) if name.isdigit() else None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path):
+    """Read a metrics file, None if it doesn't exist"""
+    try:
+        with open(path) as _file:
+            return json.load(_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    """Atomically replace a metrics file, through a temporary file unique to the call"""
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".metrics", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w') as output:
+            json.dump(data, output)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def _serialize(values):
+    return {name: [[list(key), value] for key, value in metric_values.items()]
+            for name, metric_values in values.items()}
+
+
+@contextmanager
+def _directory_lock(directory, operation):
+    """Hold an advisory lock on a metrics directory shared by every process writing to it"""
+    with open(os.path.join(directory, ".metrics.lock"), 'a') as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+requests_total = REGISTRY.counter('wcs_requests_total', "Total WCS requests by operation and http status.",
+                                  ('operation', 'status'))
+request_duration = REGISTRY.histogram('wcs_request_duration_seconds', "WCS request latency by operation.",
+                                      ('operation',))
+service_exceptions = REGISTRY.counter('wcs_service_exceptions_total', "Service exceptions returned by code.",
+                                      ('code',))
+coverage_load_bytes = REGISTRY.histogram(
+    'wcs_coverage_load_bytes', "Bytes loaded from the Data Cube per GetCoverage request.", ('coverage',),
+    buckets=BYTE_BUCKETS)
+mosaic_loads = REGISTRY.counter(
+    'wcs_mosaic_loads_total', "Scene batch loads of most recent pixel mosaics, loaded or skipped once complete.",
+    ('coverage', 'result'))
+cache_requests = REGISTRY.counter('wcs_cache_requests_total', "Cache lookups by cache and result.",
+                                  ('cache', 'result'))
+process_pool_jobs = REGISTRY.counter(
+    'wcs_process_pool_jobs_total', "Responses processed and encoded in the process pool, by result.", ('result',))
+scheduler_requests = REGISTRY.counter(
+    'wcs_scheduler_requests_total', "GetCoverage requests admitted or rejected by the scheduler, by lane.",
+    ('lane', 'result'))
+scheduler_wait = REGISTRY.histogram(
+    'wcs_scheduler_wait_seconds', "Time GetCoverage requests waited for a scheduler slot, by lane.", ('lane',))
+tile_renders = REGISTRY.counter(
+    'wcs_tile_renders_total', "GetCoverage tiles by renderer - a peer url or 'local' - and result.",
+    ('renderer', 'result'))
+memory_reservations = REGISTRY.counter(
+    'wcs_memory_reservations_total', "GetCoverage memory reservations and worker recycles, by result.", ('result',))
+memory_stage_rss = REGISTRY.histogram(
+    'wcs_memory_stage_rss_bytes', "Resident memory growth of GetCoverage requests at the end of each stage.",
+    ('stage',), buckets=BYTE_BUCKETS)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup - the hit ratio is derived from the hit/miss results"""
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
@@ -1,10 +1,11 @@
+import json
+
 from django.db import models
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 import pytz
-import datacube
-import pandas as pd
 
-from . import utils
+from . import catalog
+from . import profiling
 
 
 class CoverageOffering(models.Model):
@@ -36,6 +37,12 @@ class CoverageOffering(models.Model):
 
     offer_temporal = models.BooleanField(default=True)
 
+    # fuse acquisitions of the same pass, e.g. adjacent path/rows, into a single time slice
+    GROUP_BY_CHOICES = (("", "None"), ("solar_day", "Solar day"), ("window", "Time window"))
+    group_by = models.CharField(max_length=20, blank=True, default="", choices=GROUP_BY_CHOICES)
+    # seconds from the first acquisition of a group when group_by is window
+    group_window = models.IntegerField(default=0)
+
     def __str__(self):
         return self.name
 
@@ -56,11 +63,17 @@ class CoverageOffering(models.Model):
         return self.end_time.isoformat()
 
     def get_temporal_domain(self):
-        """The temporal domain is specified as one or more iso8601 datetimes"""
-        return [
-            date.get_timestring()
-            for date in CoverageTemporalDomainEntry.objects.filter(coverage_offering=self).order_by('date')
-        ]
+        """The temporal domain is specified as one or more iso8601 datetimes
+
+        Grouped coverages list the first acquisition of each group of fused acquisitions.
+
+        """
+        dates = CoverageTemporalDomainEntry.objects.filter(coverage_offering=self).order_by('date')
+        if not self.group_by:
+            return [date.get_timestring() for date in dates]
+        groups = catalog.group_timestamps([catalog.to_timestamp(date.date) for date in dates], self.group_by,
+                                          self.group_window, (self.min_longitude + self.max_longitude) / 2)
+        return [catalog.from_timestamp(first).isoformat() for first, _ in groups]
 
     def get_rangeset(self):
         """Get the set of rangeset entries that match this coverage"""
@@ -81,8 +94,11 @@ class CoverageOffering(models.Model):
     @classmethod
     def update_or_create_coverages(cls, update_aux=False):
         """Uses the Data Cube data access api to update database representations of coverages"""
+        import pandas as pd
+
+        from . import utils
 
-        with datacube.Datacube(config=utils.config_from_settings()) as dc:
+        with utils.datacube_from_settings() as dc:
             product_details = dc.list_products()[dc.list_products()['format'] == "NetCDF"]
             product_details['label'] = product_details.apply(
                 lambda row: "{} - {}".format(row['platform'], row['name']), axis=1)
@@ -151,13 +167,18 @@ class CoverageOffering(models.Model):
         if update_aux:
             cls.create_rangeset()
             cls.create_temporal_domain()
+            cls.create_footprints()
+            cls.update_composites()
+
+        catalog.write_snapshot()
 
     @classmethod
     def create_temporal_domain(cls):
         """Save off a series of date models for each coverage acquisition date"""
+        from . import utils
 
         def get_acquisition_dates(coverage):
-            with datacube.Datacube(config=utils.config_from_settings()) as dc:
+            with utils.datacube_from_settings() as dc:
                 return map(lambda d: d.replace(tzinfo=pytz.UTC), utils.list_acquisition_dates(dc, coverage.name))
 
         for coverage in cls.objects.all():
@@ -169,10 +190,43 @@ class CoverageOffering(models.Model):
 
             CoverageTemporalDomainEntry.objects.bulk_create(temporal_domain)
 
+        catalog.write_snapshot()
+
+    @classmethod
+    def create_footprints(cls):
+        """Replace the dataset footprints of each coverage with the datasets currently indexed in the Data Cube"""
+        from . import utils
+
+        with utils.datacube_from_settings() as dc:
+            for coverage in cls.objects.all():
+                footprints = [
+                    CoverageDatasetFootprint(coverage_offering=coverage, **utils.get_dataset_footprint(dataset))
+                    for dataset in dc.find_datasets(product=coverage.name)
+                ]
+                with transaction.atomic():
+                    CoverageDatasetFootprint.objects.filter(coverage_offering=coverage).delete()
+                    CoverageDatasetFootprint.objects.bulk_create(footprints)
+
+        # bulk_create doesn't send post_save
+        catalog.invalidate()
+        catalog.write_snapshot()
+
+    @classmethod
+    def update_composites(cls):
+        """Add the newest scenes of each coverage to its materialized composite if WCS_COMPOSITE_DIR is set"""
+        from . import composites
+
+        if composites.get_composite_path("") is None:
+            return
+        for coverage in cls.objects.all():
+            composites.update_composite(coverage)
+
     @classmethod
     def create_rangeset(cls):
         """Save off a model for each band/nodata value"""
-        with datacube.Datacube(config=utils.config_from_settings()) as dc:
+        from . import utils
+
+        with utils.datacube_from_settings() as dc:
             for coverage in cls.objects.all():
                 bands = dc.list_measurements().ix[coverage.name]
                 nodata_values = bands['nodata'].values
@@ -187,6 +241,8 @@ class CoverageOffering(models.Model):
 
                 CoverageRangesetEntry.objects.bulk_create(rangeset)
 
+        catalog.write_snapshot()
+
 
 class CoverageTemporalDomainEntry(models.Model):
     """Holds the temporal domain of given coverages so they don't need to be fetched by the DC API each call"""
@@ -209,6 +265,32 @@ class CoverageRangesetEntry(models.Model):
     null_value = models.FloatField(default=-9999)
 
 
+class CoverageDatasetFootprint(models.Model):
+    """Holds the time, extent and file locations of a single Data Cube dataset of a coverage
+
+    Lets the GetCoverage planner find the datasets intersecting a request without querying the Data Cube index.
+
+    """
+
+    coverage_offering = models.ForeignKey(CoverageOffering, on_delete=models.CASCADE)
+    dataset_id = models.CharField(max_length=36)
+    time = models.DateTimeField()
+    min_latitude = models.FloatField()
+    max_latitude = models.FloatField()
+    min_longitude = models.FloatField()
+    max_longitude = models.FloatField()
+    uri = models.CharField(max_length=1000, blank=True)
+    # json object of band name -> file path
+    band_paths = models.TextField(default="{}")
+
+    class Meta:
+        unique_together = (('coverage_offering', 'dataset_id'))
+        index_together = (('coverage_offering', 'time'))
+
+    def get_band_paths(self):
+        return json.loads(self.band_paths)
+
+
 class Format(models.Model):
     """Contains a format and the content-type headers for a GetCoverage response"""
 
@@ -232,14 +314,30 @@ class Format(models.Model):
             Http formatted bytes-like response
 
         """
+        from . import process_pool
+        from . import utils
+
+        response = process_pool.process_and_encode(self, coverage_offering, dataset, crs)
+        if response is not None:
+            return response
+
         response_mapping = {
             'GeoTIFF': utils.get_tiff_response,
             'RGB_GeoTIFF': utils.get_tiff_response,
             'Filtered_GeoTIFF': utils.get_tiff_response,
             'netCDF': utils.get_netcdf_response
         }
-        return response_mapping.get(self.name, utils.get_tiff_response)(
-            coverage_offering, self.process_dataset(coverage_offering, dataset), crs)
+        with profiling.stage('process'):
+            dataset = self.process_dataset(coverage_offering, dataset)
+        return response_mapping.get(self.name, utils.get_tiff_response)(coverage_offering, dataset, crs)
+
+    def get_required_bands(self, coverage_offering):
+        """Get the bands the processing of this format reads for a coverage, None if it uses whatever is loaded
+
+        Lets the load planner read only these measurements rather than every band of the coverage.
+
+        """
+        return self._get_processing(coverage_offering)[0]
 
     def process_dataset(self, coverage_offering, dataset):
         """Apply any preprocessing affiliated with the format type here
@@ -251,29 +349,10 @@ class Format(models.Model):
         and on self.name
 
         """
+        return dataset.pipe(self._get_processing(coverage_offering)[1])
 
-        def abs_divide(ds, bands):
-            ds["_".join(bands)] = abs(ds[bands[0]] / ds[bands[1]])
-            return ds[[*bands, "_".join(bands)]]
-
-        # this is pretty much all bad
-        processing_map = {
-            'RGB_GeoTIFF': {
-                'landsat': lambda ds: ds[['red', 'green', 'blue']],
-                'alos': lambda ds: ds.pipe(abs_divide, bands=['hh', 'hv']).fillna(0),
-                'sentinel': lambda ds: ds.pipe(abs_divide, bands=['vv', 'vh']).fillna(0)
-            },
-            'Filtered_GeoTIFF': {
-                'landsat': lambda ds: ds[['red', 'green', 'blue','nir','swir1','swir2']]
-                                        .where(utils.create_bit_mask(ds['pixel_qa'], valid_bits=[1, 2]))
-                                        .fillna(-9999)
-            }
-        }
-
-        _type = 'landsat' if any(
-            ext in coverage_offering.name for ext in ['ls5', 'ls7', 'ls8']
-        ) else 'sentinel' if 's1_gamma' in coverage_offering.name else 'alos' if 'alos' in coverage_offering.name else ""
-
-        processing_function = processing_map.get(self.name, {}).get(_type, lambda d: d)
+    def _get_processing(self, coverage_offering):
+        """Get the (input bands, processing function) pair of this format for a coverage"""
+        from . import utils
 
-        return dataset.pipe(processing_function)
+        return utils.get_format_processing(self.name, coverage_offering.name)
@@ -0,0 +1,194 @@
+"""Optional process pool for the CPU bound format processing and encoding of large GetCoverage responses
+
+Processing and encoding run under the GIL in the request thread, so a single large request keeps one core busy
+while the others idle. With WCS_PROCESS_POOL_SIZE set, responses of at least WCS_PROCESS_POOL_MIN_BYTES are
+processed and encoded in a pool of worker processes instead. The loaded bands are copied once into shared memory
+blocks that the workers map without copying, and the workers return the encoded bytes.
+
+Workers are spawned, so they need DJANGO_SETTINGS_MODULE in the environment. They never set up Django or touch the
+database - everything the processing needs is passed with the job.
+
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import metrics
+from . import profiling
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Get this process's pool of WCS_PROCESS_POOL_SIZE workers, None if the pool is disabled"""
+    global _pool, _pool_pid
+    size = getattr(settings, 'WCS_PROCESS_POOL_SIZE', 0)
+    if not size:
+        return None
+    with _pool_lock:
+        # a pool inherited from a parent process can't be used
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context(getattr(settings, 'WCS_PROCESS_POOL_START_METHOD', 'spawn'))
+            _pool = ProcessPoolExecutor(max_workers=size, mp_context=context, initializer=_initialize_worker)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown():
+    """Stop the workers of the pool, which is recreated on next use"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _initialize_worker():
+    """Import the scientific stack and configure GDAL once per worker"""
+    from . import raster_io
+    from . import utils  # noqa: F401
+
+    raster_io.configure_gdal()
+
+
+def process_and_encode(_format, coverage_offering, dataset, crs):
+    """Process and encode a GetCoverage response in the process pool
+
+    Returns:
+        the encoded response, or None if the pool is disabled, the dataset is too small to be worth the transfer or
+        the pool broke - the caller then processes and encodes the dataset itself
+
+    """
+    if not dataset.data_vars or dataset.nbytes < getattr(settings, 'WCS_PROCESS_POOL_MIN_BYTES', 16 * 2**20):
+        return None
+    pool = get_pool()
+    if pool is None:
+        return None
+
+    from . import catalog
+
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name)
+    job = {
+        'format': _format.name,
+        'coverage': coverage_offering.name,
+        'crs': crs,
+        'nodata': dict(entry.nodata) if entry else {},
+    }
+    with profiling.stage('process'), SharedDataset(dataset) as shared:
+        job['dataset'] = shared.spec
+        try:
+            response = pool.submit(_process_and_encode, job).result()
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for its memory use - replace the pool and process in this thread
+            shutdown()
+            metrics.process_pool_jobs.inc(result='broken')
+            return None
+    metrics.process_pool_jobs.inc(result='ok')
+    return response
+
+
+class SharedDataset(object):
+    """Copies the data variables of a dataset into shared memory blocks for the lifetime of the context
+
+    The spec is a picklable description of the dataset - coordinates and attributes are pickled as is while every
+    data variable is the name, shape and dtype of its block.
+
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.blocks = []
+        self.spec = None
+
+    def __enter__(self):
+        import numpy as np
+        from multiprocessing.shared_memory import SharedMemory
+
+        variables = {}
+        try:
+            for name, variable in self.dataset.data_vars.items():
+                values = variable.values
+                block = SharedMemory(create=True, size=max(values.nbytes, 1))
+                self.blocks.append(block)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[...] = values
+                variables[name] = (variable.dims, block.name, values.shape, values.dtype.str, variable.attrs)
+        except Exception:
+            self.__exit__()
+            raise
+        self.spec = {
+            'variables': variables,
+            'coords': {name: (coord.dims, coord.values, coord.attrs) for name, coord in self.dataset.coords.items()},
+            'attrs': dict(self.dataset.attrs)
+        }
+        return self
+
+    def __exit__(self, *exc):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def attach_dataset(spec):
+    """Rebuild a dataset described by a SharedDataset spec over its shared memory blocks without copying
+
+    Returns:
+        (dataset, blocks) - the blocks must be closed once the dataset is no longer used
+
+    """
+    import numpy as np
+    import xarray as xr
+
+    blocks = []
+    data_vars = {}
+    for name, (dims, block_name, shape, dtype, attrs) in spec['variables'].items():
+        block = _attach_block(block_name)
+        blocks.append(block)
+        values = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        values.flags.writeable = False
+        data_vars[name] = (dims, values, attrs)
+    dataset = xr.Dataset(data_vars, coords={name: coord for name, coord in spec['coords'].items()},
+                         attrs=spec['attrs'])
+    return dataset, blocks
+
+
+def _attach_block(name):
+    """Map an existing shared memory block that the creating process is responsible for unlinking"""
+    from multiprocessing.shared_memory import SharedMemory
+
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block again with the resource tracker the pool's workers share
+        # with their parent, which is harmless as the parent unregisters it when it unlinks the block
+        return SharedMemory(name=name)
+
+
+def _process_and_encode(job):
+    """Worker side of process_and_encode"""
+    import gc
+
+    from . import utils
+
+    dataset, blocks = attach_dataset(job['dataset'])
+    try:
+        # processing never modifies the loaded bands in place, so the read-only shared blocks can be used as is
+        dataset = utils.get_format_processing(job['format'], job['coverage'])[1](dataset)
+        if job['format'] == 'netCDF':
+            return utils.encode_netcdf(dataset, job['crs'])
+        return utils.encode_tiff(dataset, job['crs'], [job['nodata'].get(band, 0) for band in dataset.data_vars])
+    finally:
+        del dataset
+        gc.collect()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # still referenced by a view that outlived the job, unmapped once it is collected
+                pass
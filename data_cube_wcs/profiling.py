@@ -0,0 +1,303 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+from . import memory
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# tracemalloc is process wide, so memory is only traced while a single profiled request is in flight
+_active_lock = threading.Lock()
+_active_profiles = 0
+_traced_profile = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Stage(object):
+    """Measurements for a single named pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.peak_memory = None
+        self.queries = None
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'wall_ms': round(self.wall * 1000, 3),
+            'cpu_ms': round(self.cpu * 1000, 3),
+            'bytes_read': self.bytes_read,
+            'peak_memory': self.peak_memory,
+            'queries': self.queries
+        }
+
+
+class RequestProfile(object):
+    """Collects per-stage wall/cpu time, bytes read, peak memory and query counts for one request
+
+    Stages may be nested - bytes read are attributed to the innermost open stage and the peak memory of a
+    nested stage is propagated to its parents. Peak memory and query counts are None for stages that weren't
+    measured.
+
+    """
+
+    def __init__(self, operation=None, track_memory=False, count_queries=True):
+        self.operation = operation
+        self.track_memory = track_memory
+        self.count_queries = count_queries
+        self.query_count = 0
+        self.stages = []
+        self._stack = []
+        self._started = None
+        self._finished = None
+        self._cpu_started = None
+        self._cpu_finished = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        self._cpu_finished = time.thread_time()
+
+    @property
+    def total(self):
+        return (self._finished or time.perf_counter()) - self._started
+
+    @property
+    def total_cpu(self):
+        return (self._cpu_finished or time.thread_time()) - self._cpu_started
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as a named stage"""
+        record = Stage(name)
+        queries = self.query_count
+        tracing = self.track_memory
+        if tracing:
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.thread_time() - cpu
+            self._stack.pop()
+            if self.count_queries:
+                record.queries = self.query_count - queries
+            # tracing stops once a concurrent request starts, as the peak would include its allocations
+            if tracing and self.track_memory:
+                record.peak_memory = max(record.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1].peak_memory = max(self._stack[-1].peak_memory or 0, record.peak_memory)
+            self.stages.append(record)
+
+    def count_query(self, execute, sql, params, many, context):
+        """Database execute wrapper counting the queries run by this request's thread"""
+        self.query_count += 1
+        return execute(sql, params, many, context)
+
+    def add_bytes(self, nbytes):
+        if self._stack:
+            self._stack[-1].bytes_read += int(nbytes)
+
+    def server_timing_header(self):
+        """Format the collected stages as a Server-Timing header value"""
+        entries = ['{};dur={:.3f}'.format(stage.name, stage.wall * 1000) for stage in self.stages]
+        entries.append('total;dur={:.3f}'.format(self.total * 1000))
+        entries.append('cpu;dur={:.3f}'.format(self.total_cpu * 1000))
+        return ", ".join(entries)
+
+    def as_dict(self):
+        return {
+            'operation': self.operation,
+            'wall_ms': round(self.total * 1000, 3),
+            'cpu_ms': round(self.total_cpu * 1000, 3),
+            'stages': [stage.as_dict() for stage in self.stages]
+        }
+
+
+def get_current_profile():
+    """Get the profile of the request being handled by this thread, if any"""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a stage of the current request - a no-op if profiling is disabled
+
+    The resident memory of requests holding a memory reservation is sampled at the end of every stage.
+
+    """
+    profile = get_current_profile()
+    try:
+        if profile is None:
+            yield None
+        else:
+            with profile.stage(name) as record:
+                yield record
+    finally:
+        memory.record_stage(name)
+
+
+def timed(name):
+    """Decorator form of stage"""
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_bytes(nbytes):
+    """Attribute bytes read to the currently open stage"""
+    profile = get_current_profile()
+    if profile is not None:
+        profile.add_bytes(nbytes)
+
+
+def _start_sampler():
+    """Start a cProfile or pyinstrument sampler for this request based on the WCS_PROFILE_SAMPLE_RATE setting"""
+    sample_rate = _setting('WCS_PROFILE_SAMPLE_RATE', 0)
+    if not sample_rate or random.random() >= sample_rate:
+        return None
+
+    if _setting('WCS_PROFILER', 'cprofile') == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, falling back to cProfile.")
+        else:
+            sampler = Profiler()
+            sampler.start()
+            return sampler
+
+    sampler = cProfile.Profile()
+    sampler.enable()
+    return sampler
+
+
+def _stop_sampler(sampler, profile):
+    """Stop the sampler and write its output to WCS_PROFILE_OUTPUT_DIR or the log"""
+    output_dir = _setting('WCS_PROFILE_OUTPUT_DIR', None)
+    filename = "{}-{}-{}".format(profile.operation, os.getpid(), int(time.time() * 1000))
+
+    if isinstance(sampler, cProfile.Profile):
+        sampler.disable()
+        if output_dir:
+            sampler.dump_stats(os.path.join(output_dir, filename + ".prof"))
+        else:
+            stream = io.StringIO()
+            pstats.Stats(sampler, stream=stream).sort_stats('cumulative').print_stats(25)
+            logger.info(stream.getvalue())
+        return
+
+    sampler.stop()
+    if output_dir:
+        with open(os.path.join(output_dir, filename + ".html"), 'w') as output:
+            output.write(sampler.output_html())
+    else:
+        logger.info(sampler.output_text())
+
+
+@contextmanager
+def profile_request(operation=None):
+    """Profile the request handled within the block
+
+    Enabled by the WCS_PROFILING setting. Yields a RequestProfile, or None if profiling is disabled, that
+    collects all stages opened by this thread until the block exits. With WCS_PROFILE_MEMORY, memory is traced
+    only while a single profiled request is in flight - stages that are open or opened once a concurrent request
+    starts aren't traced, and tracemalloc is stopped again when the traced request finishes.
+
+    """
+    if not _setting('WCS_PROFILING', False):
+        yield None
+        return
+
+    profile = RequestProfile(operation)
+    sampler = _start_sampler()
+    _local.profile = profile
+    with ExitStack() as stack:
+        stack.callback(_release_profile, profile, _acquire_profile(profile))
+        # Django < 2.0 has no execute wrappers, and its query log is a bounded deque that can't be counted
+        profile.count_queries = hasattr(connection, 'execute_wrapper')
+        if profile.count_queries:
+            stack.enter_context(connection.execute_wrapper(profile.count_query))
+        profile.start()
+        try:
+            yield profile
+        finally:
+            profile.finish()
+            _local.profile = None
+            if sampler is not None:
+                _stop_sampler(sampler, profile)
+            if _setting('WCS_PROFILE_LOG', False):
+                logger.info(json.dumps(profile.as_dict()))
+
+
+def _acquire_profile(profile):
+    """Count a profiled request in flight and start tracing its memory if it is the only one
+
+    Returns:
+        whether tracemalloc was started for the request
+
+    """
+    global _active_profiles, _traced_profile
+    with _active_lock:
+        _active_profiles += 1
+        if _traced_profile is not None:
+            # the peaks of the traced request's open and later stages would include the new request's allocations
+            _traced_profile.track_memory = False
+        if _active_profiles > 1 or not _setting('WCS_PROFILE_MEMORY', False):
+            return False
+        profile.track_memory = True
+        _traced_profile = profile
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start()
+        return True
+
+
+def _release_profile(profile, started_tracing):
+    global _active_profiles, _traced_profile
+    with _active_lock:
+        _active_profiles -= 1
+        if _traced_profile is profile:
+            _traced_profile = None
+            if started_tracing:
+                tracemalloc.stop()
+
+
+def annotate_response(response, profile):
+    """Add the Server-Timing header for a finished profile to the response"""
+    if profile is not None:
+        response['Server-Timing'] = profile.server_timing_header()
+    return response
@@ -0,0 +1,442 @@
+"""Per-process raster I/O - the GDAL configuration and bounded caches of open storage unit handles and blocks
+
+Storage units read for grid aligned GetCoverage requests are opened once per process and kept open in an LRU of
+WCS_RASTER_HANDLE_CACHE_SIZE handles, so hot files are not re-opened and their headers re-parsed on every request.
+Small windows, like those of time series drills, can be read as whole blocks kept in an LRU of
+WCS_RASTER_BLOCK_CACHE_BYTES.
+
+"""
+import collections
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import parse_qs, unquote, urlparse
+
+from django.conf import settings
+
+from . import catalog
+from . import metrics
+
+# Django setting -> GDAL config option
+GDAL_SETTINGS = {
+    'WCS_GDAL_CACHEMAX': 'GDAL_CACHEMAX',
+    'WCS_GDAL_NUM_THREADS': 'GDAL_NUM_THREADS',
+    'WCS_VSI_CACHE': 'VSI_CACHE',
+    'WCS_VSI_CACHE_SIZE': 'VSI_CACHE_SIZE',
+}
+
+
+def configure_gdal():
+    """Set the process wide GDAL config options from the Django settings
+
+    WCS_GDAL_CACHEMAX (block cache MB), WCS_GDAL_NUM_THREADS, WCS_VSI_CACHE and WCS_VSI_CACHE_SIZE map to their GDAL
+    options and WCS_GDAL_CONFIG is a dict of any other options. Must run before the first raster is read for the
+    block cache size to apply.
+
+    Returns:
+        dict of the options that were set
+
+    """
+    options = {option: getattr(settings, name) for name, option in GDAL_SETTINGS.items()
+               if getattr(settings, name, None) is not None}
+    options.update(getattr(settings, 'WCS_GDAL_CONFIG', {}))
+    if not options:
+        return options
+
+    from rasterio.env import set_gdal_config
+
+    for option, value in options.items():
+        set_gdal_config(option, value)
+    return options
+
+
+class _Handle(object):
+    """An open dataset and the lock serializing its reads - GDAL dataset handles aren't thread safe"""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.evicted = False
+
+
+class HandleCache(object):
+    """Bounded LRU of open rasterio datasets keyed by path
+
+    Handles evicted while a read holds them are closed once that read is done.
+
+    Args:
+        maxsize: maximum number of open handles, 0 to open and close a dataset for every read
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._handles = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @contextmanager
+    def open(self, path):
+        """Get the open dataset at path, holding its lock for the duration of the context"""
+        import rasterio
+
+        handle = self._get(path)
+        if handle is None:
+            metrics.record_cache('raster_handle', False)
+            handle = self._put(path, _Handle(rasterio.open(path)))
+        else:
+            metrics.record_cache('raster_handle', True)
+
+        with handle.lock:
+            # evicted and closed between the lookup and the lock
+            if handle.dataset.closed:
+                with rasterio.open(path) as dataset:
+                    yield dataset
+                return
+            try:
+                yield handle.dataset
+            finally:
+                if handle.evicted:
+                    handle.dataset.close()
+
+    def clear(self):
+        """Close every idle handle and forget the rest"""
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), collections.OrderedDict()
+        for handle in handles:
+            self._evict(handle)
+
+    def _get(self, path):
+        with self._lock:
+            # handles inherited from a parent process share its file descriptors
+            if self._pid != os.getpid():
+                self._handles, self._pid = collections.OrderedDict(), os.getpid()
+            handle = self._handles.get(path)
+            if handle is not None:
+                self._handles.move_to_end(path)
+            return handle
+
+    def _put(self, path, handle):
+        """Cache a newly opened handle, returning the cached handle if another thread opened path first"""
+        if self.maxsize <= 0:
+            handle.evicted = True
+            return handle
+        evicted = []
+        with self._lock:
+            existing = self._handles.get(path)
+            if existing is not None:
+                evicted.append(handle)
+                handle = existing
+            else:
+                self._handles[path] = handle
+                while len(self._handles) > self.maxsize:
+                    evicted.append(self._handles.popitem(last=False)[1])
+        for old_handle in evicted:
+            self._evict(old_handle)
+        return handle
+
+    @staticmethod
+    def _evict(handle):
+        handle.evicted = True
+        if handle.lock.acquire(blocking=False):
+            try:
+                handle.dataset.close()
+            finally:
+                handle.lock.release()
+
+
+_handle_cache = None
+_handle_cache_lock = threading.Lock()
+
+
+def get_handle_cache():
+    """Get the process wide handle cache of WCS_RASTER_HANDLE_CACHE_SIZE handles (default 64)"""
+    global _handle_cache
+    if _handle_cache is None:
+        with _handle_cache_lock:
+            if _handle_cache is None:
+                _handle_cache = HandleCache(getattr(settings, 'WCS_RASTER_HANDLE_CACHE_SIZE', 64))
+    return _handle_cache
+
+
+class BlockCache(object):
+    """Bounded LRU of decoded storage unit blocks keyed by (source, band index, block row, block column)
+
+    Storage units are never rewritten in place, so cached blocks stay valid for as long as they are cached.
+
+    Args:
+        max_bytes: largest total size of the cached blocks, 0 to never cache
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+        metrics.record_cache('raster_block', block is not None)
+        return block
+
+    def put(self, key, block):
+        if block.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._blocks.pop(key, None)
+            self.nbytes += block.nbytes - (previous.nbytes if previous is not None else 0)
+            self._blocks[key] = block
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._blocks.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks = collections.OrderedDict()
+            self.nbytes = 0
+
+
+_block_cache = None
+
+
+def get_block_cache():
+    """Get the process wide cache of WCS_RASTER_BLOCK_CACHE_BYTES of decoded blocks (default 64MB)"""
+    global _block_cache
+    if _block_cache is None:
+        with _handle_cache_lock:
+            if _block_cache is None:
+                _block_cache = BlockCache(getattr(settings, 'WCS_RASTER_BLOCK_CACHE_BYTES', 64 * 2**20))
+    return _block_cache
+
+
+def read_blocks(src, source, band_index, window):
+    """Read a window of an open storage unit band whole internal block by whole block through the block cache
+
+    Small windows are read as the blocks that contain them, so later reads of nearby pixels are served from memory.
+
+    Args:
+        src: open rasterio dataset, held by the caller
+        source: path of src, part of the cache keys
+        band_index: 1 based band index
+        window: rasterio Window within the bounds of src
+
+    """
+    import numpy as np
+    from rasterio.windows import Window
+
+    cache = get_block_cache()
+    block_height, block_width = src.block_shapes[band_index - 1]
+    row_offset, column_offset = int(window.row_off), int(window.col_off)
+    values = np.empty((int(window.height), int(window.width)), dtype=src.dtypes[band_index - 1])
+    for block_row in range(row_offset // block_height, (row_offset + values.shape[0] - 1) // block_height + 1):
+        for block_column in range(column_offset // block_width,
+                                  (column_offset + values.shape[1] - 1) // block_width + 1):
+            key = (source, band_index, block_row, block_column)
+            block = cache.get(key)
+            if block is None:
+                block_window = Window(block_column * block_width, block_row * block_height,
+                                      min(block_width, src.width - block_column * block_width),
+                                      min(block_height, src.height - block_row * block_height))
+                block = src.read(band_index, window=block_window)
+                cache.put(key, block)
+            # the part of the block within the window
+            top, left = block_row * block_height, block_column * block_width
+            first_row, first_column = max(top, row_offset), max(left, column_offset)
+            last_row = min(top + block.shape[0], row_offset + values.shape[0])
+            last_column = min(left + block.shape[1], column_offset + values.shape[1])
+            values[first_row - row_offset:last_row - row_offset, first_column - column_offset:last_column -
+                   column_offset] = block[first_row - top:last_row - top, first_column - left:last_column - left]
+    return values
+
+
+BandSource = collections.namedtuple('BandSource', ('path', 'band_index'))
+
+
+def get_band_source(path, band):
+    """Get the GDAL path and band index of a band of a storage unit from its footprint band path
+
+    Band paths are file paths or uris, or dicts of a path and the 'band' and 'layer' of the Data Cube measurement
+    metadata - see utils.get_dataset_footprint. As with the Data Cube, the '#part=N' fragment of a netCDF uri selects
+    time slice N (0 based) of a stacked storage unit, the layer of a netCDF unit is its variable and the layer of
+    any other unit its band number.
+
+    Returns:
+        BandSource - band_index is None if it is to be found from the band descriptions of the storage unit. None if
+        the unit isn't a local file or its band can't be determined, so it is loaded through the Data Cube instead.
+
+    """
+    band_index = layer = None
+    if isinstance(path, dict):
+        path, band_index, layer = path.get('path', ""), path.get('band'), path.get('layer')
+    part = None
+    if path.startswith('file://'):
+        uri = urlparse(path)
+        path = unquote(uri.path)
+        if uri.fragment:
+            fragment = parse_qs(uri.fragment)
+            if list(fragment) != ['part'] or not fragment['part'][0].isdigit():
+                return None
+            part = int(fragment['part'][0])
+    elif not path or '://' in path:
+        return None
+
+    if path.lower().endswith(('.nc', '.nc4')):
+        if part is not None:
+            if band_index is not None:
+                return None
+            band_index = part + 1
+        return BandSource('NETCDF:"{}":{}'.format(path, layer or band), band_index)
+    if part is not None:
+        return None
+    if band_index is None and layer is not None:
+        if not str(layer).isdigit():
+            return None
+        band_index = int(layer)
+    return BandSource(path, band_index)
+
+
+def get_band_index(src, band):
+    """Get the 1 based index of a band in an open storage unit from its band descriptions, None if it's ambiguous"""
+    if src.descriptions.count(band) == 1:
+        return src.descriptions.index(band) + 1
+    return 1 if src.count == 1 else None
+
+
+def read_scenes(parameters, time_ranges, cache_blocks=False):
+    """Read the scenes of a grid aligned load directly from their storage units through the handle cache
+
+    The storage units are found through the coverage's dataset footprints, and the requested window is read from
+    every unit at the native resolution - datasets acquired at the same time are fused first valid pixel first, as
+    with dc.load. Reads are fanned out per band and dataset over WCS_LOAD_THREADS threads under the I/O semaphore.
+
+    Args:
+        parameters: dc.load parameters of a grid aligned request - see utils.get_grid_query
+        time_ranges: time ranges of the scenes to read
+        cache_blocks: read whole blocks through the block cache, for small windows read again and again
+
+    Returns:
+        dataset shaped like the dc.load result, or None if a storage unit can't be read directly
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    import xarray as xr
+
+    from . import utils
+
+    entry = catalog.get_catalog().get_coverage(parameters['product'])
+    # solar day groups are fused by the Data Cube
+    if entry is None or 'align' not in parameters or 'group_by' in parameters or not len(entry.footprints):
+        return None
+    output_crs = parameters['output_crs']
+    query_bounds = utils._query_bounds(parameters)
+    indexes = entry.footprints.search(utils.transform_bounds(output_crs, utils.GEOGRAPHIC_CRS, query_bounds),
+                                      time_ranges)
+    if not len(indexes):
+        return xr.Dataset()
+
+    bands = list(parameters['measurements'] or entry.measurements)
+    footprints = [entry.footprints.get_footprint(index) for index in indexes]
+    sources = [{band: get_band_source(footprint['band_paths'].get(band, ""), band) for band in bands}
+               for footprint in footprints]
+    if any(source is None for footprint_sources in sources for source in footprint_sources.values()):
+        return None
+
+    transform, y, x = utils.get_target_grid(output_crs, _align_bounds(query_bounds, parameters),
+                                            parameters['resolution'])
+    nodata = dict(zip(bands, entry.get_nodata_values(bands)))
+    reads = [(index, band) for index in range(len(footprints)) for band in bands]
+
+    def _read(read):
+        index, band = read
+        with utils.get_io_semaphore():
+            return _read_window(sources[index][band], band, transform, (len(y), len(x)), output_crs, nodata[band],
+                                cache_blocks)
+
+    thread_count = min(getattr(settings, 'WCS_LOAD_THREADS', 4), len(reads))
+    if thread_count <= 1:
+        results = [_read(read) for read in reads]
+    else:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = list(executor.map(_read, reads))
+    if any(result is None for result in results):
+        return None
+
+    # footprints are sorted by time, fuse the datasets of each time into a single slice
+    times = []
+    slices = {band: [] for band in bands}
+    for (index, band), values in zip(reads, results):
+        time = footprints[index]['time']
+        if band == bands[0] and (not times or times[-1] != time):
+            times.append(time)
+        if len(slices[band]) < len(times):
+            slices[band].append(values)
+        else:
+            missing = ~utils.get_valid_mask(slices[band][-1], nodata[band])
+            slices[band][-1][missing] = values[missing]
+
+    y_dim, x_dim = utils._crs_dims(output_crs)
+    return xr.Dataset(
+        {band: (('time', y_dim, x_dim), np.stack(slices[band])) for band in bands},
+        coords={'time': np.array(times, dtype='datetime64[ms]').astype('datetime64[ns]'), y_dim: y, x_dim: x})
+
+
+def _align_bounds(bounds, parameters):
+    """Expand query bounds outwards to the pixel edges of the aligned grid, as dc.load does with align"""
+    import numpy as np
+
+    y_resolution, x_resolution = (abs(resolution) for resolution in parameters['resolution'])
+    y_offset, x_offset = parameters['align']
+    return (x_offset + np.floor((bounds[0] - x_offset) / x_resolution) * x_resolution,
+            y_offset + np.floor((bounds[1] - y_offset) / y_resolution) * y_resolution,
+            x_offset + np.ceil((bounds[2] - x_offset) / x_resolution) * x_resolution,
+            y_offset + np.ceil((bounds[3] - y_offset) / y_resolution) * y_resolution)
+
+
+def _read_window(source, band, transform, shape, crs, nodata, cache_blocks=False):
+    """Read the pixels of a storage unit band on a grid, None if the unit isn't stored on that grid
+
+    Args:
+        source: BandSource of the band - see get_band_source
+        cache_blocks: read the pixels through the block cache - see read_blocks
+
+    Returns:
+        the pixels, or None if the unit isn't stored on the grid or the band can't be found in it
+
+    """
+    import numpy as np
+    from rasterio.windows import Window
+
+    from . import utils
+
+    with get_handle_cache().open(source.path) as src:
+        if src.crs is None or utils.normalize_crs(src.crs.to_string()) != crs:
+            return None
+        # the window of the grid in the storage unit, which must share its pixel edges
+        column, row = ~src.transform * (transform.c, transform.f)
+        if (not np.allclose((src.transform.a, src.transform.e), (transform.a, transform.e), rtol=1e-6) or
+                abs(column - round(column)) > utils.GRID_ALIGNMENT_TOLERANCE or
+                abs(row - round(row)) > utils.GRID_ALIGNMENT_TOLERANCE):
+            return None
+        column, row = int(round(column)), int(round(row))
+        band_index = source.band_index or get_band_index(src, band)
+        if band_index is None or band_index > src.count:
+            return None
+
+        values = np.full(shape, nodata, dtype=src.dtypes[band_index - 1])
+        first_row, first_column = max(row, 0), max(column, 0)
+        last_row, last_column = min(row + shape[0], src.height), min(column + shape[1], src.width)
+        if first_row < last_row and first_column < last_column:
+            window = Window(first_column, first_row, last_column - first_column, last_row - first_row)
+            values[first_row - row:last_row - row, first_column - column:last_column - column] = read_blocks(
+                src, source.path, band_index, window) if cache_blocks else src.read(band_index, window=window)
+        return values
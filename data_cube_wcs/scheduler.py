@@ -0,0 +1,171 @@
+"""Admission scheduling of GetCoverage requests by their estimated cost
+
+Requests are assigned to the first lane whose max_cost is at least their cost - output pixels x bands x time slices
+to load - and run once the lane has a free slot. Every lane is bounded separately so large exports can never take the
+slots of small interactive requests, and when the process wide WCS_SCHEDULER_MAX_ACTIVE limit is reached, freed slots
+go to the waiting requests of the earliest lane first. Each client may also only have WCS_SCHEDULER_CLIENT_LIMIT
+requests running or waiting at a time.
+
+A request is rejected right away when its client is at its limit or its lane's queue is full, and after waiting
+the lane's timeout for a slot otherwise - the view answers with a 503 and a Retry-After header.
+
+"""
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+# name, largest cost (None for any), concurrent requests, waiting requests, seconds to wait and Retry-After seconds
+DEFAULT_LANES = [
+    {'name': 'interactive', 'max_cost': 4096 * 4096, 'concurrency': 8, 'queue': 32, 'timeout': 5, 'retry_after': 1},
+    {'name': 'export', 'max_cost': None, 'concurrency': 2, 'queue': 8, 'timeout': 30, 'retry_after': 30},
+]
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request can't be admitted, with the lane and the seconds the client should wait"""
+
+    def __init__(self, lane, retry_after, reason):
+        super(SchedulerBusy, self).__init__(reason)
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Scheduler(object):
+    """Admits requests to bounded lanes in priority order
+
+    Args:
+        lanes: lane dicts ordered by priority - see DEFAULT_LANES
+        max_active: limit of running requests over all lanes, None for the sum of the lane concurrencies
+        client_limit: limit of running and waiting requests per client, 0 for none
+
+    """
+
+    def __init__(self, lanes, max_active=None, client_limit=0):
+        self.lanes = [dict(lane, priority=priority) for priority, lane in enumerate(lanes)]
+        self.max_active = max_active or sum(lane['concurrency'] for lane in self.lanes)
+        self.client_limit = client_limit
+        self._condition = threading.Condition()
+        self._active = collections.Counter()
+        self._waiting = collections.Counter()
+        self._clients = collections.Counter()
+
+    def get_lane(self, cost):
+        """Get the first lane taking requests of a cost - the last lane takes any cost"""
+        for lane in self.lanes:
+            if lane['max_cost'] is None or cost <= lane['max_cost']:
+                return lane
+        return self.lanes[-1]
+
+    @contextmanager
+    def admit(self, cost, client=None):
+        """Wait for a slot in the lane of a request for the duration of the context
+
+        Raises:
+            SchedulerBusy if the client is at its limit, the lane's queue is full or no slot freed up in time
+
+        """
+        lane = self.get_lane(cost)
+        name = lane['name']
+        started = time.monotonic()
+        with self._condition:
+            if client is not None and self.client_limit and self._clients[client] >= self.client_limit:
+                self._reject(lane, "client")
+            if not self._can_run(lane):
+                if self._waiting[name] >= lane['queue']:
+                    self._reject(lane, "queue")
+                self._waiting[name] += 1
+                self._clients[client] += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._can_run(lane), timeout=lane['timeout'])
+                finally:
+                    self._waiting[name] -= 1
+                    self._release_client(client)
+                if not admitted:
+                    self._condition.notify_all()
+                    self._reject(lane, "timeout")
+            self._active[name] += 1
+            self._clients[client] += 1
+        metrics.scheduler_wait.observe(time.monotonic() - started, lane=name)
+        metrics.scheduler_requests.inc(lane=name, result='admitted')
+        try:
+            yield lane
+        finally:
+            with self._condition:
+                self._active[name] -= 1
+                self._release_client(client)
+                self._condition.notify_all()
+
+    def _release_client(self, client):
+        """Drop a running or waiting request of a client, forgetting clients without any"""
+        self._clients[client] -= 1
+        if not self._clients[client]:
+            del self._clients[client]
+
+    def _can_run(self, lane):
+        """Check if a lane has a free slot that no waiting request of an earlier lane can take"""
+        if self._active[lane['name']] >= lane['concurrency']:
+            return False
+        # free slots go to the waiting requests of earlier lanes first, as far as their concurrency allows
+        free = self.max_active - sum(self._active.values())
+        return free > sum(min(self._waiting[other['name']], other['concurrency'] - self._active[other['name']])
+                          for other in self.lanes[:lane['priority']])
+
+    def _reject(self, lane, reason):
+        metrics.scheduler_requests.inc(lane=lane['name'], result=reason)
+        raise SchedulerBusy(lane['name'], lane['retry_after'], reason)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Get the process wide scheduler, None unless WCS_SCHEDULER is set
+
+    Lanes are set with WCS_SCHEDULER_LANES (default DEFAULT_LANES), the limit of running requests over every lane
+    with WCS_SCHEDULER_MAX_ACTIVE and the limit per client with WCS_SCHEDULER_CLIENT_LIMIT (default 4, 0 for none).
+
+    """
+    global _scheduler
+    if not getattr(settings, 'WCS_SCHEDULER', False):
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler(getattr(settings, 'WCS_SCHEDULER_LANES', DEFAULT_LANES),
+                                       getattr(settings, 'WCS_SCHEDULER_MAX_ACTIVE', None),
+                                       getattr(settings, 'WCS_SCHEDULER_CLIENT_LIMIT', 4))
+    return _scheduler
+
+
+def reset():
+    """Drop the scheduler so that it is rebuilt from the settings - requests it admitted release their slots on it"""
+    global _scheduler
+    _scheduler = None
+
+
+def get_cost(cleaned_data):
+    """Estimate the cost of a validated GetCoverage request as output pixels x bands x time slices to load"""
+    from . import tiling
+
+    width, height, _ = tiling.get_output_grid(cleaned_data)
+    return width * height * max(len(cleaned_data['measurements']), 1) * max(len(cleaned_data['load_ranges']), 1)
+
+
+def get_client(request):
+    """Identify the client of a request by the WCS_SCHEDULER_CLIENT_HEADER META key (default REMOTE_ADDR)
+
+    For a header holding a list of addresses, like X-Forwarded-For, the address appended by the outermost of the
+    WCS_SCHEDULER_TRUSTED_PROXIES proxies in front of the server (default 1) is used - the addresses before it are
+    sent by the client and can't be trusted.
+
+    """
+    value = request.META.get(getattr(settings, 'WCS_SCHEDULER_CLIENT_HEADER', 'REMOTE_ADDR'), "")
+    addresses = [address.strip() for address in value.split(",")]
+    hops = max(getattr(settings, 'WCS_SCHEDULER_TRUSTED_PROXIES', 1), 1)
+    return addresses[-min(hops, len(addresses))] or None
@@ -0,0 +1,200 @@
+"""Split and stitch execution of GetCoverage requests for very large extents
+
+Requests for more than WCS_TILE_MIN_PIXELS output pixels (default 0, never split) are partitioned into tiles of at
+most WCS_TILE_SIZE pixels square (default 2048). Every tile is an ordinary GetCoverage request for a part of the
+output grid, so any node running the WCS can render it: tiles are sent round robin to the WCS urls listed in
+WCS_TILE_PEERS, or rendered in this process without peers or when a peer fails - peer failures are logged and
+counted. Tile responses are written into a tiled GeoTIFF on disk as they complete, which is then streamed back.
+
+Point WCS_TILE_PEERS at the server's own url to spread the tiles of a request over its other worker processes.
+
+"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.http import FileResponse
+
+from . import metrics
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+# request parameters replaced by those of each tile
+TILE_PARAMETERS = ('bbox', 'width', 'height', 'resx', 'resy', 'crs', 'response_crs', 'snap')
+
+
+def get_tiles(width, height, tile_size):
+    """Partition a width x height grid into (column, row, width, height) windows of at most tile_size pixels"""
+    return [(column, row, min(tile_size, width - column), min(tile_size, height - row))
+            for row in range(0, height, tile_size) for column in range(0, width, tile_size)]
+
+
+def get_output_grid(cleaned_data):
+    """Get the (width, height) in pixels and (minx, miny, maxx, maxy) bounds of a validated request's output grid"""
+    bounds = cleaned_data['response_bounds']
+    width = max(1, int(round((bounds[2] - bounds[0]) / abs(cleaned_data['resx']))))
+    height = max(1, int(round((bounds[3] - bounds[1]) / abs(cleaned_data['resy']))))
+    return width, height, bounds
+
+
+def should_tile(cleaned_data):
+    """Check if a validated GetCoverage request is split into tiles
+
+    Only GeoTIFF responses can be stitched, and tiles are never split again as they are at most WCS_TILE_SIZE pixels
+    square. Requests without a coverage format, like GetStatistics, are never split.
+
+    """
+    min_pixels = getattr(settings, 'WCS_TILE_MIN_PIXELS', 0)
+    _format = cleaned_data.get('format')
+    if not min_pixels or _format is None or _format.name == 'netCDF':
+        return False
+    width, height, _ = get_output_grid(cleaned_data)
+    return width * height > max(min_pixels, getattr(settings, 'WCS_TILE_SIZE', 2048)**2)
+
+
+def get_tile_parameters(get_data, cleaned_data, tile):
+    """Get the GetCoverage parameters of a tile - the request's bbox and grid replaced by those of the tile
+
+    Tiles are requested in the response crs, on the pixel edges of the request's output grid.
+
+    """
+    width, height, bounds = get_output_grid(cleaned_data)
+    x_resolution, y_resolution = (bounds[2] - bounds[0]) / width, (bounds[3] - bounds[1]) / height
+    column, row, tile_width, tile_height = tile
+    parameters = {key: value for key, value in get_data.items() if key not in TILE_PARAMETERS}
+    parameters.update({
+        'crs': cleaned_data['response_crs'],
+        'response_crs': cleaned_data['response_crs'],
+        'bbox': ",".join(repr(value) for value in (
+            bounds[0] + column * x_resolution, bounds[3] - (row + tile_height) * y_resolution,
+            bounds[0] + (column + tile_width) * x_resolution, bounds[3] - row * y_resolution)),
+        'width': tile_width,
+        'height': tile_height
+    })
+    return parameters
+
+
+def render_tile(parameters):
+    """Render a tile in this process, returning the GeoTIFF bytes or None if it doesn't intersect the coverage"""
+    from django.db import close_old_connections
+    from django.test import RequestFactory
+
+    from . import views
+
+    close_old_connections()
+    try:
+        response = views.GetCoverage.as_view(admit=False)(RequestFactory().get('/wcs/', parameters))
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            close_old_connections()
+    return _tile_content(response.status_code, response['Content-Type'], response.content)
+
+
+def fetch_tile(peer, parameters):
+    """Render a tile on a peer WCS, returning the GeoTIFF bytes or None if it doesn't intersect the coverage"""
+    query = dict(parameters, service="WCS", request="GetCoverage")
+    timeout = getattr(settings, 'WCS_TILE_TIMEOUT', 300)
+    with urlopen("{}?{}".format(peer, urlencode(query)), timeout=timeout) as response:
+        return _tile_content(response.status, response.headers.get('Content-Type', ""), response.read())
+
+
+def _tile_content(status, content_type, content):
+    # the request was validated as a whole, so a tile can only be rejected for not intersecting the coverage
+    if status == 200 and 'se_xml' in content_type:
+        return None
+    if status != 200:
+        raise IOError("Tile request failed with status {}.".format(status))
+    return content
+
+
+def get_tiled_response(get_data, cleaned_data):
+    """Render a validated GetCoverage request tile by tile and stream back the stitched GeoTIFF
+
+    The stitched GeoTIFF takes the band count and dtype of the first tile rendered with data. Tiles without data are
+    filled with nodata, and an IOError is raised if the band count or dtype of a later tile with data differ rather
+    than casting its values.
+
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.io import MemoryFile
+    from rasterio.transform import from_bounds
+    from rasterio.windows import Window
+
+    from . import utils
+
+    width, height, bounds = get_output_grid(cleaned_data)
+    tiles = get_tiles(width, height, getattr(settings, 'WCS_TILE_SIZE', 2048))
+    peers = list(getattr(settings, 'WCS_TILE_PEERS', []))
+
+    def _render(index):
+        parameters = get_tile_parameters(get_data, cleaned_data, tiles[index])
+        if peers:
+            peer = peers[index % len(peers)]
+            try:
+                content = fetch_tile(peer, parameters)
+            except Exception as error:
+                logger.warning("Tile peer %s failed, rendering the tile in-process: %r", peer, error)
+                metrics.tile_renders.inc(renderer=peer, result='failed')
+            else:
+                metrics.tile_renders.inc(renderer=peer, result='ok')
+                return content
+        content = render_tile(parameters)
+        metrics.tile_renders.inc(renderer='local', result='ok')
+        return content
+
+    handle, path = tempfile.mkstemp(suffix=".tif", dir=getattr(settings, 'WCS_TILE_DIR', None))
+    os.close(handle)
+    dst = None
+    empty_tiles = []
+    try:
+        with profiling.stage('tiles'), ThreadPoolExecutor(
+                max_workers=getattr(settings, 'WCS_TILE_WORKERS', max(len(peers), 2))) as executor:
+            futures = {executor.submit(_render, index): index for index in range(len(tiles))}
+            for future in as_completed(futures):
+                content = future.result()
+                column, row, tile_width, tile_height = tiles[futures[future]]
+                if content is None:
+                    empty_tiles.append(tiles[futures[future]])
+                    continue
+                with MemoryFile(content) as memfile, memfile.open() as src:
+                    values = src.read(window=Window(0, 0, tile_width, tile_height), boundless=True)
+                    # tiles without data, e.g. outside every dataset footprint, are rendered from a placeholder
+                    # dataset whose dtype says nothing about the coverage's - they are filled with nodata instead
+                    if not any(utils.get_valid_mask(band_values, nodata).any()
+                               for band_values, nodata in zip(values, src.nodatavals)):
+                        empty_tiles.append(tiles[futures[future]])
+                        continue
+                    if dst is None:
+                        dst = rasterio.open(
+                            path, 'w', driver='GTiff', width=width, height=height, count=src.count,
+                            dtype=src.dtypes[0], crs=utils.get_crs(cleaned_data['response_crs']),
+                            transform=from_bounds(*bounds, width, height), tiled=True, blockxsize=256,
+                            blockysize=256, BIGTIFF='IF_SAFER')
+                        nodata_values = src.nodatavals
+                    elif src.count != dst.count or set(src.dtypes) != {dst.dtypes[0]}:
+                        # casting could silently truncate the tile's values
+                        raise IOError("Tile has {} {} bands, the stitched GeoTIFF has {} {} bands.".format(
+                            src.count, "/".join(sorted(set(src.dtypes))), dst.count, dst.dtypes[0]))
+                    dst.write(values, window=Window(column, row, tile_width, tile_height))
+            if dst is None:
+                return None
+            for column, row, tile_width, tile_height in empty_tiles:
+                for index, nodata in enumerate(nodata_values, start=1):
+                    dst.write(np.full((tile_height, tile_width), nodata if nodata is not None else 0,
+                                      dtype=dst.dtypes[0]), index, window=Window(column, row, tile_width, tile_height))
+            dst.set_nodatavals(nodata_values)
+            dst.close()
+            dst = None
+        # the file is unlinked right away and removed once the response has been streamed
+        return FileResponse(open(path, 'rb'), content_type=cleaned_data['format'].content_type)
+    finally:
+        if dst is not None:
+            dst.close()
+        os.remove(path)
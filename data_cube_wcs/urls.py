@@ -1,5 +1,20 @@
-from django.conf.urls import url, include
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.views import View
+
+try:
+    from django.urls import re_path
+except ImportError:
+    # Django < 2.0
+    from django.conf.urls import url as re_path
 
 from . import views
 
-urlpatterns = [url(r'^', views.WebService.as_view(), name='web_service')]
+if getattr(settings, 'WCS_ASYNC_VIEWS', False) and not hasattr(View, 'view_is_async'):
+    raise ImproperlyConfigured("WCS_ASYNC_VIEWS requires Django 4.1 or later, which awaits async view handlers.")
+
+urlpatterns = [
+    re_path(r'^metrics$', views.Metrics.as_view(), name='metrics'),
+    re_path(r'^', (views.AsyncWebService if getattr(settings, 'WCS_ASYNC_VIEWS', False) else views.WebService)
+            .as_view(), name='web_service'),
+]
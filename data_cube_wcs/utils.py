@@ -1,35 +1,68 @@
-from django.apps import apps
 from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 import xarray as xr
 import numpy as np
 import collections
+import threading
 from rasterio.io import MemoryFile
 
 from datacube.config import LocalConfig
 import datacube
 import configparser
 
+from . import catalog
+from . import metrics
+from . import profiling
+from . import raster_io
+
 
 def form_to_data_cube_parameters(form_instance):
-    """Converts some of the all caps/other form data parameters to the required Data Cube parameters"""
-    individual_dates = form_instance.cleaned_data['times']
-    date_ranges = form_instance.cleaned_data['time_ranges']
+    """Converts some of the all caps/other form data parameters to the required Data Cube parameters
 
-    return {
+    Returns the dc.load parameters, an empty list of individual dates and the planned load time ranges - ranges
+    without any dataset intersecting the request have already been dropped.
+
+    """
+    parameters = {
         'product': form_instance.cleaned_data['coverage'].name,
         'latitude': form_instance.cleaned_data['latitude'],
         'longitude': form_instance.cleaned_data['longitude'],
         'measurements': form_instance.cleaned_data['measurements'],
-        'resolution': (form_instance.cleaned_data['resy'], form_instance.cleaned_data['resx']),
-        'crs': form_instance.cleaned_data['crs'],
-        'resampling': form_instance.cleaned_data['resampling']
-    }, individual_dates, date_ranges
+        'resolution': form_instance.cleaned_data['resolution'],
+        'output_crs': form_instance.cleaned_data['output_crs'],
+        'resampling': form_instance.cleaned_data['load_resampling']
+    }
+    if form_instance.cleaned_data.get('grid_bounds'):
+        del parameters['latitude'], parameters['longitude']
+        parameters.update(get_grid_query(form_instance.cleaned_data['grid_bounds'], parameters['output_crs'],
+                                         form_instance.cleaned_data['coverage']))
+    parameters.update(get_group_query(form_instance.cleaned_data['coverage']))
+    return parameters, [], form_instance.cleaned_data['load_ranges']
+
+
+def get_load_ranges(individual_dates, date_ranges, coverage_entry=None):
+    """Get the dc.load time ranges for a list of single dates and a list of ranges
+
+    Single dates of a grouped coverage load every acquisition of their group.
+
+    """
+    if coverage_entry is not None:
+        load_ranges = [coverage_entry.get_time_range(date) for date in individual_dates]
+    else:
+        load_ranges = [(date - timedelta(seconds=1), date + timedelta(seconds=1)) for date in individual_dates]
+    load_ranges.extend(date_ranges)
+    return load_ranges
 
 
 def get_stacked_dataset(coverage_offering, parameters, individual_dates, date_ranges):
-    """Get a dataset using either a list of single dates or a list of ranges
+    """Get a most recent pixel mosaic using either a list of single dates or a list of ranges
+
+    Scenes are loaded newest first, WCS_MOSAIC_BATCH_SIZE (default 2) at a time, and fill the nodata pixels of a
+    single output buffer in place. Loading stops as soon as no nodata pixels remain, so older scenes are never read.
 
     Args:
         parameters: dictionary-like containing all the parameters needed for a dc.load call
@@ -41,87 +74,691 @@ def get_stacked_dataset(coverage_offering, parameters, individual_dates, date_ra
 
     """
 
-    def _get_datetime_range_containing(*time_ranges):
-        return (min(time_ranges) - timedelta(seconds=1), max(time_ranges) + timedelta(seconds=1))
-
     def _clear_attrs(dataset):
         """Clear out all attributes on an xarray dataset to write to disk."""
         dataset.attrs = collections.OrderedDict()
         for band in dataset:
             dataset[band].attrs = collections.OrderedDict()
 
-    rangeset = apps.get_model("data_cube_wcs.CoverageRangesetEntry").objects.filter(coverage_offering=coverage_offering)
-
-    full_date_ranges = [_get_datetime_range_containing(date) for date in individual_dates]
-    full_date_ranges.extend(date_ranges)
-
-    data_array = []
-    with datacube.Datacube(config=config_from_settings()) as dc:
-        for _range in full_date_ranges:
-            product_data = dc.load(time=_range, **parameters)
-            if 'time' in product_data:
-                data_array.append(product_data.copy(deep=True))
+    full_date_ranges = get_load_ranges(individual_dates, date_ranges)
+    batches = get_mosaic_batches(coverage_offering, parameters, full_date_ranges,
+                                 getattr(settings, 'WCS_MOSAIC_BATCH_SIZE', 2))
 
     data = None
-    if len(data_array) > 0:
-        combined_data = xr.concat(data_array, 'time')
-        data = combined_data.reindex({'time': sorted(combined_data.time.values)})
-        if data.dims['time'] > 1:
-            nodata_vals = [
-                rangeset.get(band_name=band).null_value if rangeset.filter(band_name=band).exists() else 0
-                for band in data.data_vars
-            ]
-            data = data.pipe(create_mosaic, no_data=nodata_vals)
-        _clear_attrs(data)
-        if 'time' in data:
-            data = data.isel(time=0, drop=True)
+    loaded_bytes = 0
+    remaining = len(batches)
+    # requests planned to have no intersecting datasets never touch the Data Cube
+    if batches:
+        with profiling.stage('load'), datacube_from_settings() as dc:
+            for batch in batches:
+                remaining -= 1
+                product_data = load_batch(dc, parameters, batch)
+                if 'time' not in product_data:
+                    continue
+                profiling.add_bytes(product_data.nbytes)
+                loaded_bytes += product_data.nbytes
+                # the loaded data is never used again, so the mosaic can take over its buffers
+                data, complete = fill_mosaic(data, product_data,
+                                             get_nodata_values(coverage_offering, product_data.data_vars), copy=False)
+                if complete:
+                    break
+    metrics.coverage_load_bytes.observe(loaded_bytes, coverage=parameters['product'])
+    metrics.mosaic_loads.inc(len(batches) - remaining, coverage=parameters['product'], result='loaded')
+    if remaining:
+        metrics.mosaic_loads.inc(remaining, coverage=parameters['product'], result='skipped')
 
+    if data is not None:
+        _clear_attrs(data)
     # if there isn't any data, we can assume that there was no data for the acquisition
-    if data is None:
-        with datacube.Datacube(config=config_from_settings()) as dc:
-            extents = dc.load(dask_chunks={}, **parameters)
-
-            latitude_range = (parameters.get('latitude')[0], parameters.get('latitude')[1])
-            longitude_range = (parameters.get('longitude')[0], parameters.get('longitude')[1])
-
-            latitude = extents['latitude'] if 'latitude' in extents else np.linspace(
-                latitude_range[0],
-                latitude_range[1],
-                num=abs((latitude_range[1] - latitude_range[0]) / parameters['resolution'][0]))
-            longitude = extents['longitude'] if 'longitude' in extents else np.linspace(
-                longitude_range[0],
-                longitude_range[1],
-                num=abs((longitude_range[1] - longitude_range[0]) / parameters['resolution'][1]))
-
-            data = xr.Dataset(
-                {
-                    band: (('latitude', 'longitude'), np.full(
-                        (len(latitude), len(longitude)),
-                        rangeset.get(band_name=band).null_value if rangeset.filter(band_name=band).exists() else 0))
-                    for band in parameters['measurements']
-                },
-                coords={'latitude': latitude,
-                        'longitude': longitude}).astype('int16')
+    else:
+        data = get_empty_dataset(coverage_offering, parameters, query_extents=bool(full_date_ranges))
 
     return data
 
 
-def create_mosaic(dataset_in, no_data=[]):
-    """Return a mosaic of the most recent pixel"""
+def get_composite_dataset(coverage_offering, parameters, individual_dates, date_ranges, composite):
+    """Get a temporal reduction of every scene in the requested time ranges in bounded memory
+
+    Scenes are loaded WCS_MOSAIC_BATCH_SIZE at a time and streamed through one accumulator per band, so memory use is
+    proportional to the number of pixels rather than the number of scenes.
+
+    Args:
+        parameters: dictionary-like containing all the parameters needed for a dc.load call
+        individual_dates: list/iterable of datetimes
+        date_ranges: list/iterable of two element datetime tuples
+        composite: name of the reduction - see get_accumulator
+
+    Returns:
+        dataset with one reduced value per pixel and band
+
+    """
+    full_date_ranges = get_load_ranges(individual_dates, date_ranges)
+    batches = get_mosaic_batches(coverage_offering, parameters, full_date_ranges,
+                                 getattr(settings, 'WCS_MOSAIC_BATCH_SIZE', 2))
+
+    accumulators = None
+    coords = None
+    loaded_bytes = 0
+    if batches:
+        with profiling.stage('load'), datacube_from_settings() as dc:
+            for batch in batches:
+                product_data = load_batch(dc, parameters, batch)
+                if 'time' not in product_data:
+                    continue
+                profiling.add_bytes(product_data.nbytes)
+                loaded_bytes += product_data.nbytes
+                # each pass is a single observation
+                product_data = fuse_scene_groups(coverage_offering, product_data,
+                                                 get_nodata_values(coverage_offering, product_data.data_vars))
+                if accumulators is None:
+                    bands = list(product_data.data_vars)
+                    y_dim, x_dim = _spatial_dims(product_data)
+                    coords = {y_dim: product_data[y_dim].values, x_dim: product_data[x_dim].values}
+                    accumulators = {
+                        band: get_accumulator(composite, product_data[band].dtype, nodata)
+                        for band, nodata in zip(bands, get_nodata_values(coverage_offering, bands))
+                    }
+                for index in range(product_data.sizes['time']):
+                    for band, accumulator in accumulators.items():
+                        accumulator.add(product_data[band].values[index])
+    metrics.coverage_load_bytes.observe(loaded_bytes, coverage=parameters['product'])
+
+    if accumulators is None:
+        return get_empty_dataset(coverage_offering, parameters, query_extents=bool(full_date_ranges))
+    return xr.Dataset({band: (tuple(coords), accumulator.result())
+                       for band, accumulator in accumulators.items()},
+                      coords=coords)
+
+
+def get_valid_mask(values, nodata):
+    """Get a mask of the values that aren't nodata - NaN is never valid in float bands, whatever the nodata value"""
+    valid = values != nodata
+    if values.dtype.kind == 'f':
+        valid &= ~np.isnan(values)
+    return valid
+
+
+class Accumulator(object):
+    """Base class of the streaming temporal reductions - consumes 2d time slices keeping O(pixels) state
+
+    Observations that aren't valid (see get_valid_mask) are ignored and pixels without any valid observation are set
+    to nodata in the result.
+
+    """
+
+    def __init__(self, dtype, nodata):
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+        self.count = None
+
+    def add(self, values):
+        valid = get_valid_mask(values, self.nodata)
+        if self.count is None:
+            self.count = np.zeros(values.shape, dtype=np.int32)
+            self.start(values)
+        self.count += valid
+        self.update(values, valid)
+
+    def start(self, values):
+        pass
+
+    def update(self, values, valid):
+        raise NotImplementedError
+
+    def result(self):
+        return np.where(self.count > 0, self.reduce(), self.nodata).astype(self.result_dtype())
+
+    def reduce(self):
+        raise NotImplementedError
+
+    def result_dtype(self):
+        return np.promote_types(self.dtype, np.float32)
+
+
+class CountAccumulator(Accumulator):
+    """Number of valid observations of each pixel"""
+
+    def update(self, values, valid):
+        pass
+
+    def result(self):
+        return self.count.astype(np.int16 if self.count.max() <= np.iinfo(np.int16).max else np.int32)
+
+
+class MeanAccumulator(Accumulator):
+    """Mean of the valid observations of each pixel from a running sum and count"""
+
+    def start(self, values):
+        self.total = np.zeros(values.shape, dtype=np.float64)
+
+    def update(self, values, valid):
+        np.add(self.total, values, out=self.total, where=valid)
+
+    def reduce(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total / self.count
+
+
+class ExtremumAccumulator(Accumulator):
+    """Running minimum or maximum of the valid observations of each pixel, kept in the band's dtype"""
+
+    function = None
+
+    def start(self, values):
+        self.value = np.array(values, copy=True)
+
+    def update(self, values, valid):
+        # the first valid observation of a pixel replaces whatever is held for it
+        first = valid & (self.count == 1)
+        self.value[first] = values[first]
+        self.function(self.value, values, out=self.value, where=valid & ~first)
+
+    def reduce(self):
+        return self.value
+
+    def result_dtype(self):
+        return self.dtype
+
+
+class MinAccumulator(ExtremumAccumulator):
+    function = np.minimum
+
+
+class MaxAccumulator(ExtremumAccumulator):
+    function = np.maximum
+
+
+class QuantileAccumulator(Accumulator):
+    """Approximate quantile of the valid observations of each pixel using the P-square algorithm
 
-    dataset_in = dataset_in.copy(deep=True)
-    dataset_out = None
-    time_slices = reversed(range(len(dataset_in.time)))
-    for index in time_slices:
-        dataset_slice = dataset_in.isel(time=index).drop('time')
-        if dataset_out is None:
-            dataset_out = dataset_slice.copy(deep=True)
+    Each pixel keeps five marker heights and positions that are adjusted as observations arrive (Jain and Chlamtac,
+    1985), vectorized across pixels. Pixels with fewer than five observations get their exact quantile.
+
+    Args:
+        quantile: quantile in [0, 1], e.g. 0.5 for the median
+
+    """
+
+    def __init__(self, dtype, nodata, quantile=0.5):
+        super(QuantileAccumulator, self).__init__(dtype, nodata)
+        self.quantile = quantile
+        self.increments = np.array([0, quantile / 2, quantile, (1 + quantile) / 2, 1])[:, None]
+        self.initial = np.array([1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5])[:, None]
+
+    def start(self, values):
+        self.heights = np.zeros((5, values.size), dtype=np.float64)
+        self.positions = np.tile(np.arange(1, 6, dtype=np.float64)[:, None], (1, values.size))
+
+    def add(self, values):
+        # the markers are adjusted for pixels that already had five observations before this one
+        valid = get_valid_mask(values, self.nodata).ravel()
+        update = None if self.count is None else valid & (self.count >= 5).ravel()
+        super(QuantileAccumulator, self).add(values)
+        values, count = values.ravel(), self.count.ravel()
+        if update is not None and update.any():
+            self._update_markers(update, values.astype(np.float64), count)
+        self._initialize_markers(np.flatnonzero(valid & (count <= 5) & (count > 0)), values)
+
+    def update(self, values, valid):
+        pass
+
+    def _initialize_markers(self, pixels, values):
+        if not pixels.size:
+            return
+        count = self.count.ravel()[pixels]
+        self.heights[count - 1, pixels] = values[pixels]
+        ready = pixels[count == 5]
+        self.heights[:, ready] = np.sort(self.heights[:, ready], axis=0)
+
+    def _update_markers(self, update, x, count):
+        heights, positions = self.heights, self.positions
+        np.minimum(heights[0], x, out=heights[0], where=update)
+        np.maximum(heights[4], x, out=heights[4], where=update)
+        cell = np.sum(heights[1:4] <= x, axis=0)
+        positions += (np.arange(5)[:, None] > cell) & update
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for marker in (1, 2, 3):
+                offset = self.initial[marker] + (count - 5) * self.increments[marker] - positions[marker]
+                above = positions[marker + 1] - positions[marker]
+                below = positions[marker] - positions[marker - 1]
+                step = (update & (offset >= 1) & (above > 1)).astype(np.int8) - (update & (offset <= -1) &
+                                                                                  (below > 1))
+                if not step.any():
+                    continue
+                parabolic = heights[marker] + step / (positions[marker + 1] - positions[marker - 1]) * (
+                    (below + step) * (heights[marker + 1] - heights[marker]) / above +
+                    (above - step) * (heights[marker] - heights[marker - 1]) / below)
+                linear = np.where(step > 0, heights[marker] + (heights[marker + 1] - heights[marker]) / above,
+                                  heights[marker] - (heights[marker - 1] - heights[marker]) / -below)
+                adjusted = np.where((heights[marker - 1] < parabolic) & (parabolic < heights[marker + 1]), parabolic,
+                                    linear)
+                np.copyto(heights[marker], adjusted, where=step != 0)
+                positions[marker] += step
+
+    def reduce(self):
+        count = self.count.ravel()
+        result = self.heights[2].copy()
+        partial = np.flatnonzero((count > 0) & (count < 5))
+        if partial.size:
+            observations = np.where(np.arange(5)[:, None] < count[partial], self.heights[:, partial], np.nan)
+            result[partial] = np.nanquantile(observations, self.quantile, axis=0)
+        return result.reshape(self.count.shape)
+
+
+COMPOSITES = {
+    'count': CountAccumulator,
+    'mean': MeanAccumulator,
+    'min': MinAccumulator,
+    'max': MaxAccumulator,
+    'median': QuantileAccumulator
+}
+
+
+def get_accumulator(composite, dtype, nodata):
+    """Create the accumulator of a composite name - one of COMPOSITES or percentile_<0-100>, e.g. percentile_90
+
+    Returns None for unknown names.
+
+    """
+    if composite in COMPOSITES:
+        return COMPOSITES[composite](dtype, nodata)
+    if composite.startswith('percentile_'):
+        try:
+            percentile = float(composite[len('percentile_'):])
+        except ValueError:
+            return None
+        if 0 <= percentile <= 100:
+            return QuantileAccumulator(dtype, nodata, quantile=percentile / 100)
+    return None
+
+
+def get_time_series(coverage_offering, parameters, load_ranges, grid_bounds, geometry=None):
+    """Get the values of a small grid aligned window in every scene of the load ranges, in one batched pass
+
+    The scenes are read directly from their storage units through the block cache when possible, so repeated
+    drills in the same area don't touch the disk, and are loaded from the Data Cube otherwise.
+
+    Args:
+        parameters: dc.load parameters of the window - see form_to_data_cube_parameters
+        load_ranges: time ranges of the scenes
+        grid_bounds: storage grid aligned bounds of the window
+        geometry: GeoJSON like polygon in the storage crs to average the valid pixels of, None for a single pixel
+
+    Returns:
+        (times, values, pixels) - the datetime64 scene times, an ordered dict of a value per scene for each band,
+            None where no pixel is valid, and the number of pixels drilled
+
+    """
+    bands = parameters['measurements']
+    dataset = None
+    with profiling.stage('load'):
+        if load_ranges and getattr(settings, 'WCS_DIRECT_READS', True):
+            dataset = raster_io.read_scenes(parameters, load_ranges, cache_blocks=True)
+        if dataset is None and load_ranges:
+            with datacube_from_settings() as dc:
+                dataset = load_batch(dc, parameters, load_ranges)
+    if dataset is None or 'time' not in dataset:
+        return np.empty(0, dtype='datetime64[ns]'), collections.OrderedDict((band, []) for band in bands), 0
+    profiling.add_bytes(dataset.nbytes)
+
+    # a single dc.load spans the gaps between the ranges
+    timestamps = dataset.time.values.astype('datetime64[ms]').astype(np.int64)
+    in_ranges = np.zeros(len(timestamps), dtype=bool)
+    for start, end in load_ranges:
+        in_ranges |= (timestamps >= catalog.to_timestamp(start)) & (timestamps <= catalog.to_timestamp(end))
+    dataset = fuse_scene_groups(coverage_offering, dataset.isel(time=np.flatnonzero(in_ranges)),
+                                get_nodata_values(coverage_offering, bands))
+
+    y_dim, x_dim = _spatial_dims(dataset)
+    shape = (dataset.sizes[y_dim], dataset.sizes[x_dim])
+    mask = np.ones(shape, dtype=bool)
+    if geometry is not None:
+        from rasterio.features import geometry_mask
+
+        transform, _, _ = get_target_grid(parameters['output_crs'], tuple(grid_bounds), parameters['resolution'])
+        mask = geometry_mask([geometry], shape, transform, invert=True)
+        # polygons smaller than a pixel don't contain any pixel center
+        if not mask.any():
+            mask = geometry_mask([geometry], shape, transform, all_touched=True, invert=True)
+
+    values = collections.OrderedDict()
+    for band, nodata in zip(bands, get_nodata_values(coverage_offering, bands)):
+        band_values = dataset[band].values[:, mask]
+        valid = get_valid_mask(band_values, nodata)
+        counts = valid.sum(axis=1)
+        if band_values.shape[1] == 1:
+            series = band_values[:, 0].tolist()
         else:
-            for idx, key in enumerate(dataset_in.data_vars):
-                dataset_out[key].values[dataset_out[key].values == no_data[idx]] = dataset_slice[key].values[
-                    dataset_out[key].values == no_data[idx]]
+            series = (np.where(valid, band_values, 0).sum(axis=1, dtype=np.float64) / np.maximum(counts, 1)).tolist()
+        values[band] = [value if count else None for value, count in zip(series, counts)]
+    return dataset.time.values, values, int(mask.sum())
+
+
+class BandStatistics(object):
+    """Streaming count, mean, standard deviation, min and max of the valid values of a band
+
+    Every chunk of values is reduced with vectorized numpy calls and merged into the running moments with Chan's
+    parallel algorithm, so any number of scenes is summarized in constant memory without losing precision.
+
+    """
+
+    def __init__(self, nodata):
+        self.nodata = nodata
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        valid = get_valid_mask(values, self.nodata)
+        values = values[valid].astype(np.float64, copy=False)
+        if not values.size:
+            return
+        count, mean = values.size, values.mean()
+        m2 = np.square(values - mean).sum()
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.min = values.min() if self.min is None else min(self.min, values.min())
+        self.max = values.max() if self.max is None else max(self.max, values.max())
+
+    def result(self):
+        """The statistics as a dict - all but the count are None without any valid value"""
+        if not self.count:
+            return collections.OrderedDict([('count', 0), ('mean', None), ('std', None), ('min', None),
+                                            ('max', None)])
+        return collections.OrderedDict([('count', int(self.count)), ('mean', float(self.mean)),
+                                        ('std', float(np.sqrt(self.m2 / self.count))), ('min', float(self.min)),
+                                        ('max', float(self.max))])
+
+
+def get_statistics(coverage_offering, parameters, individual_dates, date_ranges):
+    """Get the statistics of every valid observation of each band in the requested time ranges
+
+    Scenes are loaded WCS_MOSAIC_BATCH_SIZE at a time and streamed through a BandStatistics per band, so memory use
+    is bounded by a batch whatever the length of the time range.
+
+    Returns:
+        (statistics, scenes) - an ordered dict of BandStatistics.result() per band and the number of scenes read
+
+    """
+    full_date_ranges = get_load_ranges(individual_dates, date_ranges)
+    batches = get_mosaic_batches(coverage_offering, parameters, full_date_ranges,
+                                 getattr(settings, 'WCS_MOSAIC_BATCH_SIZE', 2))
+    bands = parameters['measurements']
+    statistics = collections.OrderedDict(
+        (band, BandStatistics(nodata)) for band, nodata in zip(bands, get_nodata_values(coverage_offering, bands)))
+
+    scenes = 0
+    loaded_bytes = 0
+    if batches:
+        with profiling.stage('load'), datacube_from_settings() as dc:
+            for batch in batches:
+                product_data = load_batch(dc, parameters, batch)
+                if 'time' not in product_data:
+                    continue
+                profiling.add_bytes(product_data.nbytes)
+                loaded_bytes += product_data.nbytes
+                # each pass is a single observation
+                product_data = fuse_scene_groups(coverage_offering, product_data,
+                                                 get_nodata_values(coverage_offering, product_data.data_vars))
+                scenes += product_data.sizes['time']
+                with profiling.stage('reduce'):
+                    for band, band_statistics in statistics.items():
+                        band_statistics.add(product_data[band].values)
+    metrics.coverage_load_bytes.observe(loaded_bytes, coverage=parameters['product'])
+    return collections.OrderedDict((band, band_statistics.result())
+                                   for band, band_statistics in statistics.items()), scenes
+
+
+def get_mosaic_batches(coverage_offering, parameters, load_ranges, batch_size=2):
+    """Split load time ranges into newest first batches of at most batch_size scenes each
+
+    Scene times come from the dataset footprints intersecting the request or, for coverages without footprints,
+    the temporal domain. Ranges without any known scene are loaded whole, newest range first. Grouped coverages are
+    batched by group rather than by scene, so the scenes of a pass are always loaded together.
+
+    Returns:
+        list of batches, each a newest first list of the time ranges of its scenes - see load_batch
+
+    """
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name)
+    if entry is None or not load_ranges:
+        return [[load_range] for load_range in sorted(load_ranges, key=lambda load_range: load_range[1], reverse=True)]
+
+    if len(entry.footprints):
+        bounds = transform_bounds(parameters['output_crs'], GEOGRAPHIC_CRS, _query_bounds(parameters))
+        scene_times = entry.footprints.times[entry.footprints.search(bounds, load_ranges)]
+    else:
+        scene_times = [
+            timestamp for timestamp in entry.timestamps
+            if any(catalog.to_timestamp(start) <= timestamp <= catalog.to_timestamp(end) for start, end in load_ranges)
+        ]
+    if not len(scene_times):
+        return [[load_range] for load_range in sorted(load_ranges, key=lambda load_range: load_range[1], reverse=True)]
+
+    groups = collections.OrderedDict()
+    for timestamp in sorted(set(int(timestamp) for timestamp in scene_times), reverse=True):
+        groups.setdefault(entry.get_group_index(timestamp) if entry.offering.group_by else timestamp, []).append(
+            timestamp)
+    groups = list(groups.values())
+    batch_size = max(1, batch_size)
+    batches = (groups[index:index + batch_size] for index in range(0, len(groups), batch_size))
+    return [[(catalog.from_timestamp(group[-1]) - timedelta(seconds=1),
+              catalog.from_timestamp(group[0]) + timedelta(seconds=1)) for group in batch] for batch in batches]
+
+
+def load_batch(dc, parameters, time_ranges):
+    """Load a batch of scenes, fanning the reads out per band and per scene over WCS_LOAD_THREADS threads
+
+    Every read holds the process wide I/O semaphore, so concurrent requests never have more than
+    WCS_IO_CONCURRENCY reads in flight between them. A single thread loads the scenes one dc.load at a time. Grid
+    aligned loads are read directly from the storage units through the raster handle cache when WCS_DIRECT_READS
+    is set (the default) and every unit is a local file - see raster_io.read_scenes.
+
+    Args:
+        dc: Datacube instance
+        parameters: dc.load parameters
+        time_ranges: time ranges of the scenes of the batch
+
+    Returns:
+        dataset with the time slices of every scene in time order, empty if no scene intersected the request
+
+    """
+    if getattr(settings, 'WCS_DIRECT_READS', True):
+        dataset = raster_io.read_scenes(parameters, time_ranges)
+        if dataset is not None:
+            return dataset
+
+    bands = parameters.get('measurements') or [None]
+    reads = [(time_range, band) for time_range in time_ranges for band in bands]
+    thread_count = min(getattr(settings, 'WCS_LOAD_THREADS', 4), len(reads))
 
-    return dataset_out
+    def _load(read):
+        time_range, band = read
+        query = dict(parameters, measurements=[band]) if band is not None else parameters
+        with get_io_semaphore():
+            return dc.load(time=time_range, **query)
+
+    if thread_count <= 1:
+        # a load per scene with every band - a single load spanning the batch would also read the acquisitions
+        # between its scenes, which a discrete TIME list leaves out
+        bands = [None]
+        results = [_load((time_range, None)) for time_range in time_ranges]
+    else:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = list(executor.map(_load, reads))
+
+    scenes = []
+    for index in range(len(time_ranges)):
+        parts = [part for part in results[index * len(bands):(index + 1) * len(bands)] if 'time' in part]
+        if parts:
+            scenes.append(xr.Dataset({band: part[band] for part in parts for band in part.data_vars}))
+    if not scenes:
+        return xr.Dataset()
+    return scenes[0] if len(scenes) == 1 else xr.concat(scenes, 'time').sortby('time')
+
+
+_io_semaphore = None
+_io_semaphore_lock = threading.Lock()
+
+
+def get_io_semaphore():
+    """Get the process wide semaphore bounding concurrent Data Cube reads to WCS_IO_CONCURRENCY (default 16)"""
+    global _io_semaphore
+    if _io_semaphore is None:
+        with _io_semaphore_lock:
+            if _io_semaphore is None:
+                _io_semaphore = threading.BoundedSemaphore(getattr(settings, 'WCS_IO_CONCURRENCY', 16))
+    return _io_semaphore
+
+
+def get_group_query(coverage_offering):
+    """Get the dc.load parameters that fuse a grouped coverage's acquisitions while loading
+
+    The Data Cube fuses solar days itself. Time window groups are fused after loading - see fuse_scene_groups.
+
+    """
+    return {'group_by': 'solar_day'} if coverage_offering.group_by == 'solar_day' else {}
+
+
+def fuse_scene_groups(coverage_offering, dataset, no_data):
+    """Fuse the time slices of a dataset that belong to the same time window group, newest pixel first
+
+    Returns:
+        dataset with a time slice per group, at the time of the group's first slice
+
+    """
+    if coverage_offering.group_by != 'window' or 'time' not in dataset.dims or dataset.sizes['time'] < 2:
+        return dataset
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name)
+    if entry is None:
+        return dataset
+
+    timestamps = dataset.time.values.astype('datetime64[ms]').astype(np.int64)
+    group_indexes = [entry.get_group_index(timestamp) for timestamp in timestamps]
+    if len(set(group_indexes)) == len(group_indexes):
+        return dataset
+
+    slices = []
+    for group_index in sorted(set(group_indexes)):
+        indexes = [index for index, value in enumerate(group_indexes) if value == group_index]
+        # fancy indexing copies, so the group's slices can be filled in place
+        fused, _ = fill_mosaic(None, dataset.isel(time=indexes), no_data, copy=False)
+        slices.append(fused.expand_dims(time=[dataset.time.values[indexes[0]]]))
+    return xr.concat(slices, 'time')
+
+
+def fill_mosaic(mosaic, dataset, no_data, copy=True):
+    """Fill the nodata pixels of a mosaic in place from a dataset's time slices, newest first
+
+    Args:
+        mosaic: dataset without a time dimension that owns its buffers, or None to start a new mosaic
+        dataset: dataset with a time dimension
+        no_data: nodata values matching the dataset's data variables
+        copy: copy the newest slice when starting a new mosaic - otherwise dataset's buffers are filled in place
+
+    Returns:
+        the mosaic and whether it is complete - i.e. no band has nodata pixels left
+
+    """
+    bands = list(dataset.data_vars)
+    nodata = dict(zip(bands, no_data))
+    for index in reversed(range(dataset.sizes['time'])):
+        dataset_slice = dataset.isel(time=index, drop=True)
+        if mosaic is None:
+            mosaic = dataset_slice.copy(deep=True) if copy else dataset_slice
+        else:
+            for band in bands:
+                missing = ~get_valid_mask(mosaic[band].values, nodata[band])
+                mosaic[band].values[missing] = dataset_slice[band].values[missing]
+        if all(get_valid_mask(mosaic[band].values, nodata[band]).all() for band in bands):
+            return mosaic, True
+    return mosaic, False
+
+
+def get_empty_dataset(coverage_offering, parameters, query_extents=True):
+    """Get a dataset of nodata values covering the requested grid
+
+    Args:
+        parameters: dc.load parameters of the request
+        query_extents: get the grid from a lazy Data Cube load - otherwise it is computed from the parameters
+
+    """
+    extents = xr.Dataset()
+    if query_extents:
+        with datacube_from_settings() as dc:
+            extents = dc.load(dask_chunks={}, **parameters)
+
+    y_dim, x_dim = _spatial_dims(extents) if extents.dims else _crs_dims(parameters['output_crs'])
+    if y_dim in extents and x_dim in extents:
+        y, x = extents[y_dim].values, extents[x_dim].values
+    else:
+        _, y, x = get_target_grid(parameters['output_crs'], _query_bounds(parameters), parameters['resolution'])
+
+    nodata_values = get_nodata_values(coverage_offering, parameters['measurements'])
+    # int16 unless a nodata value doesn't fit, e.g. NaN
+    limits = np.iinfo(np.int16)
+    dtype = 'int16' if all(limits.min <= nodata <= limits.max and float(nodata).is_integer()
+                           for nodata in nodata_values) else 'float32'
+    return xr.Dataset(
+        {
+            band: ((y_dim, x_dim), np.full((len(y), len(x)), nodata, dtype=dtype))
+            for band, nodata in zip(parameters['measurements'], nodata_values)
+        },
+        coords={y_dim: y,
+                x_dim: x})
+
+
+def get_dataset_footprint(dataset):
+    """Get the CoverageDatasetFootprint fields of a Data Cube dataset
+
+    Band paths are resolved against the dataset uri so that they can be opened directly. The band and layer of
+    measurements stored in multi-band or multi-variable files are kept with their path - see
+    raster_io.get_band_source.
+
+    """
+    import json
+    import pytz
+
+    bounds = dataset.extent.to_crs(GEOGRAPHIC_CRS).boundingbox
+    uri = dataset.local_uri or (dataset.uris[0] if dataset.uris else "")
+    time = dataset.center_time
+    return {
+        'dataset_id': str(dataset.id),
+        'time': time.replace(tzinfo=pytz.UTC) if time.tzinfo is None else time,
+        'min_latitude': bounds.bottom,
+        'max_latitude': bounds.top,
+        'min_longitude': bounds.left,
+        'max_longitude': bounds.right,
+        'uri': uri,
+        'band_paths': json.dumps({band: _get_band_path(uri, measurement)
+                                  for band, measurement in dataset.measurements.items()})
+    }
+
+
+def _get_band_path(uri, measurement):
+    from datacube.utils.uris import uri_resolve
+
+    path = uri_resolve(uri, measurement.get('path', '')) if uri else measurement.get('path', '')
+    if measurement.get('band') is None and measurement.get('layer') is None:
+        return path
+    return {'path': path, 'band': measurement.get('band'), 'layer': measurement.get('layer')}
+
+
+def get_nodata_values(coverage_offering, bands):
+    """Get the nodata values of a coverage's bands from the catalog snapshot, 0 for bands without a rangeset entry"""
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name)
+    return entry.get_nodata_values(bands) if entry else [0] * len(bands)
+
+
+def create_mosaic(dataset_in, no_data=[]):
+    """Return a mosaic of the most recent pixel"""
+    return fill_mosaic(None, dataset_in, no_data)[0]
 
 
 def create_bit_mask(data_array, valid_bits, no_data=-9999):
@@ -141,6 +778,38 @@ def create_bit_mask(data_array, valid_bits, no_data=-9999):
     return clean_mask.values
 
 
+def get_format_processing(format_name, coverage_name):
+    """Get the (input bands, processing function) pair of a format for a coverage
+
+    Only depends on the names, so that processing can be looked up in worker processes without the database.
+
+    """
+    def abs_divide(ds, bands):
+        ds["_".join(bands)] = abs(ds[bands[0]] / ds[bands[1]])
+        return ds[[*bands, "_".join(bands)]]
+
+    # this is pretty much all bad
+    processing_map = {
+        'RGB_GeoTIFF': {
+            'landsat': (['red', 'green', 'blue'], lambda ds: ds[['red', 'green', 'blue']]),
+            'alos': (['hh', 'hv'], lambda ds: ds.pipe(abs_divide, bands=['hh', 'hv']).fillna(0)),
+            'sentinel': (['vv', 'vh'], lambda ds: ds.pipe(abs_divide, bands=['vv', 'vh']).fillna(0))
+        },
+        'Filtered_GeoTIFF': {
+            'landsat': (['red', 'green', 'blue', 'nir', 'swir1', 'swir2', 'pixel_qa'],
+                        lambda ds: ds[['red', 'green', 'blue','nir','swir1','swir2']]
+                                    .where(create_bit_mask(ds['pixel_qa'], valid_bits=[1, 2]))
+                                    .fillna(-9999))
+        }
+    }
+
+    _type = 'landsat' if any(
+        ext in coverage_name for ext in ['ls5', 'ls7', 'ls8']
+    ) else 'sentinel' if 's1_gamma' in coverage_name else 'alos' if 'alos' in coverage_name else ""
+
+    return processing_map.get(format_name, {}).get(_type, (None, lambda d: d))
+
+
 def get_datacube_metadata(dc, product):
     """Get the extents and number of tiles for a given product"""
     dataset = dc.load(product, dask_chunks={})
@@ -178,8 +847,14 @@ def list_acquisition_dates(dc, product):
     return dataset.time.values.astype('M8[ms]').tolist()
 
 
+@profiling.timed('encode')
 def get_tiff_response(coverage_offering, dataset, crs):
     """Uses rasterio MemoryFiles in order to return a streamable GeoTiff response"""
+    return encode_tiff(dataset, crs, get_nodata_values(coverage_offering, dataset.data_vars))
+
+
+def encode_tiff(dataset, crs, nodata_values):
+    """Encode a dataset as a GeoTIFF with a band per data variable"""
 
     supported_dtype_map = {
         'uint8': 1,
@@ -196,47 +871,281 @@ def get_tiff_response(coverage_offering, dataset, crs):
 
     dtype_list = [dataset[array].dtype for array in dataset.data_vars]
     dtype = str(max(dtype_list, key=lambda d: supported_dtype_map[str(d)]))
-    rangeset = apps.get_model("data_cube_wcs.CoverageRangesetEntry").objects.filter(coverage_offering=coverage_offering)
 
-    dataset = dataset.astype(dtype)
+    if any(dataset[band].dtype != dtype for band in dataset.data_vars):
+        dataset = dataset.astype(dtype)
     with MemoryFile() as memfile:
         with memfile.open(
                 driver="GTiff",
-                width=dataset.dims['longitude'],
-                height=dataset.dims['latitude'],
+                width=dataset.sizes[_spatial_dims(dataset)[1]],
+                height=dataset.sizes[_spatial_dims(dataset)[0]],
                 count=len(dataset.data_vars),
                 transform=_get_transform_from_xr(dataset),
                 crs=crs,
                 dtype=dtype) as dst:
             for idx, band in enumerate(dataset.data_vars, start=1):
                 dst.write(dataset[band].values, idx)
-            dst.set_nodatavals([
-                rangeset.get(band_name=band).null_value if rangeset.filter(band_name=band).exists() else 0
-                for band in dataset.data_vars
-            ])
+            dst.set_nodatavals(nodata_values)
         return memfile.read()
 
 
+@profiling.timed('encode')
 def get_netcdf_response(coverage_offering, dataset, crs):
     """Uses a standard xarray function to create a bytes-like data stream for http response"""
+    return encode_netcdf(dataset, crs)
+
+
+def encode_netcdf(dataset, crs):
     dataset.attrs['crs'] = crs
-    return dataset.to_netcdf()
+    # newer xarray versions return a memoryview, which HttpResponse would iterate over byte by byte
+    return bytes(dataset.to_netcdf())
 
 
 def _get_transform_from_xr(dataset):
-    """Create a geotransform from an xarray dataset."""
+    """Create a geotransform from the pixel center coordinates of an xarray dataset."""
+
+    from affine import Affine
+    y_dim, x_dim = _spatial_dims(dataset)
+    x, y = dataset[x_dim].values, dataset[y_dim].values
+    x_resolution = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 0
+    y_resolution = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 0
+
+    return Affine(x_resolution, 0, x[0] - x_resolution / 2, 0, y_resolution, y[0] - y_resolution / 2)
+
+
+def _spatial_dims(dataset):
+    """Get the (y, x) dimension names of a dataset - latitude/longitude for geographic data"""
+    return ('latitude', 'longitude') if 'latitude' in dataset.dims else ('y', 'x')
+
+
+def _crs_dims(crs):
+    """Get the (y, x) dimension names used for data in a crs"""
+    return ('latitude', 'longitude') if get_crs(crs).is_geographic else ('y', 'x')
+
+
+GEOGRAPHIC_CRS = "EPSG:4326"
+
+
+def normalize_crs(crs):
+    """Normalize a crs string so that equal crs strings compare equal, e.g. epsg:4326 -> EPSG:4326"""
+    return crs.strip().upper()
+
+
+@lru_cache(maxsize=256)
+def get_crs(crs):
+    """Parse a crs string once per process"""
+    from rasterio.crs import CRS
+    return CRS.from_user_input(crs)
+
+
+def is_valid_crs(crs):
+    """Check if a crs string can be used as a request or response crs - any EPSG code is accepted"""
+    if not crs.startswith("EPSG:"):
+        return False
+    try:
+        get_crs(crs)
+    except Exception:
+        return False
+    return True
+
+
+@lru_cache(maxsize=4096)
+def transform_bounds(src_crs, dst_crs, bounds):
+    """Transform (minx, miny, maxx, maxy) bounds between two crs, cached for repeated requests"""
+    if src_crs == dst_crs:
+        return tuple(bounds)
+    from rasterio.warp import transform_bounds as _transform_bounds
+    return _transform_bounds(get_crs(src_crs), get_crs(dst_crs), *bounds, densify_pts=21)
 
-    from rasterio.transform import from_bounds
-    geotransform = from_bounds(dataset.longitude[0], dataset.latitude[-1], dataset.longitude[-1], dataset.latitude[0],
-                               len(dataset.longitude), len(dataset.latitude))
 
-    return geotransform
+def transform_points(src_crs, dst_crs, points):
+    """Transform a list of (x, y) points between two crs"""
+    if src_crs == dst_crs:
+        return [tuple(point) for point in points]
+    from rasterio.warp import transform
+    xs, ys = transform(get_crs(src_crs), get_crs(dst_crs), [x for x, _ in points], [y for _, y in points])
+    return list(zip(xs, ys))
+
+
+@lru_cache(maxsize=1024)
+def get_target_grid(crs, bounds, resolution):
+    """Get the affine transform and y/x pixel center coordinates of a north-up grid
+
+    Args:
+        crs: crs of the grid - only part of the cache key
+        bounds: (minx, miny, maxx, maxy) covered by the grid
+        resolution: (y resolution, x resolution) where the y resolution is negative
+
+    """
+    from affine import Affine
+    y_resolution, x_resolution = -abs(resolution[0]), abs(resolution[1])
+    width = max(1, int(round((bounds[2] - bounds[0]) / x_resolution)))
+    height = max(1, int(round((bounds[3] - bounds[1]) / -y_resolution)))
+    transform = Affine(x_resolution, 0, bounds[0], 0, y_resolution, bounds[3])
+    x = bounds[0] + x_resolution * (np.arange(width) + 0.5)
+    y = bounds[3] + y_resolution * (np.arange(height) + 0.5)
+    return transform, y, x
+
+
+# misalignment, in pixels, below which a request is treated as exactly on the storage grid
+GRID_ALIGNMENT_TOLERANCE = 1e-3
+
+
+def align_to_grid(bounds, resolution, origin, storage_resolution, tolerance=GRID_ALIGNMENT_TOLERANCE):
+    """Snap a request grid to a north-up storage grid if every pixel edge is within tolerance pixels of it
+
+    Args:
+        bounds: (minx, miny, maxx, maxy) of the request in the storage crs
+        resolution: (y resolution, x resolution) of the request
+        origin: (x, y) of the storage grid's top left corner
+        storage_resolution: (y resolution, x resolution) of the storage grid - y must be negative
+        tolerance: largest misalignment of any pixel edge, as a fraction of a pixel
+
+    Returns:
+        the bounds snapped onto the storage grid's pixel edges or None if the request is not aligned
+
+    """
+    y_resolution, x_resolution = storage_resolution
+    if not (x_resolution > 0 > y_resolution):
+        return None
+
+    columns = (bounds[2] - bounds[0]) / x_resolution
+    rows = (bounds[3] - bounds[1]) / -y_resolution
+    # the resolution error accumulates across the request, so it is checked at the far edges
+    if (abs(abs(resolution[1]) / x_resolution - 1) * columns > tolerance or
+            abs(abs(resolution[0]) / -y_resolution - 1) * rows > tolerance):
+        return None
+
+    left = (bounds[0] - origin[0]) / x_resolution
+    top = (bounds[3] - origin[1]) / y_resolution
+    if any(abs(edge - round(edge)) > tolerance for edge in (left, top, left + columns, top + rows)):
+        return None
+
+    left, top, columns, rows = round(left), round(top), max(1, round(columns)), max(1, round(rows))
+    return (origin[0] + left * x_resolution, origin[1] + (top + rows) * y_resolution,
+            origin[0] + (left + columns) * x_resolution, origin[1] + top * y_resolution)
+
+
+def expand_to_grid(bounds, origin, storage_resolution):
+    """Expand bounds outwards to the pixel edges of a north-up storage grid, covering at least one pixel
+
+    Args:
+        bounds: (minx, miny, maxx, maxy) in the storage crs - a point has equal min and max
+        origin: (x, y) of the storage grid's top left corner
+        storage_resolution: (y resolution, x resolution) of the storage grid - y must be negative
+
+    """
+    y_resolution, x_resolution = storage_resolution
+    left = np.floor((bounds[0] - origin[0]) / x_resolution)
+    right = max(left + 1, np.ceil((bounds[2] - origin[0]) / x_resolution))
+    top = np.floor((bounds[3] - origin[1]) / y_resolution)
+    bottom = max(top + 1, np.ceil((bounds[1] - origin[1]) / y_resolution))
+    return (float(origin[0] + left * x_resolution), float(origin[1] + bottom * y_resolution),
+            float(origin[0] + right * x_resolution), float(origin[1] + top * y_resolution))
+
+
+def get_grid_query(bounds, crs, coverage_offering):
+    """Get the dc.load query parameters that load exactly the storage grid pixels within snapped bounds
+
+    The load is aligned to the storage grid at the native resolution, so the Data Cube reads the pixels with
+    windowed reads rather than resampling them. The query bounds are inset by a quarter pixel so that rounding can
+    never add a row or column of pixels.
+
+    """
+    y_resolution, x_resolution = coverage_offering.y_resolution, coverage_offering.x_resolution
+    x_inset, y_inset = x_resolution / 4, -y_resolution / 4
+    query = {
+        'resolution': (y_resolution, x_resolution),
+        'align': (_grid_offset(coverage_offering.origin_y, -y_resolution),
+                  _grid_offset(coverage_offering.origin_x, x_resolution)),
+        'resampling': 'nearest'
+    }
+    if get_crs(crs).is_geographic:
+        query.update({
+            'latitude': (bounds[1] + y_inset, bounds[3] - y_inset),
+            'longitude': (bounds[0] + x_inset, bounds[2] - x_inset)
+        })
+    else:
+        query.update({
+            'x': (bounds[0] + x_inset, bounds[2] - x_inset),
+            'y': (bounds[1] + y_inset, bounds[3] - y_inset),
+            'crs': crs
+        })
+    return query
+
+
+def _grid_offset(origin, resolution):
+    """Get the offset of a grid's pixel edges from 0, in [0, resolution)"""
+    offset = origin % resolution
+    return 0.0 if abs(offset - resolution) < resolution * GRID_ALIGNMENT_TOLERANCE else offset
+
+
+def _query_bounds(parameters):
+    """Get the (minx, miny, maxx, maxy) bounds of dc.load parameters in the output crs"""
+    if 'x' in parameters:
+        return (parameters['x'][0], parameters['y'][0], parameters['x'][1], parameters['y'][1])
+    return transform_bounds(GEOGRAPHIC_CRS, parameters['output_crs'],
+                            (parameters['longitude'][0], parameters['latitude'][0], parameters['longitude'][1],
+                             parameters['latitude'][1]))
+
+
+@profiling.timed('reproject')
+def reproject_dataset(coverage_offering, dataset, src_crs, dst_crs, bounds, resolution, resampling='nearest'):
+    """Warp a dataset to a grid in another crs using a GDAL warp with WCS_WARP_THREADS threads (default 1)
+
+    Requests are already served concurrently, so the warp is single threaded unless configured otherwise.
+
+    Args:
+        coverage_offering: CoverageOffering model, used for nodata values
+        dataset: xarray dataset with y/x or latitude/longitude dimensions in src_crs
+        src_crs, dst_crs: crs strings
+        bounds: (minx, miny, maxx, maxy) of the output grid in dst_crs
+        resolution: (y resolution, x resolution) of the output grid in dst_crs units
+        resampling: rasterio resampling method name
+
+    """
+    from rasterio.warp import reproject, Resampling
+
+    dst_transform, y, x = get_target_grid(dst_crs, tuple(bounds), tuple(resolution))
+    y_dim, x_dim = _crs_dims(dst_crs)
+    src_transform = _get_transform_from_xr(dataset)
+
+    bands = {}
+    for band, nodata in zip(dataset.data_vars, get_nodata_values(coverage_offering, dataset.data_vars)):
+        destination = np.full((len(y), len(x)), nodata, dtype=dataset[band].dtype)
+        reproject(
+            source=dataset[band].values,
+            destination=destination,
+            src_transform=src_transform,
+            src_crs=get_crs(src_crs),
+            src_nodata=nodata,
+            dst_transform=dst_transform,
+            dst_crs=get_crs(dst_crs),
+            dst_nodata=nodata,
+            resampling=getattr(Resampling, resampling),
+            num_threads=getattr(settings, 'WCS_WARP_THREADS', 1),
+            warp_mem_limit=getattr(settings, 'WCS_WARP_MEMORY_LIMIT', 64))
+        bands[band] = ((y_dim, x_dim), destination)
+
+    return xr.Dataset(bands, coords={y_dim: y, x_dim: x})
 
 
 def _ranges_intersect(x, y):
     return x[0] <= y[1] and y[0] <= x[1]
 
 
+def datacube_from_settings():
+    """Create a Datacube instance configured from the django settings
+
+    The WCS_DATACUBE_FACTORY setting can be set to the dotted path of a callable that returns a Datacube-like
+    object, e.g. the synthetic Data Cube used by the benchmarks.
+
+    """
+    if getattr(settings, 'WCS_DATACUBE_FACTORY', None):
+        return import_string(settings.WCS_DATACUBE_FACTORY)()
+    return datacube.Datacube(config=config_from_settings())
+
+
 def config_from_settings():
     """Create or load a Datacube configuration from the django settings"""
     if hasattr(settings, 'DATACUBE_CONF_PATH'):
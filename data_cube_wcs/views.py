@@ -1,10 +1,81 @@
-from django.shortcuts import render, render_to_response
-from django.http import HttpResponse
+import asyncio
+import collections
+import csv
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.shortcuts import render
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.views import View
 
+from . import catalog
 from . import forms
+from . import memory
+from . import metrics
 from . import models
-from . import utils
+from . import profiling
+from . import scheduler
+
+# operations that load coverage data, run in the coverage pool of the async view
+COVERAGE_OPERATIONS = ("GetCoverage", "GetStatistics", "GetTimeSeries")
+
+
+def service_exception_response(exception_code, error_msg):
+    """Render a ServiceException document, counting the returned exception code"""
+    metrics.service_exceptions.inc(
+        code=exception_code if exception_code in forms.exception_codes else "NoApplicableCode")
+    response = render(None, 'ServiceException.xml', {'exception_code': exception_code, 'error_msg': error_msg})
+    response['Content-Type'] = 'application/vnd.ogc.se_xml'
+    return response
+
+
+def get_request_parameters(request):
+    """Get the GET parameters with lowercased keys, parsed once per request and shared by the service views"""
+    if not hasattr(request, 'wcs_parameters'):
+        request.wcs_parameters = {key.lower(): val for key, val in request.GET.items()}
+    return request.wcs_parameters
+
+
+def xml_response(document):
+    return HttpResponse(document, content_type='text/xml; charset=UTF-8;')
+
+
+def get_capabilities_key(request, section):
+    """Get the document cache key of a GetCapabilities response - the document links back to the requested url"""
+    return ("GetCapabilities", request.build_absolute_uri().split('?')[0], section or "/")
+
+
+def get_cached_document(request):
+    """Get the cached response document of a valid GetCapabilities or DescribeCoverage request
+
+    Never touches the database, so it can run on an event loop.
+
+    Returns:
+        (operation, document) - the operation is None for invalid requests and the document None if it isn't cached
+
+    """
+    get_data = get_request_parameters(request)
+    base_request_form = forms.BaseRequestForm(get_data)
+    if not base_request_form.is_valid():
+        return None, None
+    operation = base_request_form.cleaned_data.get('request', 'GetCapabilities')
+
+    key = None
+    if operation == "GetCapabilities":
+        get_capabilities_form = forms.GetCapabilitiesForm(get_data)
+        if get_capabilities_form.is_valid():
+            key = get_capabilities_key(request, get_capabilities_form.cleaned_data.get('section'))
+    elif operation == "DescribeCoverage" and get_data.get('version') == "1.0.0":
+        key = ("DescribeCoverage", get_data.get('coverage'))
+
+    snapshot = catalog.get_current() if key else None
+    return operation, snapshot.get_document(key) if snapshot else None
 
 
 class WebService(View):
@@ -17,23 +88,89 @@ class WebService(View):
             'WCS': {
                 'GetCapabilities': GetCapabilities,
                 'DescribeCoverage': DescribeCoverage,
-                'GetCoverage': GetCoverage
+                'GetCoverage': GetCoverage,
+                'GetStatistics': GetStatistics,
+                'GetTimeSeries': GetTimeSeries
             }
         }
-        get_data = {key.lower(): val for key, val in request.GET.items()}
-        base_request_form = forms.BaseRequestForm(get_data)
-        if not base_request_form.is_valid():
-            response = render_to_response('ServiceException.xml', {
-                'exception_code': "InvalidParameterValue",
-                'error_msg': "Invalid request or service parameter."
-            })
-            response['Content-Type'] = 'application/vnd.ogc.se_xml'
+        started = time.perf_counter()
+        _request = "Invalid"
+        with profiling.profile_request() as profile:
+            get_data = get_request_parameters(request)
+            base_request_form = forms.BaseRequestForm(get_data)
+            if base_request_form.is_valid():
+                service = base_request_form.cleaned_data.get('service', 'WCS')
+                _request = base_request_form.cleaned_data.get('request', 'GetCapabilities')
+                if profile is not None:
+                    profile.operation = _request
+
+                response = view_mapping[service][_request].as_view()(request)
+            else:
+                response = service_exception_response("InvalidParameterValue", "Invalid request or service parameter.")
+
+        metrics.request_duration.observe(time.perf_counter() - started, operation=_request)
+        metrics.requests_total.inc(operation=_request, status=response.status_code)
+        return profiling.annotate_response(response, profile)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """Get the process wide thread pool of the async views for GetCoverage ('coverage') or other ('service') requests
+
+    Sized by WCS_ASYNC_COVERAGE_THREADS (default 4) and WCS_ASYNC_SERVICE_THREADS (default 2).
+
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                setting, default = {'coverage': ('WCS_ASYNC_COVERAGE_THREADS', 4),
+                                    'service': ('WCS_ASYNC_SERVICE_THREADS', 2)}[name]
+                executor = _executors[name] = ThreadPoolExecutor(
+                    max_workers=getattr(settings, setting, default), thread_name_prefix="wcs-" + name)
+    return executor
+
+
+def _serve(request):
+    """Serve a request with the synchronous WebService, managing the database connection of the pool thread"""
+    close_old_connections()
+    try:
+        return WebService.as_view()(request)
+    finally:
+        close_old_connections()
+
+
+class AsyncWebService(View):
+    """Asynchronous entry point for ASGI servers, enabled with WCS_ASYNC_VIEWS (requires Django 4.1+)
+
+    Cached GetCapabilities and DescribeCoverage documents are served directly on the event loop. Every other request
+    runs the synchronous WebService in a bounded thread pool - GetCoverage requests in their own pool, so slow loads
+    and encodes never hold up the cheap operations and a single process can keep many clients waiting on them.
+
+    """
+
+    async def get(self, request):
+        started = time.perf_counter()
+        operation, document = get_cached_document(request)
+        if document is not None:
+            response = xml_response(document)
+            metrics.request_duration.observe(time.perf_counter() - started, operation=operation)
+            metrics.requests_total.inc(operation=operation, status=response.status_code)
             return response
 
-        service = base_request_form.cleaned_data.get('service', 'WCS')
-        _request = base_request_form.cleaned_data.get('request', 'GetCapabilities')
+        executor = get_executor('coverage' if operation in COVERAGE_OPERATIONS else 'service')
+        return await asyncio.get_running_loop().run_in_executor(executor, _serve, request)
 
-        return view_mapping[service][_request].as_view()(request)
+
+class Metrics(View):
+    """Exposes the metrics registry in the Prometheus text exposition format"""
+
+    def get(self, request):
+        return HttpResponse(metrics.REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class GetCapabilities(View):
@@ -62,16 +199,11 @@ class GetCapabilities(View):
             Validated capabilities document
         """
 
-        get_data = {key.lower(): val for key, val in request.GET.items()}
+        get_data = get_request_parameters(request)
         get_capabilities_form = forms.GetCapabilitiesForm(get_data)
         if not get_capabilities_form.is_valid():
             for error in get_capabilities_form.errors:
-                response = render_to_response('ServiceException.xml', {
-                    'exception_code': get_capabilities_form.errors[error][0],
-                    'error_msg': "Invalid section value."
-                })
-                response['Content-Type'] = 'application/vnd.ogc.se_xml'
-                return response
+                return service_exception_response(get_capabilities_form.errors[error][0], "Invalid section value.")
 
         section_map = {
             "/WCS_Capabilities/Service": "get_capabilities/service.xml",
@@ -79,17 +211,21 @@ class GetCapabilities(View):
             "/WCS_Capabilities/ContentMetadata": "get_capabilities/content_metadata.xml"
         }
 
-        context = {
-            'base_url': request.build_absolute_uri().split('?')[0],
-            'coverage_offerings': models.CoverageOffering.objects.all()
-        }
-        if 'section' in get_capabilities_form.cleaned_data and get_capabilities_form.cleaned_data['section']:
-            context['section'] = section_map[get_capabilities_form.cleaned_data[
-                'section']] if get_capabilities_form.cleaned_data['section'] != "/" else None
-
-        response = render_to_response('GetCapabilities.xml', context)
-        response['Content-Type'] = 'text/xml; charset=UTF-8;'
-        return response
+        # capabilities only change with the catalog, so they are rendered once per catalog snapshot
+        snapshot = catalog.get_catalog()
+        key = get_capabilities_key(request, get_capabilities_form.cleaned_data.get('section'))
+        document = snapshot.get_document(key)
+        if document is None:
+            context = {
+                'base_url': request.build_absolute_uri().split('?')[0],
+                'coverage_offerings': models.CoverageOffering.objects.all()
+            }
+            if 'section' in get_capabilities_form.cleaned_data and get_capabilities_form.cleaned_data['section']:
+                context['section'] = section_map[get_capabilities_form.cleaned_data[
+                    'section']] if get_capabilities_form.cleaned_data['section'] != "/" else None
+            document = render_to_string('GetCapabilities.xml', context)
+            snapshot.set_document(key, document)
+        return xml_response(document)
 
 
 class DescribeCoverage(View):
@@ -120,27 +256,25 @@ class DescribeCoverage(View):
         """
 
         coverages = models.CoverageOffering.objects.all()
-        get_data = {key.lower(): val for key, val in request.GET.items()}
+        get_data = get_request_parameters(request)
 
         if 'version' not in get_data or get_data['version'] != "1.0.0":
-            response = render_to_response('ServiceException.xml', {
-                'exception_code': "MissingParameterValue",
-                'error_msg': "Version is a required parameter for DescribeCoverage requests"
-            })
-            response['Content-Type'] = 'application/vnd.ogc.se_xml'
-            return response
+            return service_exception_response("MissingParameterValue",
+                                              "Version is a required parameter for DescribeCoverage requests")
+
+        # only valid requests are cached, so a cached document needs no validation
+        snapshot = catalog.get_catalog()
+        key = ("DescribeCoverage", get_data.get('coverage'))
+        document = snapshot.get_document(key)
+        if document is not None:
+            return xml_response(document)
 
         if 'coverage' in get_data:
             coverages = models.CoverageOffering.objects.filter(name__in=get_data.get('coverage').split(","))
             if len(coverages) != len(get_data.get('coverage').split(",")):
-                response = render_to_response('ServiceException.xml', {
-                    'exception_code': "CoverageNotDefined",
-                    'error_msg': "Invalid coverage value."
-                })
-                response['Content-Type'] = 'application/vnd.ogc.se_xml'
-                return response
+                return service_exception_response("CoverageNotDefined", "Invalid coverage value.")
 
-        response = render_to_response(
+        document = render_to_string(
             'DescribeCoverage.xml',
             context={
                 'coverage_offerings': coverages,
@@ -149,8 +283,8 @@ class DescribeCoverage(View):
                 'available_input_output_crs': forms.AVAILABLE_INPUT_OUTPUT_CRS,
                 'interpolation_methods': forms.INTERPOLATION_OPTIONS
             })
-        response['Content-Type'] = 'text/xml; charset=UTF-8;'
-        return response
+        snapshot.set_document(key, document)
+        return xml_response(document)
 
 
 class GetCoverage(View):
@@ -163,6 +297,10 @@ class GetCoverage(View):
 
     """
 
+    form_class = forms.GetCoverageForm
+    # tiles rendered in-process for an admitted request are not admitted again, their memory is already reserved
+    admit = True
+
     def get(self, request):
         """Handles the GET parameters for the GetCoverage call, returning a dataset
 
@@ -200,32 +338,168 @@ class GetCoverage(View):
             Subsetted dataset
 
         """
-
-        get_data = {key.lower(): val for key, val in request.GET.items()}
+        get_data = get_request_parameters(request)
 
         if 'version' not in get_data or get_data['version'] != "1.0.0":
-            response = render_to_response('ServiceException.xml', {
-                'exception_code': "MissingParameterValue",
-                'error_msg': "Version is a required parameter for DescribeCoverage requests"
-            })
-            response['Content-Type'] = 'application/vnd.ogc.se_xml'
-            return response
+            return service_exception_response("MissingParameterValue",
+                                              "Version is a required parameter for DescribeCoverage requests")
 
-        coverage_data = forms.GetCoverageForm(get_data)
-        if not coverage_data.is_valid():
+        coverage_data = self.form_class(get_data)
+        with profiling.stage('validate'):
+            is_valid = coverage_data.is_valid()
+        if not is_valid:
             for error in coverage_data.errors:
-                response = render_to_response('ServiceException.xml', {
-                    'exception_code': coverage_data.errors[error][0],
-                    'error_msg': "Invalid or missing {} value.".format(error)
-                })
-                response['Content-Type'] = 'application/vnd.ogc.se_xml'
+                return service_exception_response(coverage_data.errors[error][0],
+                                                  "Invalid or missing {} value.".format(error))
+
+        if not self.admit:
+            return self.render_coverage(get_data, coverage_data)
+        try:
+            with self.admission(request, coverage_data.cleaned_data):
+                return self.render_coverage(get_data, coverage_data)
+        except scheduler.SchedulerBusy as busy:
+            response = service_exception_response(
+                "NoApplicableCode", "The server is busy ({} {}), retry in {} seconds.".format(
+                    busy.lane, busy, busy.retry_after))
+            response.status_code = 503
+            response['Retry-After'] = str(busy.retry_after)
+            return response
+
+    @contextmanager
+    def admission(self, request, cleaned_data):
+        """Wait for a scheduler slot, then reserve the predicted peak memory of a validated request"""
+        with ExitStack() as stack:
+            active_scheduler = scheduler.get_scheduler()
+            if active_scheduler is not None:
+                stack.enter_context(active_scheduler.admit(scheduler.get_cost(cleaned_data),
+                                                           scheduler.get_client(request)))
+            stack.enter_context(memory.reserve(cleaned_data))
+            yield
+
+    def render_coverage(self, get_data, coverage_data):
+        """Load, process and encode the coverage of a validated GetCoverage request"""
+        from . import tiling
+
+        if tiling.should_tile(coverage_data.cleaned_data):
+            response = tiling.get_tiled_response(get_data, coverage_data.cleaned_data)
+            # None if no tile intersects the coverage, which is rendered as a single nodata response
+            if response is not None:
                 return response
-        dc_parameters, individual_dates, date_ranges = utils.form_to_data_cube_parameters(coverage_data)
 
-        dataset = utils.get_stacked_dataset(coverage_data.cleaned_data['coverage'], dc_parameters, individual_dates,
-                                            date_ranges)
+        dataset = self.load_dataset(coverage_data)
         _format = coverage_data.cleaned_data['format']
         return HttpResponse(
             _format.get_http_response(coverage_data.cleaned_data['coverage'], dataset,
                                       coverage_data.cleaned_data['response_crs']),
             content_type=_format.content_type)
+
+    def load_dataset(self, coverage_data):
+        """Load the mosaic or composite of a validated request, warped to the response crs"""
+        # the scientific stack is only imported once the first coverage is requested
+        from . import composites
+        from . import utils
+
+        dc_parameters, individual_dates, date_ranges = utils.form_to_data_cube_parameters(coverage_data)
+
+        if coverage_data.cleaned_data['composite'] == "mosaic":
+            # requests for the whole archive are served from the materialized composite when there is one
+            dataset = None if coverage_data.cleaned_data['time'] else composites.read_composite(
+                coverage_data.cleaned_data['coverage'], dc_parameters, coverage_data.cleaned_data['grid_bounds'])
+            if dataset is None:
+                dataset = utils.get_stacked_dataset(coverage_data.cleaned_data['coverage'], dc_parameters,
+                                                    individual_dates, date_ranges)
+        else:
+            dataset = utils.get_composite_dataset(coverage_data.cleaned_data['coverage'], dc_parameters,
+                                                  individual_dates, date_ranges,
+                                                  coverage_data.cleaned_data['composite'])
+        if coverage_data.cleaned_data['warp']:
+            dataset = utils.reproject_dataset(coverage_data.cleaned_data['coverage'], dataset,
+                                              **coverage_data.cleaned_data['warp'])
+        return dataset
+
+
+class GetStatistics(GetCoverage):
+    """Vendor specific operation summarizing a coverage subset as per band count, mean, std, min and max
+
+    Takes the GetCoverage parameters and goes through the same validation, admission and loads, but reduces the
+    data on the server and returns a small JSON (default) or XML document instead of the coverage.
+
+    """
+
+    form_class = forms.GetStatisticsForm
+
+    def render_coverage(self, get_data, coverage_data):
+        from . import utils
+
+        cleaned_data = coverage_data.cleaned_data
+        if cleaned_data['composite'] is None:
+            dc_parameters, individual_dates, date_ranges = utils.form_to_data_cube_parameters(coverage_data)
+            statistics, scenes = utils.get_statistics(cleaned_data['coverage'], dc_parameters, individual_dates,
+                                                      date_ranges)
+        else:
+            dataset = self.load_dataset(coverage_data)
+            scenes = None
+            statistics = collections.OrderedDict()
+            with profiling.stage('reduce'):
+                for band, nodata in zip(cleaned_data['measurements'], utils.get_nodata_values(
+                        cleaned_data['coverage'], cleaned_data['measurements'])):
+                    band_statistics = utils.BandStatistics(nodata)
+                    band_statistics.add(dataset[band].values)
+                    statistics[band] = band_statistics.result()
+
+        document = collections.OrderedDict([
+            ('coverage', cleaned_data['coverage'].name),
+            ('crs', cleaned_data['response_crs']),
+            ('bbox', list(cleaned_data['response_bounds'])),
+            ('resolution', [cleaned_data['resx'], cleaned_data['resy']]),
+            ('composite', cleaned_data['composite']),
+            ('scenes', scenes),
+            ('bands', statistics),
+        ])
+        if cleaned_data['output_format'] == "XML":
+            return HttpResponse(render_to_string('GetStatistics.xml', document),
+                                content_type='text/xml; charset=UTF-8;')
+        return JsonResponse(document)
+
+
+class GetTimeSeries(GetCoverage):
+    """Vendor specific operation extracting the time series of a point or a small polygon
+
+    Takes the GetCoverage parameters with POINT or POLYGON in place of BBOX and returns the value of each band in
+    every scene of the time range - the mean of the valid pixels for polygons - as JSON (default) or CSV.
+
+    """
+
+    form_class = forms.GetTimeSeriesForm
+
+    def render_coverage(self, get_data, coverage_data):
+        import numpy as np
+
+        from . import utils
+
+        cleaned_data = coverage_data.cleaned_data
+        dc_parameters, _, load_ranges = utils.form_to_data_cube_parameters(coverage_data)
+        times, values, pixels = utils.get_time_series(cleaned_data['coverage'], dc_parameters, load_ranges,
+                                                      cleaned_data['grid_bounds'], cleaned_data['geometry'])
+        times = np.datetime_as_string(times, unit='s').tolist()
+        bands = list(values)
+
+        if cleaned_data['output_format'] == "CSV":
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["time"] + bands)
+            for index, timestamp in enumerate(times):
+                writer.writerow([timestamp] + ["" if values[band][index] is None else values[band][index]
+                                               for band in bands])
+            response = HttpResponse(output.getvalue(), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(cleaned_data['coverage'].name)
+            return response
+        return JsonResponse(collections.OrderedDict([
+            ('coverage', cleaned_data['coverage'].name),
+            ('crs', cleaned_data['response_crs']),
+            ('bbox', list(cleaned_data['response_bounds'])),
+            ('pixels', pixels),
+            ('series', [collections.OrderedDict([('time', timestamp)] + [(band, values[band][index])
+                                                                         for band in bands])
+                        for index, timestamp in enumerate(times)]),
+        ]))
@@ -0,0 +1,188 @@
+"""Worker warmup - initializes the state GetCoverage creates lazily before the first request rather than during it
+
+Enabled by the WCS_WARMUP setting, either True for every step or a list of WARMUP_STEPS. The app runs the warmup
+when it is ready in processes that serve requests (see is_serving), in a background thread unless
+WCS_WARMUP_BACKGROUND is False. Pre-fork servers that load the app before forking (e.g. gunicorn --preload) should
+call start() in their post fork hook instead, as the threads and connections of the parent process are not
+inherited by the workers.
+
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+WARMUP_STEPS = ('imports', 'datacube', 'catalog', 'rasters', 'capabilities', 'encode')
+
+
+def _import_stack():
+    """Import the scientific stack and register the GDAL drivers"""
+    import rasterio
+
+    from . import composites  # noqa: F401
+    from . import utils  # noqa: F401
+
+    with rasterio.Env():
+        pass
+
+
+def _open_datacube():
+    """Connect to the Data Cube index"""
+    from . import utils
+
+    with utils.datacube_from_settings() as dc:
+        dc.list_products()
+
+
+def _load_catalog():
+    """Load the catalog snapshot and the time groups of every coverage"""
+    from . import catalog
+
+    for entry in catalog.get_catalog().coverages.values():
+        entry.groups
+
+
+def _open_rasters():
+    """Open the storage units of the newest scene of every coverage in the raster handle cache"""
+    from . import catalog
+    from . import raster_io
+
+    handle_cache = raster_io.get_handle_cache()
+    sources = []
+    for entry in catalog.get_catalog().coverages.values():
+        if len(entry.footprints):
+            band_paths = entry.footprints.get_footprint(len(entry.footprints) - 1)['band_paths']
+            sources.extend(raster_io.get_band_source(path, band) for band, path in band_paths.items())
+    # the bands of a netCDF storage unit are separate handles, only as many as fit in the cache are opened
+    for source in [source for source in sources if source][:handle_cache.maxsize]:
+        with handle_cache.open(source.path):
+            pass
+
+
+def _render_capabilities():
+    """Render the GetCapabilities and DescribeCoverage documents, compiling their templates"""
+    from django.test import RequestFactory
+    from django.urls import reverse
+
+    from . import views
+
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    factory = RequestFactory(SERVER_NAME=hosts[0] if hosts else 'localhost')
+    # GetCapabilities documents are cached by the url they were requested at
+    path = reverse('web_service')
+    parameters = {'service': "WCS", 'version': "1.0.0"}
+    for view, request in ((views.GetCapabilities, "GetCapabilities"), (views.DescribeCoverage, "DescribeCoverage")):
+        view.as_view()(factory.get(path, dict(parameters, request=request)))
+
+
+def _encode_tile():
+    """Process and encode a 2x2 pixel tile of the first coverage in each of its formats"""
+    from . import catalog
+    from . import models
+    from . import utils
+
+    coverage_offering = models.CoverageOffering.objects.prefetch_related('available_formats').first()
+    entry = catalog.get_catalog().get_coverage(coverage_offering.name) if coverage_offering else None
+    if entry is None:
+        return
+
+    crs = utils.normalize_crs(coverage_offering.crs)
+    resolution = (-abs(coverage_offering.y_resolution or 1e-3), abs(coverage_offering.x_resolution or 1e-3))
+    bounds = (coverage_offering.origin_x, coverage_offering.origin_y + 2 * resolution[0],
+              coverage_offering.origin_x + 2 * resolution[1], coverage_offering.origin_y)
+    y_dim, x_dim = utils._crs_dims(crs)
+    for _format in coverage_offering.available_formats.all():
+        bands = _format.get_required_bands(coverage_offering) or entry.measurements
+        parameters = {
+            'measurements': list(bands),
+            'output_crs': crs,
+            'resolution': resolution,
+            x_dim: (bounds[0], bounds[2]),
+            y_dim: (bounds[1], bounds[3])
+        }
+        dataset = utils.get_empty_dataset(coverage_offering, parameters, query_extents=False)
+        _format.get_http_response(coverage_offering, dataset, crs)
+
+
+_STEP_FUNCTIONS = {
+    'imports': _import_stack,
+    'datacube': _open_datacube,
+    'catalog': _load_catalog,
+    'rasters': _open_rasters,
+    'capabilities': _render_capabilities,
+    'encode': _encode_tile,
+}
+
+
+def get_steps():
+    """Get the warmup steps enabled by the WCS_WARMUP setting, in order"""
+    enabled = getattr(settings, 'WCS_WARMUP', False)
+    if enabled is True:
+        return list(WARMUP_STEPS)
+    return [step for step in WARMUP_STEPS if step in (enabled or ())]
+
+
+def run(steps=None):
+    """Run warmup steps, logging the time each takes - a failing step is logged and skipped
+
+    Returns:
+        dict of the duration in ms of every step that succeeded
+
+    """
+    timings = {}
+    try:
+        for step in get_steps() if steps is None else steps:
+            started = time.perf_counter()
+            try:
+                _STEP_FUNCTIONS[step]()
+            except Exception:
+                logger.exception("WCS warmup step %s failed.", step)
+                continue
+            timings[step] = (time.perf_counter() - started) * 1000
+            logger.info("WCS warmup step %s took %.1fms.", step, timings[step])
+    finally:
+        # don't keep a connection open in a thread that won't serve requests
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+    return timings
+
+
+def is_serving():
+    """Whether this process serves requests - management commands other than runserver and test runs don't
+
+    Processes started through manage.py, django-admin or python -m django are management commands, and only the
+    runserver child process that serves requests (or runserver --noreload) is serving. Any other process, e.g. a
+    gunicorn, uWSGI or mod_wsgi worker, is serving unless it runs tests.
+
+    """
+    if not sys.argv or 'pytest' in sys.modules or 'unittest' in sys.argv[0]:
+        return False
+    program = os.path.basename(sys.argv[0])
+    if program in ('manage.py', 'django-admin', 'django-admin.py') or sys.argv[0].endswith(
+            os.path.join('django', '__main__.py')):
+        # the autoreloader's parent process only restarts the child that serves requests
+        return sys.argv[1:2] == ['runserver'] and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv)
+    return True
+
+
+def start():
+    """Run the configured warmup, in a daemon thread unless WCS_WARMUP_BACKGROUND is False
+
+    Returns:
+        the warmup thread, or None if the warmup ran in this thread or is disabled
+
+    """
+    if not get_steps():
+        return None
+    if not getattr(settings, 'WCS_WARMUP_BACKGROUND', True):
+        run()
+        return None
+    thread = threading.Thread(target=run, name="wcs-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,60 @@
+import os
+import shutil
+import unittest
+
+import django
+
+
+class SyntheticDatacubeTestCase(unittest.TestCase):
+    """Base class of the tests that run the app in-process against the synthetic Data Cube used by the benchmarks
+
+    Every test class shares the one benchmark database and the process wide catalog snapshot and raster caches, so
+    each class writes its own uniquely named products and the caches are dropped around it. Subclasses list the
+    SyntheticProduct instances to set up in get_products - the first one is available as cls.product.
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+        django.setup()
+
+        from benchmarks import fake_datacube, harness
+
+        cls.fake_datacube = fake_datacube
+        cls.harness = harness
+        cls.products = cls.get_products()
+        for product in cls.products:
+            if product.name in fake_datacube.PRODUCTS:
+                raise ValueError("Product {} is already set up by another test class.".format(product.name))
+        cls.product = cls.products[0] if cls.products else None
+        cls.directory = harness.setup_environment(cls.products) if cls.products else None
+        cls.reset_caches()
+
+    @classmethod
+    def tearDownClass(cls):
+        from data_cube_wcs import models
+
+        cls.reset_caches()
+        if cls.products:
+            models.CoverageOffering.objects.filter(name__in=[product.name for product in cls.products]).delete()
+            for product in cls.products:
+                cls.fake_datacube.PRODUCTS.pop(product.name, None)
+            shutil.rmtree(cls.directory, ignore_errors=True)
+        cls.reset_caches()
+
+    @classmethod
+    def get_products(cls):
+        """Get the SyntheticProducts the tests of the class request"""
+        return []
+
+    @staticmethod
+    def reset_caches():
+        """Drop the process wide catalog snapshot, raster caches and recorded Data Cube loads"""
+        from benchmarks import fake_datacube
+        from data_cube_wcs import catalog, raster_io
+
+        catalog.invalidate()
+        raster_io.get_handle_cache().clear()
+        raster_io.get_block_cache().clear()
+        fake_datacube.LOAD_CALLS.clear()
@@ -0,0 +1,77 @@
+import asyncio
+import importlib
+import unittest
+
+from django.views import View
+
+from .base import SyntheticDatacubeTestCase
+
+
+@unittest.skipUnless(hasattr(View, 'view_is_async'), "Async views are awaited from Django 4.1.")
+class TestAsyncWebService(SyntheticDatacubeTestCase):
+    """Checks requests sent through Django's ASGI handler to the WCS url served by the async view"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestAsyncWebService, cls).setUpClass()
+
+        from django.test import override_settings
+
+        cls.settings = override_settings(WCS_ASYNC_VIEWS=True)
+        cls.settings.enable()
+        cls.reload_urls()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.reload_urls()
+        super(TestAsyncWebService, cls).tearDownClass()
+
+    @staticmethod
+    def reload_urls():
+        """Rebuild the app's url patterns, which pick the view to serve from WCS_ASYNC_VIEWS"""
+        from django.urls import clear_url_caches
+
+        from data_cube_wcs import urls
+
+        importlib.reload(urls)
+        clear_url_caches()
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_async", width=20, height=20, times=2)]
+
+    def request(self, parameters):
+        """Send a GET request through Django's ASGI handler, returning the response status, headers and body"""
+        from django.core.handlers.asgi import ASGIHandler
+
+        return asyncio.run(self.harness.asgi_get(ASGIHandler(), "/wcs/", parameters))
+
+    def test_async_view_is_served(self):
+        from django.urls import resolve
+
+        from data_cube_wcs import views
+
+        self.assertIs(resolve("/wcs/").func.view_class, views.AsyncWebService)
+
+    def test_get_capabilities(self):
+        from data_cube_wcs import catalog
+
+        for cached in (False, True):
+            if not cached:
+                catalog.invalidate()
+            status, headers, body = self.request({'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCapabilities"})
+            self.assertEqual(status, 200)
+            self.assertIn(b"text/xml", headers[b'Content-Type'])
+            self.assertIn(self.product.name.encode(), body)
+
+    def test_get_coverage(self):
+        from rasterio.io import MemoryFile
+
+        status, headers, body = self.request(self.harness.get_coverage_parameters(self.product, bbox_fraction=1.0))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'Content-Type'], b"image/tiff")
+        with MemoryFile(body) as memfile, memfile.open() as src:
+            self.assertEqual((src.width, src.height), (self.product.width, self.product.height))
@@ -0,0 +1,51 @@
+from .base import SyntheticDatacubeTestCase
+
+
+class TestBandPushdown(SyntheticDatacubeTestCase):
+    """Checks that formats only load the bands their processing reads
+
+    Runs the app in-process against the synthetic Data Cube used by the benchmarks, asserting on the measurements
+    each Data Cube load asked for.
+
+    """
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_band_pushdown", width=20, height=20, times=2)]
+
+    def get_loaded_measurements(self, _format, measurements=None):
+        """Make a GetCoverage request, returning the set of measurements its Data Cube loads read
+
+        Loads may be split per band, so only the union of the loaded measurements is meaningful.
+
+        """
+        from django.test import Client
+
+        self.fake_datacube.LOAD_CALLS.clear()
+        parameters = self.harness.get_coverage_parameters(
+            self.product, _format=_format, time_depth=2, measurements=measurements)
+        response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/tiff')
+        loads = [call['measurements'] for call in self.fake_datacube.LOAD_CALLS]
+        self.assertTrue(loads, msg="The request should load data from the Data Cube.")
+        return {band for measurements in loads for band in measurements}
+
+    def test_rgb_loads_rgb_bands(self):
+        self.assertEqual(self.get_loaded_measurements("RGB_GeoTIFF"), {'red', 'green', 'blue'})
+
+    def test_filtered_loads_reflectance_and_qa_bands(self):
+        self.assertEqual(self.get_loaded_measurements("Filtered_GeoTIFF"),
+                         {'red', 'green', 'blue', 'nir', 'swir1', 'swir2', 'pixel_qa'})
+
+    def test_rgb_ignores_other_requested_measurements(self):
+        self.assertEqual(self.get_loaded_measurements("RGB_GeoTIFF", measurements=['nir', 'red']),
+                         {'red', 'green', 'blue'})
+
+    def test_geotiff_loads_requested_measurements(self):
+        self.assertEqual(self.get_loaded_measurements("GeoTIFF", measurements=['nir', 'swir1']), {'nir', 'swir1'})
+
+    def test_geotiff_loads_every_band_by_default(self):
+        self.assertEqual(self.get_loaded_measurements("GeoTIFF"), set(self.product.bands))
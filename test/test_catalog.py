@@ -0,0 +1,178 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestCatalogSnapshotFile(SyntheticDatacubeTestCase):
+    """Checks the memory mapped catalog snapshot file shared between workers"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_catalog", width=10, height=10, times=3)]
+
+    def setUp(self):
+        from django.test import override_settings
+
+        self.snapshot_directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.snapshot_directory.name, "catalog.snapshot")
+        self.settings = override_settings(WCS_CATALOG_SNAPSHOT_PATH=self.path, WCS_CATALOG_CHECK_INTERVAL=0)
+        self.settings.enable()
+        self.reset_caches()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.reset_caches()
+        self.snapshot_directory.cleanup()
+
+    def test_round_trip(self):
+        import numpy as np
+
+        from data_cube_wcs import catalog
+
+        snapshot = catalog.CatalogSnapshot.from_database(version=7)
+        snapshot.write(self.path)
+        mapped = catalog.CatalogSnapshot.from_file(self.path)
+
+        self.assertEqual(mapped.version, 7)
+        self.assertEqual(mapped.identity, catalog._file_identity(path=self.path))
+        self.assertEqual({name: (_format.pk, _format.content_type) for name, _format in mapped.formats.items()},
+                         {name: (_format.pk, _format.content_type) for name, _format in snapshot.formats.items()})
+        self.assertEqual(set(mapped.coverages), set(snapshot.coverages))
+        for name, entry in snapshot.coverages.items():
+            copy = mapped.get_coverage(name)
+            for field in entry.offering._meta.concrete_fields:
+                self.assertEqual(getattr(copy.offering, field.attname), getattr(entry.offering, field.attname),
+                                 msg=field.attname)
+            self.assertEqual(copy.measurements, entry.measurements)
+            self.assertEqual(copy.nodata, entry.nodata)
+            self.assertEqual(copy.formats, entry.formats)
+            self.assertEqual(list(copy.timestamps), list(entry.timestamps))
+            self.assertEqual(len(copy.footprints), len(entry.footprints))
+            np.testing.assert_array_equal(copy.footprints.times, entry.footprints.times)
+            np.testing.assert_array_equal(copy.footprints.bounds, entry.footprints.bounds)
+            for index in range(len(entry.footprints)):
+                self.assertEqual(copy.footprints.get_footprint(index), entry.footprints.get_footprint(index))
+
+        entry = mapped.get_coverage(self.product.name)
+        self.assertEqual(len(entry.timestamps), len(self.product.acquisition_times))
+        self.assertEqual(len(entry.footprints), len(self.product.acquisition_times))
+
+    def test_new_file_is_remapped(self):
+        from data_cube_wcs import catalog
+
+        catalog.CatalogSnapshot.from_database(version=1).write(self.path)
+        snapshot = catalog.get_catalog()
+        self.assertEqual(snapshot.version, 1)
+        self.assertIs(catalog.get_catalog(), snapshot)
+
+        catalog.CatalogSnapshot.from_database(version=2).write(self.path)
+        snapshot = catalog.get_catalog()
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(snapshot.identity, catalog._file_identity(path=self.path))
+        self.assertIsNotNone(snapshot.get_coverage(self.product.name))
+
+    def test_foreign_version_falls_back_to_the_database(self):
+        from data_cube_wcs import catalog
+
+        catalog.CatalogSnapshot.from_database(version=1).write(self.path)
+        with open(self.path, 'r+b') as snapshot_file:
+            snapshot_file.write(b'WCSCAT01')
+        with self.assertRaises(ValueError):
+            catalog.CatalogSnapshot.from_file(self.path)
+
+        snapshot = catalog.get_catalog()
+        self.assertIsNone(snapshot.identity)
+        self.assertEqual(snapshot.version, 0)
+        self.assertIsNotNone(snapshot.get_coverage(self.product.name))
+
+
+class TestFootprintIndex(unittest.TestCase):
+    """Checks the time range and bbox search of the dataset footprints of a coverage"""
+
+    def setUp(self):
+        import numpy as np
+
+        from data_cube_wcs import catalog
+
+        self.times = [datetime(2015, 1, day) for day in (1, 5, 5, 9, 13)]
+        self.index = catalog.FootprintIndex(
+            np.array([catalog.to_timestamp(time) for time in self.times], dtype=np.int64),
+            np.array([(35.0, 0.0, 35.5, 0.5), (35.5, 0.0, 36.0, 0.5), (35.0, 0.5, 35.5, 1.0), (35.0, 0.0, 36.0, 1.0),
+                      (35.4, 0.4, 35.6, 0.6)]), ["uri-{}".format(index) for index in range(5)],
+            ['{{"red": "/data/{}.tif"}}'.format(index) for index in range(5)])
+
+    def search(self, bounds, time_ranges):
+        return list(self.index.search(bounds, time_ranges))
+
+    def test_search(self):
+        everything = [(datetime(2015, 1, 1), datetime(2015, 1, 31))]
+        self.assertEqual(self.search((35.0, 0.0, 36.0, 1.0), everything), [0, 1, 2, 3, 4])
+        self.assertEqual(self.search((35.6, 0.1, 35.9, 0.2), everything), [1, 3])
+        # bboxes that only share an edge intersect
+        self.assertEqual(self.search((35.5, 0.0, 35.5, 0.0), everything), [0, 1, 3])
+        self.assertEqual(self.search((36.5, 0.0, 37.0, 1.0), everything), [])
+
+    def test_time_ranges_are_inclusive(self):
+        bounds = (35.0, 0.0, 36.0, 1.0)
+        self.assertEqual(self.search(bounds, [(datetime(2015, 1, 5), datetime(2015, 1, 9))]), [1, 2, 3])
+        self.assertEqual(self.search(bounds, [(datetime(2015, 1, 6), datetime(2015, 1, 8))]), [])
+        self.assertEqual(self.search(bounds, [(datetime(2015, 1, 13), datetime(2015, 1, 13))]), [4])
+
+    def test_several_time_ranges(self):
+        bounds = (35.0, 0.0, 36.0, 1.0)
+        # overlapping ranges find each footprint once, in time order
+        self.assertEqual(self.search(bounds, [(datetime(2015, 1, 9), datetime(2015, 1, 20)),
+                                              (datetime(2015, 1, 1), datetime(2015, 1, 9))]), [0, 1, 2, 3, 4])
+        self.assertEqual(self.search(bounds, [(datetime(2015, 1, 13), datetime(2015, 1, 20)),
+                                              (datetime(2015, 1, 1), datetime(2015, 1, 2))]), [0, 4])
+        self.assertEqual(self.search(bounds, []), [])
+
+    def test_get_footprint(self):
+        from data_cube_wcs import catalog
+
+        self.assertEqual(self.index.get_footprint(2), {
+            'time': catalog.to_timestamp(self.times[2]),
+            'bounds': (35.0, 0.5, 35.5, 1.0),
+            'uri': "uri-2",
+            'band_paths': {'red': "/data/2.tif"}
+        })
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(len(catalog.FootprintIndex.empty()), 0)
+
+
+class TestGroupTimestamps(unittest.TestCase):
+    """Checks the grouping of acquisitions into the time slices that are fused together"""
+
+    def test_no_grouping(self):
+        from data_cube_wcs import catalog
+
+        self.assertEqual(catalog.group_timestamps([0, 1000, 1000, 5000]), [(0, 0), (1000, 1000), (1000, 1000),
+                                                                          (5000, 5000)])
+        self.assertEqual(catalog.group_timestamps([]), [])
+
+    def test_window(self):
+        from data_cube_wcs import catalog
+
+        # a window runs from a group's first acquisition, so a chain of close acquisitions is still split
+        timestamps = [0, 30000, 60000, 61000, 90000, 200000]
+        self.assertEqual(catalog.group_timestamps(timestamps, 'window', 60),
+                         [(0, 60000), (61000, 90000), (200000, 200000)])
+        self.assertEqual(catalog.group_timestamps(timestamps, 'window', 10),
+                         [(0, 0), (30000, 30000), (60000, 61000), (90000, 90000), (200000, 200000)])
+        self.assertEqual(catalog.group_timestamps(timestamps, 'window', 1000), [(0, 200000)])
+
+    def test_solar_day(self):
+        from data_cube_wcs import catalog
+
+        timestamps = [catalog.to_timestamp(datetime(2015, 1, 1, 22)), catalog.to_timestamp(datetime(2015, 1, 2, 1)),
+                      catalog.to_timestamp(datetime(2015, 1, 2, 23))]
+        self.assertEqual(catalog.group_timestamps(timestamps, 'solar_day', longitude=0),
+                         [(timestamps[0], timestamps[0]), (timestamps[1], timestamps[2])])
+        # three hours ahead of UTC at 45 degrees east
+        self.assertEqual(catalog.group_timestamps(timestamps, 'solar_day', longitude=45),
+                         [(timestamps[0], timestamps[1]), (timestamps[2], timestamps[2])])
@@ -0,0 +1,114 @@
+from datetime import timezone
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestCompositeAccumulators(SyntheticDatacubeTestCase):
+    """Checks that the streaming temporal reductions ignore invalid observations"""
+
+    def test_nan_is_never_valid(self):
+        import numpy as np
+
+        from data_cube_wcs import utils
+
+        scenes = np.array([[1, np.nan, -9999], [3, 2, np.nan], [5, np.nan, np.nan], [7, 4, 1], [9, 6, 3],
+                           [np.nan, np.nan, 5]], dtype=np.float32)[:, None, :]
+        # NaN pixels in float bands are missing too, whatever the nodata value
+        valid = [column[(column != -9999) & ~np.isnan(column)] for column in scenes[:, 0, :].T]
+        for nodata in (-9999, np.nan):
+            for composite, reduce in (('mean', np.mean), ('median', np.median), ('max', np.max)):
+                accumulator = utils.get_accumulator(composite, np.float32, nodata)
+                for scene in np.where(scenes == -9999, nodata, scenes):
+                    accumulator.add(scene)
+                np.testing.assert_allclose(accumulator.result()[0], [reduce(column) for column in valid],
+                                           err_msg="{} {}".format(composite, nodata))
+
+
+class TestMaterializedComposite(SyntheticDatacubeTestCase):
+    """Checks that the latest pixel composite built and updated by the catalog sync matches the mosaic of every scene
+
+    The product's missing pixels are NaN, which is never a valid value of a float band.
+
+    """
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_composite", width=40, height=40, times=3, dtype='float32',
+                                               storage='geotiff')]
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestMaterializedComposite, cls).setUpClass()
+
+        import numpy as np
+        import rasterio
+
+        for path in cls.product.paths.values():
+            with rasterio.open(path, 'r+') as dst:
+                values = dst.read()
+                dst.write(np.where(values == cls.product.nodata, np.nan, values).astype(values.dtype))
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def update_composite(self, times=None):
+        """Update the composite from the footprints of the product's scenes at times (default all)"""
+        from django.test import override_settings
+
+        from data_cube_wcs import catalog, composites, models
+
+        coverage = models.CoverageOffering.objects.get(name=self.product.name)
+        self.fake_datacube.create_coverages([self.product])
+        if times is not None:
+            models.CoverageDatasetFootprint.objects.filter(coverage_offering=coverage).exclude(
+                time__in=[time.replace(tzinfo=timezone.utc) for time in times]).delete()
+        catalog.invalidate()
+        with override_settings(WCS_COMPOSITE_DIR=self.directory.name):
+            return composites.update_composite(coverage)
+
+    def read(self, parameters, from_composite):
+        """Make a GetCoverage request with the composite in place, returning its pixels"""
+        from unittest import mock
+
+        from django.test import Client, override_settings
+        from rasterio.io import MemoryFile
+
+        from data_cube_wcs import composites
+
+        with override_settings(WCS_COMPOSITE_DIR=self.directory.name), \
+                mock.patch.object(composites, 'read_composite', wraps=composites.read_composite) as read_composite:
+            response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(read_composite.called, from_composite)
+        with MemoryFile(response.content) as memfile, memfile.open() as src:
+            return src.read()
+
+    def assert_composite_is_mosaic(self, bbox_fraction):
+        import numpy as np
+
+        mosaic = self.harness.get_coverage_parameters(self.product, bbox_fraction=bbox_fraction,
+                                                      time_depth=len(self.product.acquisition_times))
+        composite = {key: value for key, value in mosaic.items() if key != 'TIME'}
+        np.testing.assert_array_equal(self.read(composite, True), self.read(mosaic, False))
+
+    def test_build(self):
+        self.assertEqual(self.update_composite(), 3)
+        self.assertEqual(self.update_composite(), 0)
+        for bbox_fraction in (1.0, 0.5):
+            self.assert_composite_is_mosaic(bbox_fraction)
+
+    def test_incremental_update(self):
+        self.assertEqual(self.update_composite(self.product.acquisition_times[:2]), 2)
+        self.assertEqual(self.update_composite(), 1)
+        self.assert_composite_is_mosaic(1.0)
+
+    def test_requests_with_time_are_not_read_from_the_composite(self):
+        self.update_composite()
+        self.read(self.harness.get_coverage_parameters(self.product, bbox_fraction=1.0), False)
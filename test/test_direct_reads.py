@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestDirectReads(SyntheticDatacubeTestCase):
+    """Checks that storage units are read directly only when the band to read can be determined"""
+
+    def setUp(self):
+        import numpy as np
+
+        self.directory = tempfile.TemporaryDirectory()
+        # three distinct 4x5 slices
+        self.values = np.arange(3 * 4 * 5, dtype=np.int16).reshape(3, 4, 5)
+
+    def tearDown(self):
+        from data_cube_wcs import raster_io
+
+        raster_io.get_handle_cache().clear()
+        self.directory.cleanup()
+
+    def read(self, band_path, band):
+        """Read the whole storage unit band through raster_io, None if it can't be read directly"""
+        import rasterio
+
+        from data_cube_wcs import raster_io
+
+        source = raster_io.get_band_source(band_path, band)
+        if source is None:
+            return None
+        with rasterio.open(source.path) as src:
+            transform = src.transform
+        return raster_io._read_window(source, band, transform, self.values.shape[1:], "EPSG:4326", -9999)
+
+    def test_stacked_netcdf(self):
+        import numpy as np
+        import xarray as xr
+        from rasterio.crs import CRS
+
+        path = os.path.join(self.directory.name, "stacked.nc")
+        dataset = xr.Dataset({'red': (('time', 'latitude', 'longitude'), self.values, {'grid_mapping': 'crs'})},
+                             coords={'time': np.arange(3), 'latitude': 10 - np.arange(4) - 0.5,
+                                     'longitude': np.arange(5) + 0.5})
+        dataset['crs'] = xr.DataArray(0, attrs={'spatial_ref': CRS.from_epsg(4326).to_wkt()})
+        dataset.to_netcdf(path)
+
+        for part in range(3):
+            np.testing.assert_array_equal(self.read("file://{}#part={}".format(path, part), 'red'), self.values[part])
+        # any of the slices could be meant
+        self.assertIsNone(self.read("file://" + path, 'red'))
+
+    def test_multi_band_geotiff_without_descriptions(self):
+        import numpy as np
+        import rasterio
+        from rasterio.transform import from_origin
+
+        path = os.path.join(self.directory.name, "bands.tif")
+        with rasterio.open(path, 'w', driver='GTiff', width=5, height=4, count=3, dtype='int16', crs='EPSG:4326',
+                           transform=from_origin(0, 10, 1, 1)) as dst:
+            dst.write(self.values)
+
+        np.testing.assert_array_equal(self.read({'path': path, 'layer': 2}, 'green'), self.values[1])
+        np.testing.assert_array_equal(self.read({'path': path, 'band': 3, 'layer': None}, 'blue'), self.values[2])
+        self.assertIsNone(self.read(path, 'green'))
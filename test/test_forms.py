@@ -0,0 +1,65 @@
+from .base import SyntheticDatacubeTestCase
+
+
+class TestGridPlanning(SyntheticDatacubeTestCase):
+    """Checks which native crs GetCoverage requests are planned as windowed reads of the storage grid"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        # a 0.025 degree storage grid
+        return [fake_datacube.SyntheticProduct("ls8_forms", width=40, height=40, times=1)]
+
+    def clean(self, bounds, width, height, **parameters):
+        """Validate a GetCoverage request for bounds, returning its cleaned data"""
+        from data_cube_wcs import forms
+
+        data = {
+            'service': "WCS",
+            'version': "1.0.0",
+            'request': "GetCoverage",
+            'coverage': self.product.name,
+            'crs': "EPSG:4326",
+            'bbox': ",".join(str(value) for value in bounds),
+            'width': width,
+            'height': height,
+            'format': "GeoTIFF"
+        }
+        data.update(parameters)
+        form = forms.GetCoverageForm(data)
+        self.assertTrue(form.is_valid(), msg=form.errors)
+        return form.cleaned_data
+
+    def assert_bounds_equal(self, first, second):
+        for value, expected in zip(first, second):
+            self.assertAlmostEqual(value, expected, places=9)
+
+    def test_aligned_request(self):
+        bounds = (35.25, 0.25, 35.75, 0.75)
+        cleaned_data = self.clean(bounds, 20, 20)
+        self.assert_bounds_equal(cleaned_data['grid_bounds'], bounds)
+        self.assertEqual((cleaned_data['resx'], cleaned_data['resy']), (0.025, -0.025))
+
+    def test_misaligned_requests_are_resampled(self):
+        # half a pixel off the grid, and a resolution other than the storage grid's
+        for bounds, width in (((35.2625, 0.25, 35.7625, 0.75), 20), ((35.25, 0.25, 35.75, 0.75), 10)):
+            cleaned_data = self.clean(bounds, width, 20, snap="true")
+            self.assertIsNone(cleaned_data['grid_bounds'], msg=bounds)
+            self.assert_bounds_equal(cleaned_data['response_bounds'], bounds)
+
+    def test_nearly_aligned_request_is_snapped(self):
+        from django.test import override_settings
+
+        # a twentieth of a pixel off the grid
+        bounds, aligned = (35.25125, 0.25125, 35.75125, 0.75125), (35.25, 0.25, 35.75, 0.75)
+        self.assertIsNone(self.clean(bounds, 20, 20)['grid_bounds'])
+        self.assertIsNone(self.clean(bounds, 20, 20, snap="false")['grid_bounds'])
+
+        cleaned_data = self.clean(bounds, 20, 20, snap="true")
+        self.assert_bounds_equal(cleaned_data['grid_bounds'], aligned)
+        self.assert_bounds_equal(cleaned_data['response_bounds'], aligned)
+        self.assertEqual((cleaned_data['resx'], cleaned_data['resy']), (0.025, -0.025))
+
+        with override_settings(WCS_GRID_SNAP_TOLERANCE=0.01):
+            self.assertIsNone(self.clean(bounds, 20, 20, snap="true")['grid_bounds'])
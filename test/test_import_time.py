@@ -0,0 +1,25 @@
+import os
+import unittest
+
+from benchmarks import bench_import_time
+
+
+class TestImportTime(unittest.TestCase):
+    """Guards the startup cost of the app - the scientific stack is only imported once a coverage is requested
+
+    The import time budget defaults to 1000ms and can be set for slower machines with WCS_IMPORT_BUDGET_MS.
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.result = bench_import_time.measure_startup()
+
+    def test_no_heavy_imports_at_startup(self):
+        self.assertEqual(self.result['heavy_modules'], [],
+                         msg="Startup should not import the scientific stack - import it where it is used.")
+
+    def test_import_time_budget(self):
+        budget = float(os.environ.get('WCS_IMPORT_BUDGET_MS', 1000))
+        self.assertLessEqual(self.result['total_ms'], budget,
+                             msg="Startup import time regressed: {:.1f}ms".format(self.result['total_ms']))
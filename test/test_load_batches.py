@@ -0,0 +1,28 @@
+from .base import SyntheticDatacubeTestCase
+
+
+class TestLoadBatches(SyntheticDatacubeTestCase):
+    """Checks that GetCoverage only loads the scenes of a discrete TIME list"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_load_batches", width=20, height=20, times=3)]
+
+    def test_discrete_times(self):
+        from django.test import Client, override_settings
+
+        first, skipped, last = self.product.acquisition_times
+        parameters = self.harness.get_coverage_parameters(self.product, "GeoTIFF", bbox_fraction=1.0)
+        parameters['TIME'] = "{},{}".format(first.isoformat(), last.isoformat())
+        for threads in (1, 4):
+            for composite in ({}, {'COMPOSITE': "mean"}):
+                self.fake_datacube.LOAD_CALLS.clear()
+                with override_settings(WCS_LOAD_THREADS=threads, WCS_DIRECT_READS=False):
+                    response = Client().get('/wcs/', dict(parameters, **composite))
+                self.assertEqual(response.status_code, 200)
+                loads = [call['time'] for call in self.fake_datacube.LOAD_CALLS if call['time'] is not None]
+                self.assertTrue(loads)
+                for start, end in loads:
+                    self.assertFalse(start <= skipped <= end, msg="{} threads loaded {}".format(threads, skipped))
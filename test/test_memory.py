@@ -0,0 +1,86 @@
+import signal
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestMemoryBudget(SyntheticDatacubeTestCase):
+    """Checks that requests reserve their predicted memory from the budget of the process and that the watchdog
+    recycles a worker over its resident memory limit
+
+    """
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_memory", width=40, height=40, times=2)]
+
+    def tearDown(self):
+        from data_cube_wcs import memory
+
+        memory.reset()
+
+    def test_reservations_wait_for_the_budget(self):
+        from django.test import override_settings
+
+        from data_cube_wcs import memory, scheduler
+
+        budget = memory.MemoryBudget(100)
+        with override_settings(WCS_MEMORY_WAIT=0.05):
+            with budget.reserve(60):
+                self.assertEqual(budget.reserved, 60)
+                with self.assertRaises(scheduler.SchedulerBusy) as busy:
+                    with budget.reserve(60):
+                        pass
+                self.assertEqual(busy.exception.lane, 'memory')
+                with budget.reserve(40):
+                    self.assertEqual(budget.reserved, 100)
+            # requests over the whole budget run alone
+            with budget.reserve(1000) as reservation:
+                self.assertEqual(reservation.reserved, 100)
+        self.assertEqual(budget.reserved, 0)
+
+    def test_calibration_from_stage_samples(self):
+        import numpy as np
+
+        from data_cube_wcs import memory, profiling
+
+        budget = memory.MemoryBudget(2**40)
+        with budget.reserve(2**20):
+            with profiling.stage('load'):
+                data = np.ones(2**23, dtype=np.uint8)
+            del data
+        self.assertGreater(budget.calibration, 1.0)
+
+    def test_busy_response(self):
+        from django.test import Client, override_settings
+
+        from data_cube_wcs import memory
+
+        with override_settings(WCS_MEMORY_BUDGET=1, WCS_MEMORY_WAIT=0.05, WCS_MEMORY_RETRY_AFTER=3):
+            memory.reset()
+            with memory.get_watchdog().budget.reserve(1):
+                response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], "3")
+            response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+            self.assertEqual(response.status_code, 200)
+
+    def test_watchdog_recycles_worker(self):
+        from django.test import Client, override_settings
+
+        from data_cube_wcs import memory
+
+        received = []
+        handler = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+        try:
+            with override_settings(WCS_MEMORY_RECYCLE_RSS=1, WCS_MEMORY_RECYCLE_SIGNAL=signal.SIGUSR1):
+                memory.reset()
+                response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(received, [signal.SIGUSR1])
+                # a recycled worker doesn't admit any more requests
+                response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+                self.assertEqual(response.status_code, 503)
+        finally:
+            signal.signal(signal.SIGUSR1, handler)
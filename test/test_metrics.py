@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestMetricsDirectory(SyntheticDatacubeTestCase):
+    """Checks the per-process metrics files of a shared WCS_METRICS_DIR"""
+
+    def setUp(self):
+        from data_cube_wcs import metrics
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry = metrics.Registry()
+        self.counter = self.registry.counter('test_total', "Test counter.", ('result',))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_concurrent_flushes(self):
+        def flush():
+            for _ in range(50):
+                self.counter.inc(result='ok')
+                self.registry.flush(self.directory.name)
+
+        threads = [threading.Thread(target=flush) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(os.path.join(self.directory.name, "metrics_{}.json".format(os.getpid()))) as _file:
+            self.assertEqual(json.load(_file)['test_total'], [[["ok"], 200]])
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["metrics_{}.json".format(os.getpid())])
+
+    def test_exited_processes_are_retired(self):
+        from django.test import override_settings
+
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        with open(os.path.join(self.directory.name, "metrics_{}.json".format(exited.pid)), 'w') as _file:
+            json.dump({'test_total': [[["ok"], 5]]}, _file)
+
+        self.counter.inc(2, result='ok')
+        with override_settings(WCS_METRICS_DIR=self.directory.name, WCS_METRICS_FLUSH_INTERVAL=3600):
+            self.assertIn('test_total{result="ok"} 7', self.registry.exposition())
+            self.assertFalse(os.path.exists(os.path.join(self.directory.name, "metrics_{}.json".format(exited.pid))))
+            # the retired values are still counted once the process's file is gone
+            self.assertIn('test_total{result="ok"} 7', self.registry.exposition())
@@ -0,0 +1,126 @@
+import unittest
+from datetime import timedelta
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestFillMosaic(unittest.TestCase):
+    """Checks the newest first filling of a mosaic's nodata pixels"""
+
+    def get_dataset(self, values):
+        import numpy as np
+        import xarray as xr
+
+        values = np.array(values, dtype='float32')
+        return xr.Dataset({'red': (('time', 'y', 'x'), values)},
+                          coords={'time': np.arange(len(values)), 'y': [0], 'x': np.arange(values.shape[2])})
+
+    def test_newest_valid_pixel_first(self):
+        import numpy as np
+
+        from data_cube_wcs import utils
+
+        dataset = self.get_dataset([[[1, 2, 3, 4]], [[5, -9999, 7, np.nan]], [[-9999, -9999, 9, np.nan]]])
+        mosaic, complete = utils.fill_mosaic(None, dataset, [-9999])
+        np.testing.assert_array_equal(mosaic.red.values, [[5, 2, 9, 4]])
+        self.assertTrue(complete)
+        # the dataset is left alone unless the mosaic may take over its buffers
+        self.assertEqual(dataset.red.values[2, 0, 0], -9999)
+
+        mosaic, complete = utils.fill_mosaic(None, dataset.isel(time=[1, 2]), [-9999])
+        np.testing.assert_array_equal(mosaic.red.values, [[5, -9999, 9, np.nan]])
+        self.assertFalse(complete)
+
+        # an existing mosaic is only filled where it has no valid pixels
+        mosaic, complete = utils.fill_mosaic(mosaic, dataset.isel(time=[0]), [-9999])
+        np.testing.assert_array_equal(mosaic.red.values, [[5, 2, 9, 4]])
+        self.assertTrue(complete)
+
+    def test_stops_once_complete(self):
+        from unittest import mock
+
+        from data_cube_wcs import utils
+
+        dataset = self.get_dataset([[[1, -9999]], [[2, 3]], [[4, 5]]])
+        with mock.patch.object(utils, 'get_valid_mask', wraps=utils.get_valid_mask) as get_valid_mask:
+            mosaic, complete = utils.fill_mosaic(None, dataset, [-9999])
+        self.assertTrue(complete)
+        self.assertEqual(mosaic.red.values.tolist(), [[4, 5]])
+        # only the completeness of the newest slice is checked
+        self.assertEqual(get_valid_mask.call_count, 1)
+
+
+class TestMosaicBatches(SyntheticDatacubeTestCase):
+    """Checks that mosaics load their scenes in newest first batches and skip the batches they don't need"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [
+            fake_datacube.SyntheticProduct("ls8_mosaic", width=20, height=20, times=5),
+            fake_datacube.SyntheticProduct("ls8_mosaic_complete", width=20, height=20, times=5, nodata_fraction=0.0),
+            fake_datacube.SyntheticProduct("ls8_mosaic_passes", width=20, height=20, times=3, scenes_per_pass=2,
+                                           group_by='window')
+        ]
+
+    def get_batches(self, product, load_ranges, batch_size):
+        from data_cube_wcs import models, utils
+
+        parameters = {'output_crs': "EPSG:4326", 'longitude': product.extent[0::2], 'latitude': product.extent[1::2]}
+        return utils.get_mosaic_batches(models.CoverageOffering.objects.get(name=product.name), parameters,
+                                        load_ranges, batch_size)
+
+    @staticmethod
+    def get_range(first, last=None):
+        """Get the load time range of the scenes from first to last"""
+        return first - timedelta(seconds=1), (last or first) + timedelta(seconds=1)
+
+    def test_batches(self):
+        times = self.products[0].acquisition_times
+        everything = [self.get_range(times[0], times[-1])]
+        self.assertEqual(self.get_batches(self.products[0], everything, 2),
+                         [[self.get_range(times[4]), self.get_range(times[3])],
+                          [self.get_range(times[2]), self.get_range(times[1])], [self.get_range(times[0])]])
+        self.assertEqual(self.get_batches(self.products[0], everything, 0), [[self.get_range(time)]
+                                                                             for time in reversed(times)])
+        # only the scenes within the load ranges
+        self.assertEqual(self.get_batches(self.products[0], [self.get_range(times[1]), self.get_range(times[3])], 4),
+                         [[self.get_range(times[3]), self.get_range(times[1])]])
+        # ranges without a scene are dropped, unless no range has one - those are loaded whole
+        empty = self.get_range(times[-1] + timedelta(days=1), times[-1] + timedelta(days=2))
+        self.assertEqual(self.get_batches(self.products[0], [empty, self.get_range(times[0])], 2),
+                         [[self.get_range(times[0])]])
+        self.assertEqual(self.get_batches(self.products[0], [empty], 2), [[empty]])
+
+    def test_passes_are_batched_together(self):
+        times = self.products[2].acquisition_times
+        self.assertEqual(self.get_batches(self.products[2], [self.get_range(times[0], times[-1])], 2),
+                         [[self.get_range(times[4], times[5]), self.get_range(times[2], times[3])],
+                          [self.get_range(times[0], times[1])]])
+
+    def get_loaded_batches(self, product):
+        """Request the mosaic of every scene of a product, returning the batches that were loaded"""
+        from unittest import mock
+
+        from django.test import Client, override_settings
+
+        from data_cube_wcs import utils
+
+        parameters = self.harness.get_coverage_parameters(product, bbox_fraction=1.0,
+                                                          time_depth=len(product.acquisition_times))
+        with override_settings(WCS_MOSAIC_BATCH_SIZE=2), \
+                mock.patch.object(utils, 'load_batch', wraps=utils.load_batch) as load_batch:
+            response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        return [call[0][2] for call in load_batch.call_args_list]
+
+    def test_loads_stop_once_complete(self):
+        times = self.products[1].acquisition_times
+        self.assertEqual(self.get_loaded_batches(self.products[1]),
+                         [[self.get_range(times[4]), self.get_range(times[3])]])
+        loaded = set(call['time'] for call in self.fake_datacube.LOAD_CALLS if call['product'] == self.products[1].name)
+        self.assertTrue(loaded <= {self.get_range(times[4]), self.get_range(times[3])}, msg=loaded)
+
+    def test_incomplete_mosaics_load_every_batch(self):
+        self.assertEqual(len(self.get_loaded_batches(self.products[0])), 3)
@@ -0,0 +1,44 @@
+import tracemalloc
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestProfiling(SyntheticDatacubeTestCase):
+    """Checks per-stage query counts and that memory tracing is scoped to single profiled requests"""
+
+    def test_query_counts(self):
+        from django.db import connection
+        from django.test import override_settings
+
+        from data_cube_wcs import profiling
+
+        with override_settings(WCS_PROFILING=True), profiling.profile_request("test") as profile:
+            with profiling.stage('queries'):
+                # well past the 9000 entries the connection's query log keeps
+                with connection.cursor() as cursor:
+                    for _ in range(9100):
+                        cursor.execute("SELECT 1")
+        self.assertEqual(profile.stages[0].queries, 9100)
+
+    def test_memory_tracing(self):
+        from django.test import override_settings
+
+        from data_cube_wcs import profiling
+
+        self.assertFalse(tracemalloc.is_tracing())
+        with override_settings(WCS_PROFILING=True, WCS_PROFILE_MEMORY=True):
+            with profiling.profile_request("first") as first:
+                with profiling.stage('alone'):
+                    buffer = bytearray(2**20)
+                self.assertTrue(tracemalloc.is_tracing())
+                with profiling.stage('overlapping'):
+                    # a concurrent request, whose allocations the peak would include
+                    with profiling.profile_request("second") as second:
+                        with profiling.stage('concurrent'):
+                            pass
+        del buffer
+        # tracing doesn't outlive the traced request
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreaterEqual(first.stages[0].peak_memory, 2**20)
+        self.assertIsNone(first.stages[-1].peak_memory)
+        self.assertIsNone(second.stages[0].peak_memory)
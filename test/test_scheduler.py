@@ -0,0 +1,140 @@
+import threading
+import time
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestScheduler(SyntheticDatacubeTestCase):
+    """Checks that the admission scheduler bounds its lanes, prefers earlier lanes and rejects busy GetCoverage
+    requests with a 503 and a Retry-After header
+
+    """
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_scheduler", width=40, height=40, times=2)]
+
+    def get_scheduler(self, **kwargs):
+        from data_cube_wcs import scheduler
+
+        lanes = [
+            {'name': 'interactive', 'max_cost': 100, 'concurrency': 2, 'queue': 2, 'timeout': 5, 'retry_after': 1},
+            {'name': 'export', 'max_cost': None, 'concurrency': 1, 'queue': 1, 'timeout': 0.1, 'retry_after': 10},
+        ]
+        return scheduler.Scheduler(lanes, **kwargs)
+
+    def test_requests_are_assigned_to_lanes_by_cost(self):
+        active_scheduler = self.get_scheduler()
+        self.assertEqual(active_scheduler.get_lane(100)['name'], 'interactive')
+        self.assertEqual(active_scheduler.get_lane(101)['name'], 'export')
+
+    def test_saturated_lane_rejects_without_blocking_other_lanes(self):
+        from data_cube_wcs import scheduler
+
+        active_scheduler = self.get_scheduler()
+        with active_scheduler.admit(1000):
+            # the export lane is full and its request waits out the lane timeout
+            with self.assertRaises(scheduler.SchedulerBusy) as busy:
+                with active_scheduler.admit(1000):
+                    pass
+            self.assertEqual((busy.exception.lane, busy.exception.retry_after), ('export', 10))
+            with active_scheduler.admit(10) as lane:
+                self.assertEqual(lane['name'], 'interactive')
+
+    def test_freed_slot_goes_to_the_earlier_lane(self):
+        from data_cube_wcs import scheduler
+
+        active_scheduler = self.get_scheduler(max_active=1)
+        admitted = []
+
+        def _request(cost):
+            try:
+                with active_scheduler.admit(cost) as lane:
+                    admitted.append(lane['name'])
+            except scheduler.SchedulerBusy:
+                pass
+
+        with active_scheduler.admit(10):
+            threads = [threading.Thread(target=_request, args=(cost,)) for cost in (1000, 10)]
+            threads[0].start()
+            threads[1].start()
+            while sum(active_scheduler._waiting.values()) < 2:
+                time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted[0], 'interactive')
+
+    def test_client_limit(self):
+        from data_cube_wcs import scheduler
+
+        active_scheduler = self.get_scheduler(client_limit=1)
+        with active_scheduler.admit(10, client="10.0.0.1"):
+            with self.assertRaises(scheduler.SchedulerBusy):
+                with active_scheduler.admit(10, client="10.0.0.1"):
+                    pass
+            with active_scheduler.admit(10, client="10.0.0.2"):
+                pass
+
+    def test_free_slots_go_to_earlier_lanes_first(self):
+        active_scheduler = self.get_scheduler(max_active=2)
+        interactive, export = active_scheduler.lanes
+        # two slots freed up at once while two interactive requests wait for them
+        active_scheduler._waiting['interactive'] = 2
+        self.assertTrue(active_scheduler._can_run(interactive))
+        self.assertFalse(active_scheduler._can_run(export))
+        active_scheduler._waiting['interactive'] = 1
+        self.assertTrue(active_scheduler._can_run(export))
+
+    def test_rejected_clients_are_forgotten(self):
+        from data_cube_wcs import scheduler
+
+        active_scheduler = self.get_scheduler(client_limit=2)
+        with active_scheduler.admit(1000, client="10.0.0.1"):
+            # waits out the export lane's timeout
+            with self.assertRaises(scheduler.SchedulerBusy):
+                with active_scheduler.admit(1000, client="10.0.0.2"):
+                    pass
+            # rejected right away by the full export queue
+            active_scheduler._waiting['export'] = 1
+            with self.assertRaises(scheduler.SchedulerBusy):
+                with active_scheduler.admit(1000, client="10.0.0.3"):
+                    pass
+            active_scheduler._waiting['export'] = 0
+            self.assertEqual(dict(active_scheduler._clients), {"10.0.0.1": 1})
+        self.assertEqual(dict(active_scheduler._clients), {})
+
+    def test_client_from_forwarded_addresses(self):
+        from django.test import RequestFactory, override_settings
+
+        from data_cube_wcs import scheduler
+
+        # the client sent the first address, the proxies in front of the server appended the others
+        request = RequestFactory().get('/wcs/', HTTP_X_FORWARDED_FOR="203.0.113.9, 198.51.100.7, 10.0.0.2")
+        with override_settings(WCS_SCHEDULER_CLIENT_HEADER='HTTP_X_FORWARDED_FOR'):
+            self.assertEqual(scheduler.get_client(request), "10.0.0.2")
+            with override_settings(WCS_SCHEDULER_TRUSTED_PROXIES=2):
+                self.assertEqual(scheduler.get_client(request), "198.51.100.7")
+            with override_settings(WCS_SCHEDULER_TRUSTED_PROXIES=5):
+                self.assertEqual(scheduler.get_client(request), "203.0.113.9")
+        self.assertEqual(scheduler.get_client(request), "127.0.0.1")
+
+    def test_busy_response(self):
+        from django.test import Client, override_settings
+
+        from data_cube_wcs import scheduler
+
+        lanes = [{'name': 'export', 'max_cost': None, 'concurrency': 1, 'queue': 0, 'timeout': 1, 'retry_after': 7}]
+        with override_settings(WCS_SCHEDULER=True, WCS_SCHEDULER_LANES=lanes):
+            scheduler.reset()
+            try:
+                with scheduler.get_scheduler().admit(1):
+                    response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], "7")
+                self.assertIn(b"ServiceException", response.content)
+                response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+                self.assertEqual(response.status_code, 200)
+            finally:
+                scheduler.reset()
@@ -0,0 +1,77 @@
+import json
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestGetStatistics(SyntheticDatacubeTestCase):
+    """Checks the GetStatistics vendor operation against statistics computed from GetCoverage responses"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_statistics", width=50, height=40, times=3)]
+
+    def get_parameters(self, **parameters):
+        get_data = self.harness.get_coverage_parameters(self.product, bbox_fraction=0.8, time_depth=3,
+                                                        measurements=["red", "nir"])
+        del get_data['FORMAT'], get_data['WIDTH'], get_data['HEIGHT']
+        get_data.update(REQUEST="GetStatistics", **parameters)
+        return get_data
+
+    def get_coverage(self, parameters):
+        """Get the bands of a GetCoverage netCDF response for GetStatistics parameters"""
+        import xarray as xr
+        from django.test import Client
+
+        from data_cube_wcs import catalog
+
+        offering = catalog.get_catalog().get_coverage(self.product.name).offering
+        parameters = dict(parameters, REQUEST="GetCoverage", FORMAT="netCDF", RESX=offering.x_resolution,
+                          RESY=offering.y_resolution)
+        response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        return xr.open_dataset(response.content)
+
+    def assert_statistics(self, statistics, values):
+        import numpy as np
+
+        values = values[values != -9999].astype(np.float64)
+        self.assertEqual(statistics['count'], values.size)
+        self.assertAlmostEqual(statistics['mean'], values.mean(), places=6)
+        self.assertAlmostEqual(statistics['std'], values.std(), places=6)
+        self.assertEqual((statistics['min'], statistics['max']), (values.min(), values.max()))
+
+    def test_statistics_of_every_observation(self):
+        import numpy as np
+        from django.test import Client
+
+        parameters = self.get_parameters()
+        response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        document = json.loads(response.content.decode())
+        self.assertEqual(document['scenes'], 3)
+        self.assertEqual(list(document['bands']), ["red", "nir"])
+
+        scenes = [self.get_coverage(dict(parameters, TIME=time.isoformat())) for time in self.product.acquisition_times]
+        for band in ("red", "nir"):
+            self.assert_statistics(document['bands'][band], np.stack([scene[band].values for scene in scenes]))
+
+    def test_statistics_of_composite(self):
+        from django.test import Client
+
+        parameters = self.get_parameters(COMPOSITE="mosaic", FORMAT="XML")
+        response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<Band name="red">', response.content)
+
+        parameters['FORMAT'] = "JSON"
+        document = json.loads(Client().get('/wcs/', parameters).content.decode())
+        mosaic = self.get_coverage(parameters)
+        self.assert_statistics(document['bands']['nir'], mosaic['nir'].values)
+
+    def test_invalid_format(self):
+        from django.test import Client
+
+        response = Client().get('/wcs/', self.get_parameters(FORMAT="GeoTIFF"))
+        self.assertIn(b"InvalidFormat", response.content)
@@ -0,0 +1,137 @@
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from socketserver import ThreadingMixIn
+
+from .base import SyntheticDatacubeTestCase
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTiling(SyntheticDatacubeTestCase):
+    """Checks that split and stitched GetCoverage responses match the responses rendered in one piece
+
+    Tiles are rendered in-process and by a peer WCS served on localhost, both against the synthetic Data Cube used
+    by the benchmarks.
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestTiling, cls).setUpClass()
+
+        from django.core.wsgi import get_wsgi_application
+
+        cls.server = make_server('127.0.0.1', 0, get_wsgi_application(), server_class=_ThreadingWSGIServer,
+                                 handler_class=_QuietHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.peer = "http://127.0.0.1:{}/wcs/".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(TestTiling, cls).tearDownClass()
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_tiling", width=60, height=50, times=3, storage='geotiff'),
+                # uint16 scenes covering the western 40% of the extent
+                fake_datacube.SyntheticProduct("ls8_tiling_partial", width=60, height=50, times=2, dtype='uint16',
+                                               nodata=0, footprint=(35.0, 0.0, 35.4, 1.0), storage='geotiff')]
+
+    def read(self, parameters, **tile_settings):
+        """Make a GetCoverage request with the given tiling settings, returning its pixels and transform"""
+        from django.test import Client, override_settings
+        from rasterio.io import MemoryFile
+
+        with override_settings(**tile_settings):
+            response = Client().get('/wcs/', parameters)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        with MemoryFile(content) as memfile, memfile.open() as src:
+            return src.read(), src.transform
+
+    def assert_tiled_equal(self, parameters, **tile_settings):
+        expected, expected_transform = self.read(parameters)
+        tiled, transform = self.read(parameters, WCS_TILE_MIN_PIXELS=1, WCS_TILE_SIZE=16, **tile_settings)
+        self.assertEqual(tiled.shape, expected.shape)
+        self.assertTrue((tiled == expected).all(), msg="Stitched tiles differ from the untiled response.")
+        self.assertTrue(transform.almost_equals(expected_transform))
+
+    def test_tiles_rendered_in_process(self):
+        self.assert_tiled_equal(self.harness.get_coverage_parameters(self.product, bbox_fraction=0.8, time_depth=2))
+
+    def test_tiles_rendered_by_peer(self):
+        self.assert_tiled_equal(self.harness.get_coverage_parameters(self.product, bbox_fraction=0.8, time_depth=2),
+                                WCS_TILE_PEERS=[self.peer])
+
+    def test_failed_peer_is_logged(self):
+        import socket
+
+        from data_cube_wcs import metrics
+
+        # nothing listens on a port that was bound and closed again
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            dead_peer = "http://127.0.0.1:{}/wcs/".format(unused.getsockname()[1])
+        with self.assertLogs('data_cube_wcs.tiling', 'WARNING') as logs:
+            self.assert_tiled_equal(self.harness.get_coverage_parameters(self.product, bbox_fraction=0.8),
+                                    WCS_TILE_PEERS=[dead_peer])
+        self.assertIn(dead_peer, logs.output[0])
+        self.assertIn('wcs_tile_renders_total{{renderer="{}",result="failed"}}'.format(dead_peer),
+                      metrics.REGISTRY.exposition())
+
+    def test_processed_format(self):
+        self.assert_tiled_equal(self.harness.get_coverage_parameters(
+            self.product, _format="Filtered_GeoTIFF", bbox_fraction=1.0), WCS_TILE_PEERS=[self.peer])
+
+    def test_tiles_outside_the_footprints(self):
+        partial = self.products[1]
+        for composite in ({}, {'COMPOSITE': "mean"}):
+            parameters = self.harness.get_coverage_parameters(partial, bbox_fraction=1.0, time_depth=2)
+            self.assert_tiled_equal(dict(parameters, **composite))
+
+    def test_small_requests_are_not_tiled(self):
+        from django.test import Client, override_settings
+
+        with override_settings(WCS_TILE_MIN_PIXELS=1, WCS_TILE_SIZE=1024):
+            response = Client().get('/wcs/', self.harness.get_coverage_parameters(self.product))
+        self.assertFalse(response.streaming)
+
+    def test_mismatched_tiles_are_rejected(self):
+        from unittest import mock
+
+        from django.test import Client, override_settings
+        from rasterio.io import MemoryFile
+
+        from data_cube_wcs import tiling
+
+        render_tile, rendered = tiling.render_tile, []
+
+        def render_mismatched(parameters):
+            content = render_tile(parameters)
+            rendered.append(parameters)
+            if len(rendered) == 1:
+                return content
+            # later tiles come back as float32 values that don't fit the first tile's integer dtype
+            with MemoryFile(content) as memfile, memfile.open() as src:
+                profile, values = src.profile, src.read().astype('float32') + 0.5
+            with MemoryFile() as memfile:
+                with memfile.open(**dict(profile, dtype='float32')) as dst:
+                    dst.write(values)
+                return memfile.read()
+
+        parameters = self.harness.get_coverage_parameters(self.product, bbox_fraction=0.8, time_depth=1)
+        with override_settings(WCS_TILE_MIN_PIXELS=1, WCS_TILE_SIZE=16, WCS_TILE_WORKERS=1), \
+                mock.patch.object(tiling, 'render_tile', render_mismatched), self.assertRaises(IOError):
+            Client().get('/wcs/', parameters)
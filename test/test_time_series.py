@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+from unittest import mock
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestGetTimeSeries(SyntheticDatacubeTestCase):
+    """Checks the GetTimeSeries vendor operation against GetCoverage responses for every scene"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_time_series", width=60, height=50, times=4, storage='geotiff')]
+
+    def get(self, **parameters):
+        from django.test import Client
+
+        get_data = {'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetTimeSeries", 'COVERAGE': self.product.name,
+                    'CRS': "EPSG:4326", 'MEASUREMENTS': "red,nir"}
+        get_data.update(parameters)
+        return Client().get('/wcs/', get_data)
+
+    def get_scenes(self, bbox, band):
+        """Get the values of a band within bbox in every scene through GetCoverage"""
+        import numpy as np
+        import xarray as xr
+        from django.test import Client
+
+        scenes = []
+        for time in self.product.acquisition_times:
+            response = Client().get('/wcs/', {
+                'SERVICE': "WCS", 'VERSION': "1.0.0", 'REQUEST': "GetCoverage", 'COVERAGE': self.product.name,
+                'CRS': "EPSG:4326", 'BBOX': ",".join(map(repr, bbox)), 'RESX': self.product.x_resolution,
+                'RESY': self.product.y_resolution, 'FORMAT': "netCDF", 'TIME': time.isoformat()})
+            scenes.append(xr.open_dataset(response.content)[band].values)
+        return np.stack(scenes)
+
+    def test_point(self):
+        from django.test import override_settings
+
+        # the center of the pixel in column 10, row 20
+        x = self.product.extent[0] + 10.5 * self.product.x_resolution
+        y = self.product.extent[3] + 20.5 * self.product.y_resolution
+        expected = self.get_scenes((x - self.product.x_resolution / 2, y + self.product.y_resolution / 2,
+                                    x + self.product.x_resolution / 2, y - self.product.y_resolution / 2), 'nir')
+        expected = [None if value == self.product.nodata else int(value) for value in expected.ravel()]
+
+        for direct_reads in (True, False):
+            with override_settings(WCS_DIRECT_READS=direct_reads):
+                response = self.get(POINT="{!r},{!r}".format(x, y))
+            self.assertEqual(response.status_code, 200)
+            document = json.loads(response.content.decode())
+            self.assertEqual(document['pixels'], 1)
+            self.assertEqual(len(document['series']), 4)
+            self.assertEqual([row['nir'] for row in document['series']], expected)
+
+    def test_polygon_mean_and_csv(self):
+        import numpy as np
+
+        from data_cube_wcs import raster_io
+
+        left, top = self.product.extent[0] + 5 * self.product.x_resolution, self.product.extent[3]
+        right, bottom = left + 4 * self.product.x_resolution, top + 3 * self.product.y_resolution
+        polygon = "{0!r} {1!r},{2!r} {1!r},{2!r} {3!r},{0!r} {3!r}".format(left, top, right, bottom)
+        scenes = self.get_scenes((left, bottom, right, top), 'red').reshape(4, -1).astype(np.float64)
+
+        raster_io.get_block_cache().clear()
+        response = self.get(POLYGON=polygon, FORMAT="CSV")
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.content.decode())))
+        self.assertEqual(rows[0], ["time", "red", "nir"])
+        for row, scene in zip(rows[1:], scenes):
+            valid = scene[scene != self.product.nodata]
+            self.assertAlmostEqual(float(row[1]), valid.mean(), places=6)
+        # repeated drills in the same area are read from the block cache
+        self.assertGreater(len(raster_io.get_block_cache()), 0)
+        with mock.patch.object(raster_io.metrics, 'record_cache', wraps=raster_io.metrics.record_cache) as record_cache:
+            self.assertEqual(self.get(POLYGON=polygon, FORMAT="CSV").content, response.content)
+        lookups = [call[0][1] for call in record_cache.call_args_list if call[0][0] == 'raster_block']
+        self.assertTrue(lookups)
+        self.assertTrue(all(lookups), msg="The repeated drill should only hit the block cache.")
+
+    def test_polygon_too_large(self):
+        from django.test import override_settings
+
+        polygon = "35.0 1.0,36.0 1.0,36.0 0.0"
+        with override_settings(WCS_DRILL_MAX_PIXELS=100):
+            response = self.get(POLYGON=polygon)
+        self.assertIn(b"InvalidParameterValue", response.content)
+
+    def test_missing_geometry(self):
+        self.assertIn(b"MissingParameterValue", self.get().content)
@@ -0,0 +1,39 @@
+import os
+import sys
+from unittest import mock
+
+from .base import SyntheticDatacubeTestCase
+
+
+class TestWarmup(SyntheticDatacubeTestCase):
+    """Checks where the warmup runs and that it warms the documents requests are served from"""
+
+    @classmethod
+    def get_products(cls):
+        from benchmarks import fake_datacube
+
+        return [fake_datacube.SyntheticProduct("ls8_warmup", width=10, height=10, times=1)]
+
+    def test_is_serving(self):
+        from data_cube_wcs import warmup
+
+        self.assertFalse(warmup.is_serving())
+        modules = {name: module for name, module in sys.modules.items() if name != 'pytest'}
+        for argv, environment, serving in ((['manage.py', 'migrate'], {}, False),
+                                           (['manage.py', 'runserver'], {}, False),
+                                           (['manage.py', 'runserver'], {'RUN_MAIN': "true"}, True),
+                                           (['/usr/bin/gunicorn', 'project.wsgi'], {}, True)):
+            with mock.patch.object(sys, 'argv', argv), mock.patch.dict(sys.modules, modules, clear=True), \
+                    mock.patch.dict(os.environ, environment):
+                self.assertEqual(warmup.is_serving(), serving, msg=argv)
+
+    def test_capabilities_are_cached_at_the_served_url(self):
+        from django.test import RequestFactory
+
+        from data_cube_wcs import catalog, views, warmup
+
+        catalog.invalidate()
+        self.assertIn('capabilities', warmup.run(['capabilities']))
+        request = RequestFactory(SERVER_NAME='localhost').get('/wcs/', {'service': "WCS", 'version': "1.0.0",
+                                                                         'request': "GetCapabilities"})
+        self.assertIsNotNone(catalog.get_catalog().get_document(views.get_capabilities_key(request, None)))